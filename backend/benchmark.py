@@ -0,0 +1,231 @@
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import lightgbm as lgb
+import numpy as np
+import pandas as pd
+
+from data_processing import build_final_dataset, peak_rss_mb, process_cities, resource
+from features import RAW_COLUMNS
+from model import QUANTILES, dataset_cache_directory, predict_model, train_model
+from model_registry import ModelRegistry
+from sqlitedb_dataservice import SQLiteDataService
+from storage import CITY_STORAGE_FORMAT, city_store
+
+
+# Synthetic data ends on a fixed day so runs at the same scale are comparable across commits
+SYNTHETIC_END_DATE = "2025-06-20"
+
+STAGES = ["process_cities", "build_final_dataset", "train_model", "predict_model", "set_history"]
+
+
+def generate_synthetic_data(data_directory: str, cities: int, years: int, seed: int = 0):
+    """
+    Writes the inputs of the pipeline for synthetic cities: cities_metadata.csv, the first and full bloom date CSVs and
+    one raw weather table per city covering the given number of years, so the offline stages run without network access.
+    """
+    rng = np.random.default_rng(seed)
+    end = pd.Timestamp(SYNTHETIC_END_DATE)
+    first_year = end.year - years + 1
+    city_names = [f"City{i:03d}" for i in range(cities)]
+    latitudes = rng.uniform(26.0, 45.0, cities)
+
+    os.makedirs(data_directory, exist_ok=True)
+    pd.DataFrame({"City": city_names, "Jp": [f"都市{i}" for i in range(cities)], "latitude": latitudes,
+                  "longitude": rng.uniform(127.0, 145.0, cities)}
+                 ).to_csv(os.path.join(data_directory, "cities_metadata.csv"), index=False)
+
+    # Cherry trees bloom later further north, some years were not observed
+    bloom_years = range(first_year, end.year + 1)
+    for file, delay in [("sakura_first_bloom_dates.csv", 0), ("sakura_full_bloom_dates.csv", 7)]:
+        rows = []
+        for city, latitude in zip(city_names, latitudes):
+            row = {"Site Name": city, "Currently Being Observed": "Yes", "30 Year Average 1981-2010": "", "Notes": ""}
+            for year in bloom_years:
+                day = int(60 + 2.5 * (latitude - 26.0) + delay + rng.normal(0, 5))
+                missing = rng.random() < 0.05
+                row[str(year)] = "" if missing else (pd.Timestamp(year, 1, 1) + pd.Timedelta(days=day)).strftime("%Y-%m-%d")
+            rows.append(row)
+        pd.DataFrame(rows).to_csv(os.path.join(data_directory, file), index=False)
+
+    # Daily weather at midnight in Japan, in UTC like the Open-Meteo downloads
+    dates = pd.date_range(f"{first_year}-01-01", end, freq="D", tz="UTC") - pd.Timedelta(hours=9)
+    season = -np.cos(2 * np.pi * dates.dayofyear.to_numpy() / 365.25)
+    store = city_store(os.path.join(data_directory, "raw_cities"))
+    for city, latitude in zip(city_names, latitudes):
+        n = len(dates)
+        mean = 30.0 - 0.5 * latitude + 11.0 * season + rng.normal(0, 3, n)
+        df = pd.DataFrame({
+            "date": dates,
+            "temperature_2m_max": mean + rng.uniform(3, 7, n),
+            "temperature_2m_min": mean - rng.uniform(3, 7, n),
+            "rain_sum": np.round(np.clip(rng.normal(2, 5, n), 0, None), 1),
+            "snowfall_sum": np.round(np.clip(rng.normal(-2, 2, n) - mean / 5, 0, None), 2),
+            "temperature_2m_mean": mean,
+            "et0_fao_evapotranspiration": np.clip(rng.normal(2.5, 1.2, n), 0, None),
+            "weather_code": rng.choice([0, 1, 2, 3, 51, 61, 63, 71], n).astype(np.float64),
+        }, columns=["date"] + RAW_COLUMNS)
+        store.write(city, df)
+    os.makedirs(os.path.join(data_directory, "processed_cities"), exist_ok=True)
+
+
+def run_stage(stage: str, data_directory: str, workers: int):
+    """
+    Runs one pipeline stage on the data directory, the stages depend on the outputs of the ones before them.
+    :return: Details of what the stage produced
+    """
+    processed_cities_directory = os.path.join(data_directory, "processed_cities")
+    registry = ModelRegistry(os.path.join(data_directory, "models"))
+
+    if stage == "process_cities":
+        errors = process_cities(data_directory, workers=workers)
+        return {"cities": len(city_store(processed_cities_directory).list_cities()), "errors": len(errors)}
+    if stage == "build_final_dataset":
+        df = build_final_dataset(processed_cities_directory)
+        return {"rows": len(df), "columns": len(df.columns), "memory_mb": round(df.memory_usage().sum() / 2 ** 20, 1)}
+    if stage == "train_model":
+        # Cold start, the binned Dataset is built from the tables instead of the cache. Saving the models is included.
+        shutil.rmtree(dataset_cache_directory(processed_cities_directory), ignore_errors=True)
+        models = train_model(processed_cities_directory)
+        entry = registry.register(models, {"mode": "benchmark"})
+        return {"rows": models[QUANTILES[0]].train_set.num_data(), "trees": entry["num_trees"]}
+    if stage == "predict_model":
+        predictions = predict_model(processed_cities_directory, registry.load())
+        with open(os.path.join(data_directory, "predictions.json"), "w") as f:
+            json.dump({city: [float(pred) for pred in preds] for city, preds in predictions.items()}, f)
+        return {"cities": len(predictions)}
+    if stage == "set_history":
+        SQLiteDataService(os.path.join(data_directory, "heatmap.db")).set_history(data_directory)
+        return {"db_mb": round(os.path.getsize(os.path.join(data_directory, "heatmap.db")) / 2 ** 20, 2)}
+    raise ValueError(f"Unknown stage {stage}")
+
+
+def measure_stage(stage: str, data_directory: str, workers: int):
+    """
+    Runs a stage in this process and measures it, meant to run in a fresh process so the peak memory is the stage's own.
+    """
+    rss_before = peak_rss_mb()
+    times_before = os.times()
+    start = time.perf_counter()
+    details = run_stage(stage, data_directory, workers)
+    wall = time.perf_counter() - start
+    times_after = os.times()
+
+    result = {
+        "stage": stage,
+        "wall_s": round(wall, 3),
+        "cpu_s": round(times_after.user + times_after.system - times_before.user - times_before.system, 3),
+        # Worker processes, e.g. of process_cities
+        "children_cpu_s": round(times_after.children_user + times_after.children_system
+                                - times_before.children_user - times_before.children_system, 3),
+        "peak_rss_mb": peak_rss_mb(),
+        "rss_before_mb": rss_before,
+        "details": details,
+    }
+    if resource is not None:
+        # Largest worker process, in kilobytes on Linux
+        children_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+        result["children_peak_rss_mb"] = round(children_rss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+    return result
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(data_directory: str, cities: int, years: int, workers: int = 1, stages=None, seed: int = 0):
+    """
+    Generates synthetic data in data_directory and runs each stage in its own Python process.
+    :return: Benchmark report with the environment and one measurement per stage
+    """
+    stages = stages or STAGES
+    start = time.perf_counter()
+    generate_synthetic_data(data_directory, cities, years, seed)
+    report = {
+        "commit": git_commit(),
+        "created": datetime.now().isoformat(),
+        "scale": {"cities": cities, "years": years, "seed": seed},
+        "environment": {"python": platform.python_version(), "platform": platform.platform(),
+                        "cpu_count": os.cpu_count(), "pandas": pd.__version__, "numpy": np.__version__,
+                        "lightgbm": lgb.__version__, "storage_format": CITY_STORAGE_FORMAT, "workers": workers},
+        "generate_s": round(time.perf_counter() - start, 3),
+        "stages": [],
+    }
+
+    for stage in stages:
+        print(f"Benchmarking {stage}...")
+        with tempfile.NamedTemporaryFile("r", suffix=".json") as result_file:
+            subprocess.run([sys.executable, os.path.abspath(__file__), "--measure", stage, "--data", data_directory,
+                            "--workers", str(workers), "--result", result_file.name], check=True)
+            result = json.load(result_file)
+        print(f"{stage}: {result['wall_s']:.2f}s wall, {result['cpu_s'] + result['children_cpu_s']:.2f}s CPU, "
+              f"peak RSS {result['peak_rss_mb']} MB")
+        report["stages"].append(result)
+    return report
+
+
+def compare_reports(baseline: dict, report: dict):
+    """
+    Prints the wall time, CPU time and peak memory of each stage relative to a baseline report.
+    """
+    baseline_stages = {stage["stage"]: stage for stage in baseline["stages"]}
+    print(f"Compared with {baseline.get('commit')} at {baseline['scale']}")
+    for stage in report["stages"]:
+        old = baseline_stages.get(stage["stage"])
+        if old is None:
+            continue
+        changes = []
+        for key in ["wall_s", "cpu_s", "peak_rss_mb"]:
+            if old.get(key) and stage.get(key) is not None:
+                changes.append(f"{key} {old[key]} -> {stage[key]} ({stage[key] / old[key] - 1:+.0%})")
+        print(f"{stage['stage']:<20} " + ", ".join(changes))
+
+
+if __name__ == "__main__":
+    # python benchmark.py --cities 50 --years 40 --output benchmark.json [--compare previous.json]
+    parser = argparse.ArgumentParser(description="Benchmark the offline pipeline stages on synthetic city data")
+    parser.add_argument("--cities", type=int, default=20)
+    parser.add_argument("--years", type=int, default=30)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=1, help="Processes of process_cities")
+    parser.add_argument("--stages", nargs="+", choices=STAGES, help="Stages to run, all by default")
+    parser.add_argument("--data", help="Directory for the synthetic data, a temporary directory by default")
+    parser.add_argument("--output", default="benchmark.json")
+    parser.add_argument("--compare", help="Earlier benchmark report to compare with")
+    parser.add_argument("--measure", choices=STAGES, help=argparse.SUPPRESS)
+    parser.add_argument("--result", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        # Child process of run_benchmark
+        stage_result = measure_stage(args.measure, args.data, args.workers)
+        with open(args.result, "w") as f:
+            json.dump(stage_result, f)
+        sys.exit(0)
+
+    data_dir = args.data or tempfile.mkdtemp(prefix="bloomscape-benchmark-")
+    try:
+        benchmark_report = run_benchmark(data_dir, args.cities, args.years, args.workers, args.stages, args.seed)
+    finally:
+        if not args.data:
+            shutil.rmtree(data_dir, ignore_errors=True)
+
+    with open(args.output, "w") as f:
+        json.dump(benchmark_report, f, indent=2)
+    print(f"Wrote {args.output}")
+
+    if args.compare:
+        with open(args.compare, "r") as f:
+            compare_reports(json.load(f), benchmark_report)
@@ -1,5 +1,12 @@
+import json
+import multiprocessing
+import random
+import sys
+import threading
 import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 
+import numpy as np
 import pandas as pd
 import openmeteo_requests
 import requests
@@ -10,13 +17,24 @@ import os
 from bs4 import BeautifulSoup
 from datetime import datetime, timedelta
 import re
+from typing import List
 
 from tqdm import tqdm
 
-from features import FeatureExtractor
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
 
+from features import DataContext, FeatureExtractor, RAW_COLUMNS, load_data_context
+from rate_limiter import RateLimiter, TokenBucket
+from storage import CityStore, city_store
 
-def update_bloom_dates(url: str, bloom_dates_csv: str, metadata_csv: str):
+
+def update_bloom_dates(url: str, bloom_dates_csv: str, jp_to_en: dict):
+    """
+    :param jp_to_en: Japanese to English city names, see DataContext.jp_to_en
+    """
     response = requests.get(url)
     response.encoding = response.apparent_encoding  # Correct Japanese encoding
 
@@ -81,23 +99,6 @@ def update_bloom_dates(url: str, bloom_dates_csv: str, metadata_csv: str):
             result[city][years[year_idx]] = date
             year_idx += 1
 
-    metadata = pd.read_csv(metadata_csv)
-    jp_to_en = {}
-
-    for _, row in metadata.iterrows():
-        jp = row['Jp']
-        en = row['City']
-
-        # Always map full Japanese name → English name
-        jp_clean = jp.strip()
-        jp_to_en[jp_clean] = en
-
-        # If parenthesis present, map inner name → English name too
-        m = re.search(r'[(（](.*?)[)）]', jp)
-        if m:
-            inner_jp = m.group(1).strip()
-            jp_to_en[inner_jp] = en
-
     for city in result:
         g = jp_to_en.get(city, None)
         if g is None:
@@ -121,24 +122,10 @@ def update_bloom_dates(url: str, bloom_dates_csv: str, metadata_csv: str):
     df.to_csv(bloom_dates_csv, index=False)
 
 
-def update_from_live_bloom_dates(url: str, bloom_dates_csv: str, metadata_csv: str,):
-    metadata = pd.read_csv(metadata_csv)
-    jp_to_en = {}
-
-    for _, row in metadata.iterrows():
-        jp = row['Jp']
-        en = row['City']
-
-        # Always map full Japanese name → English name
-        jp_clean = jp.strip()
-        jp_to_en[jp_clean] = en
-
-        # If parenthesis present, map inner name → English name too
-        m = re.search(r'[(（](.*?)[)）]', jp)
-        if m:
-            inner_jp = m.group(1).strip()
-            jp_to_en[inner_jp] = en
-
+def update_from_live_bloom_dates(url: str, bloom_dates_csv: str, jp_to_en: dict):
+    """
+    :param jp_to_en: Japanese to English city names, see DataContext.jp_to_en
+    """
     response = requests.get(url)
     response.encoding = response.apparent_encoding  # Correct Japanese encoding
 
@@ -186,37 +173,87 @@ def update_from_live_bloom_dates(url: str, bloom_dates_csv: str, metadata_csv: s
     df.to_csv(bloom_dates_csv, index=False)
 
 
+OPEN_METEO_ARCHIVE_URL = os.getenv("OPEN_METEO_ARCHIVE_URL", "https://archive-api.open-meteo.com/v1/archive")
+
+# Cities sharing one multi-location request, and how far apart their missing ranges may start to share it
+MAX_LOCATIONS_PER_REQUEST = 50
+MAX_START_DATE_SPREAD = timedelta(days=14)
+
+# Open-Meteo free tier quotas, in API calls
+OPEN_METEO_MINUTELY_LIMIT = float(os.getenv("OPEN_METEO_MINUTELY_LIMIT", 600))
+OPEN_METEO_HOURLY_LIMIT = float(os.getenv("OPEN_METEO_HOURLY_LIMIT", 5000))
+
+# Concurrent batch downloads and retries per batch before it is left for the next run
+INGESTION_WORKERS = int(os.getenv("INGESTION_WORKERS", 4))
+INGESTION_MAX_ATTEMPTS = 5
+INGESTION_BACKOFF_BASE = 5
+INGESTION_BACKOFF_CAP = 120
+# Cities that failed this many runs in a row are only retried once per cooldown instead of on every run
+INGESTION_QUEUE_MAX_ATTEMPTS = 5
+INGESTION_QUEUE_COOLDOWN = timedelta(days=7)
+
+# First day downloaded for a raw table without any dates, at midnight in Japan like the other rows
+RAW_HISTORY_START = pd.Timestamp(os.getenv("RAW_HISTORY_START", "1950-01-01"), tz="Asia/Tokyo").tz_convert("UTC")
+
+_openmeteo_clients = threading.local()
+
+
+def get_openmeteo_client():
+    """
+    Open-Meteo API client with cache and retry on error. Each thread reuses its own client for every request.
+    """
+    client = getattr(_openmeteo_clients, "client", None)
+    if client is None:
+        cache_session = requests_cache.CachedSession('.cache', expire_after=-1)
+        retry_session = retry(cache_session, retries=5, backoff_factor=0.2)
+        client = openmeteo_requests.Client(session=retry_session)
+        _openmeteo_clients.client = client
+    return client
+
+
+def build_openmeteo_rate_limiter():
+    return RateLimiter([TokenBucket(OPEN_METEO_MINUTELY_LIMIT, 60), TokenBucket(OPEN_METEO_HOURLY_LIMIT, 3600)])
+
+
+def openmeteo_request_weight(n_locations: int, start_date, end_date):
+    """
+    API calls counted by Open-Meteo for a request: every location counts, and so do every 2 weeks of data and
+    every 10 variables.
+    """
+    days = (end_date - start_date).days + 1
+    return n_locations * max(1.0, days / 14) * max(1.0, len(RAW_COLUMNS) / 10)
+
+
 def get_meteorological_data(latitude, longitude, start_date, end_date):
-    # Setup the Open-Meteo API client with cache and retry on error
-    cache_session = requests_cache.CachedSession('.cache', expire_after=-1)
-    retry_session = retry(cache_session, retries=5, backoff_factor=0.2)
-    openmeteo = openmeteo_requests.Client(session=retry_session)
+    return get_meteorological_data_batch([latitude], [longitude], start_date, end_date)[0]
 
+
+def get_meteorological_data_batch(latitudes, longitudes, start_date, end_date, url: str = None):
+    """
+    Downloads the daily weather of several locations over the same date range with one request.
+    :param url: Archive API url, defaults to OPEN_METEO_ARCHIVE_URL
+    :return: One daily DataFrame per location, in the order of the given coordinates
+    """
     # Make sure all required weather variables are listed here
     # The order of variables in hourly or daily is important to assign them correctly below
-    url = "https://archive-api.open-meteo.com/v1/archive"
     params = {
-        "latitude": latitude,
-        "longitude": longitude,
+        "latitude": [float(lat) for lat in latitudes],
+        "longitude": [float(lon) for lon in longitudes],
         "start_date": start_date,
         "end_date": end_date,
-        "daily": ["temperature_2m_max", "temperature_2m_min", "rain_sum", "snowfall_sum", "temperature_2m_mean", "et0_fao_evapotranspiration", "weather_code"],
+        "daily": RAW_COLUMNS,
         "timezone": "Asia/Tokyo"
     }
-    responses = openmeteo.weather_api(url, params=params)
+    responses = get_openmeteo_client().weather_api(url or OPEN_METEO_ARCHIVE_URL, params=params)
+    if len(responses) != len(latitudes):
+        raise ValueError(f"Expected {len(latitudes)} locations in response, got {len(responses)}")
+
+    return [daily_response_to_dataframe(response) for response in responses]
 
-    # Process first location. Add a for-loop for multiple locations or weather models
-    response = responses[0]
 
+def daily_response_to_dataframe(response):
     # Process daily data. The order of variables needs to be the same as requested.
     daily = response.Daily()
-    daily_temperature_2m_max = daily.Variables(0).ValuesAsNumpy()
-    daily_temperature_2m_min = daily.Variables(1).ValuesAsNumpy()
-    daily_rain_sum = daily.Variables(2).ValuesAsNumpy()
-    daily_snowfall_sum = daily.Variables(3).ValuesAsNumpy()
-    daily_temperature_2m_mean = daily.Variables(4).ValuesAsNumpy()
-    daily_et0_fao_evapotranspiration = daily.Variables(5).ValuesAsNumpy()
-    daily_weather_code = daily.Variables(6).ValuesAsNumpy()
 
     daily_data = {"date": pd.date_range(
         start = pd.to_datetime(daily.Time(), unit = "s", utc = True),
@@ -224,101 +261,385 @@ def get_meteorological_data(latitude, longitude, start_date, end_date):
         freq = pd.Timedelta(seconds = daily.Interval()),
         inclusive = "left"
     )}
-
-    daily_data["temperature_2m_max"] = daily_temperature_2m_max
-    daily_data["temperature_2m_min"] = daily_temperature_2m_min
-    daily_data["rain_sum"] = daily_rain_sum
-    daily_data["snowfall_sum"] = daily_snowfall_sum
-    daily_data["temperature_2m_mean"] = daily_temperature_2m_mean
-    daily_data["et0_fao_evapotranspiration"] = daily_et0_fao_evapotranspiration
-    daily_data["weather_code"] = daily_weather_code
+    for i, column in enumerate(RAW_COLUMNS):
+        daily_data[column] = daily.Variables(i).ValuesAsNumpy()
 
     daily_dataframe = pd.DataFrame(data = daily_data)
     return daily_dataframe
 
 
-def update_raw_city(city, raw_cities_directory: str, metadata_csv: str):
-    file_path = os.path.join(raw_cities_directory, f"{city}.csv")
+def update_raw_city(city, raw_cities_directory: str, metadata: pd.DataFrame):
+    return update_raw_cities([city], raw_cities_directory, metadata).get(city)
+
+
+def update_raw_cities(cities, raw_cities_directory: str, metadata: pd.DataFrame, queue_path: str = None,
+                      workers: int = INGESTION_WORKERS, rate_limiter: RateLimiter = None):
+    """
+    Downloads the missing days of every stale city. Cities with close start dates share multi-location requests,
+    which run concurrently under the Open-Meteo quotas. A failing batch is retried with jittered backoff without
+    holding back the others, and cities that still fail are kept in the resume queue for the next run. Cities failing
+    INGESTION_QUEUE_MAX_ATTEMPTS runs in a row are skipped until INGESTION_QUEUE_COOLDOWN passed since their last try.
+    :param metadata: City metadata indexed by City, see DataContext.cities_metadata_df
+    :param queue_path: JSON file persisting the cities left to retry, None to not persist them
+    :param workers: Number of batches downloaded concurrently
+    :param rate_limiter: Limiter shared by every request, defaults to the Open-Meteo quotas
+    :return: {city: error message} of the cities that could not be updated
+    """
+    queue = load_ingestion_queue(queue_path)
+
+    # Get the latest date of each city from the store metadata, tables without dates are downloaded in full
+    store = city_store(raw_cities_directory)
+    latest_dates = {}
+    for city in cities:
+        last_date = store.last_date(city)
+        latest_dates[city] = RAW_HISTORY_START if last_date is None else last_date
+
+    stale = [city for city in cities if not is_raw_city_fresh(latest_dates[city])]
+    for city in list(queue):
+        if city not in stale:
+            del queue[city]
+
+    errors = {}
+    for city in [city for city in stale if is_ingestion_cooling_down(queue.get(city))]:
+        entry = queue[city]
+        errors[city] = f"Skipped after {entry['attempts']} failed runs, last error: {entry['error']}"
+        stale.remove(city)
+    if not stale:
+        save_ingestion_queue(queue_path, queue)
+        return errors
+
+    # Batches holding cities left over from the last run go first
+    batches = batch_stale_cities(stale, latest_dates)
+    batches.sort(key=lambda batch: not any(city in queue for city in batch))
+
+    rate_limiter = rate_limiter or build_openmeteo_rate_limiter()
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="ingestion") as executor:
+        futures = {executor.submit(download_raw_batch, batch, raw_cities_directory, metadata, latest_dates,
+                                   rate_limiter): batch for batch in batches}
+        pbar = tqdm(as_completed(futures), total=len(futures), desc="Update raw cities")
+        for future in pbar:
+            batch = futures[future]
+            try:
+                err = future.result()
+            except Exception as e:
+                err = f"{type(e).__name__}: {e}"
+
+            for city in batch:
+                if err is None:
+                    queue.pop(city, None)
+                else:
+                    errors[city] = err
+                    queue[city] = {"attempts": queue.get(city, {}).get("attempts", 0) + 1, "error": err,
+                                   "last_attempt": datetime.now().isoformat()}
+            save_ingestion_queue(queue_path, queue)
+            pbar.set_postfix(failed=len(errors))
+
+    return errors
+
+
+def download_raw_batch(batch, raw_cities_directory: str, metadata, latest_dates, rate_limiter: RateLimiter):
+    """
+    Downloads and appends one batch of cities, retrying with jittered exponential backoff.
+    :return: Error message if the batch could not be downloaded, otherwise None
+    """
+    start_date = min(latest_dates[city] for city in batch)
+    end_date = datetime.now(start_date.tz) - timedelta(days=2)
+    weight = openmeteo_request_weight(len(batch), start_date, end_date)
+
+    downloaded = None
+    error = None
+    for attempt in range(INGESTION_MAX_ATTEMPTS):
+        rate_limiter.acquire(weight)
+        try:
+            downloaded = get_meteorological_data_batch(metadata.loc[batch, "latitude"], metadata.loc[batch, "longitude"],
+                                                       start_date.strftime('%Y-%m-%d'), end_date.strftime("%Y-%m-%d"))
+            break
+        except (OpenMeteoRequestsError, requests.exceptions.RequestException) as e:
+            # Connection errors and timeouts are retried like API errors
+            error = str(e) if isinstance(e, OpenMeteoRequestsError) else f"{type(e).__name__}: {e}"
+            if "Hourly API" in error or "Daily API" in error:
+                # Quota won't come back within this run, leave the batch for the next one
+                return error
+            if attempt + 1 == INGESTION_MAX_ATTEMPTS:
+                break
+
+            backoff = random.uniform(0, min(INGESTION_BACKOFF_CAP, INGESTION_BACKOFF_BASE * 2 ** attempt))
+            if "Minutely API" in error:
+                # Hold back every worker until the minutely quota refills
+                rate_limiter.pause(60 + backoff)
+            time.sleep(backoff)
+
+    if downloaded is None:
+        return error
+
+    store = city_store(raw_cities_directory)
+    for city, downloaded_df in zip(batch, downloaded):
+        append_raw_city(store, city, latest_dates[city], downloaded_df)
+    return None
+
+
+def load_ingestion_queue(queue_path: str):
+    """
+    :return: {city: {"attempts", "error", "last_attempt"}} of the cities left to retry from previous runs
+    """
+    if queue_path is None or not os.path.exists(queue_path):
+        return {}
+    with open(queue_path, "r") as f:
+        return json.load(f)
+
+
+def is_ingestion_cooling_down(entry) -> bool:
+    """
+    :param entry: Resume queue entry of a city, None if it isn't queued
+    :return: Whether the city failed too many runs in a row to be retried before its cooldown passes
+    """
+    if entry is None or entry["attempts"] < INGESTION_QUEUE_MAX_ATTEMPTS:
+        return False
+    return datetime.now() - datetime.fromisoformat(entry["last_attempt"]) < INGESTION_QUEUE_COOLDOWN
 
-    # Get the latest date and also the current date
-    old_df = pd.read_csv(file_path)
-    old_df['date'] = pd.to_datetime(old_df['date'])
-    latest_date = old_df['date'].max()
+
+def save_ingestion_queue(queue_path: str, queue: dict):
+    if queue_path is None:
+        return
+    with open(queue_path + ".tmp", "w") as f:
+        json.dump(queue, f, indent=2)
+    os.replace(queue_path + ".tmp", queue_path)
+
+
+def is_raw_city_fresh(latest_date):
     two_days_ago = datetime.now(latest_date.tz) - timedelta(days=2)
+    return two_days_ago - timedelta(days=1) <= latest_date
+
+
+def batch_stale_cities(cities, latest_dates):
+    """
+    Groups cities whose missing ranges start within MAX_START_DATE_SPREAD of each other into request batches.
+    """
+    batches = []
+    for city in sorted(cities, key=lambda c: (latest_dates[c], c)):
+        if batches and len(batches[-1]) < MAX_LOCATIONS_PER_REQUEST \
+                and latest_dates[city] - latest_dates[batches[-1][0]] <= MAX_START_DATE_SPREAD:
+            batches[-1].append(city)
+        else:
+            batches.append([city])
+    return batches
+
+
+def append_raw_city(store: CityStore, city, latest_date, downloaded_df):
+    """
+    Appends downloaded days to a raw city table. Only the latest stored day is overwritten, earlier days of a batch
+    range that starts before it are dropped, so the raw tables stay append-only for incremental feature building.
+    """
+    downloaded_df = downloaded_df[downloaded_df['date'] >= latest_date]
+    if len(downloaded_df) == 0:
+        return
+    if store.last_date(city) is None:
+        # Missing, empty or date-less table, replaced by the full download
+        store.write(city, downloaded_df.reset_index(drop=True))
+        return
+
+    # The re-downloaded latest day is usually unchanged, then only the new days are appended
+    tail = store.tail(city)
+    if len(tail) == 1 and tail["date"].iloc[0] == downloaded_df["date"].iloc[0] \
+            and np.array_equal(tail[RAW_COLUMNS].iloc[0].to_numpy(dtype=np.float64),
+                               downloaded_df[RAW_COLUMNS].iloc[0].to_numpy(dtype=np.float64), equal_nan=True):
+        store.append(city, downloaded_df.iloc[1:].reset_index(drop=True))
+        return
+
+    old_df = store.read(city)
+
+    # Combine and deduplicate
+    combinedDF = pd.concat([old_df, downloaded_df]).drop_duplicates(subset='date', keep='last')
+    store.write(city, combinedDF.reset_index(drop=True))
+
+
+def process_cities(data_directory: str, incremental: bool = False, workers: int = 1, context: DataContext = None,
+                   cities: List[str] = None):
+    """
+    Builds the static and temporal features of every raw city into processed_cities.
+    :param data_directory: Data directory
+    :param incremental: Only build the rows appended since the last run for cities with a valid feature state,
+                        falling back to a full rebuild of a city when its history changed.
+    :param workers: Number of processes to shard the cities across, 1 processes them in this process
+    :param context: Metadata and bloom dates of the run, loaded from data_directory if None
+    :param cities: Cities to build, every raw city if None
+    :return: {city: error message} of the cities that failed, the other cities are still processed
+    """
+    if cities is None:
+        cities = city_store(os.path.join(data_directory, "raw_cities")).list_cities()
+    context = context or load_data_context(data_directory)
+    errors = {}
+    if not cities:
+        return errors
+
+    if workers <= 1:
+        extractor = FeatureExtractor(data_directory, context)
+        pbar = tqdm(cities, desc="Processing cities")
+        for city in pbar:
+            pbar.set_description(f"{city}: Building features")
+            err = _process_city_safe(extractor, city, incremental)
+            if err is not None:
+                errors[city] = err
+    else:
+        # Spawned workers receive the loaded context once instead of reparsing the CSVs, then take cities one at a time
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                                 initializer=_init_process_worker, initargs=(data_directory, context)) as executor:
+            futures = {executor.submit(_process_worker_city, city, incremental): city for city in cities}
+            pbar = tqdm(as_completed(futures), total=len(futures), desc=f"Processing cities ({workers} workers)")
+            for future in pbar:
+                city = futures[future]
+                err = future.result()
+                if err is not None:
+                    errors[city] = err
+                    pbar.set_postfix(failed=len(errors))
+
+    for city in sorted(errors):
+        print(f"Failed to build features for {city}: {errors[city]}")
+    return errors
 
-    if two_days_ago - timedelta(days=1) <= latest_date:
+
+def process_city(extractor: FeatureExtractor, city: str, incremental: bool = False):
+    if incremental and extend_city(extractor, city):
+        return
+
+    df = extractor.raw_store.read(city)
+
+    extractor.build_static_features(df, city)
+    extractor.build_temporal_features(df)
+
+    extractor.processed_store.write(city, df)
+
+    state = extractor.build_feature_state(df, len(df), extractor.static_fingerprint(city))
+    state["processed_rows"] = len(df)
+    extractor.save_feature_state(city, state)
+
+
+def _process_city_safe(extractor: FeatureExtractor, city: str, incremental: bool):
+    # One bad city file must not abort the whole batch
+    try:
+        process_city(extractor, city, incremental)
         return None
+    except Exception as e:
+        return f"{type(e).__name__}: {e}"
 
-    # Get the longtitude and latitude of the city
-    metadata = pd.read_csv(metadata_csv)
-    metadata.set_index('City', inplace=True)
 
-    lat = metadata.loc[city]["latitude"]
-    lon = metadata.loc[city]["longitude"]
+_worker_extractor = None
 
-    # Get the updated weather data
-    # Retry logic
-    downloadedDF = None
-    MAX_ATTEMPTS = 5
-    for attempt in range(MAX_ATTEMPTS):
-        try:
-            downloadedDF = get_meteorological_data(lat, lon, latest_date.strftime('%Y-%m-%d'), two_days_ago.strftime("%Y-%m-%d"))
-            downloadedDF['date'] = pd.to_datetime(downloadedDF['date'])
-            break
-        except OpenMeteoRequestsError as e:
-            if "Minutely API" in str(e):
-                wait_time = 60 * (attempt + 1)
-                print(
-                    f"Attempt {attempt + 1}/{MAX_ATTEMPTS} | Error occurred... sleeping for {wait_time} seconds and then retrying")
-                print(e)
-                time.sleep(wait_time)
-            else:
-                return str(e)
-        time.sleep(5)
 
-    # Combine and deduplicate
-    combinedDF = pd.concat([old_df, downloadedDF]).drop_duplicates(subset='date', keep='last')
-    combinedDF.to_csv(file_path, index=False)
+def _init_process_worker(data_directory: str, context: DataContext):
+    global _worker_extractor
+    _worker_extractor = FeatureExtractor(data_directory, context)
 
-    return None
 
+def _process_worker_city(city: str, incremental: bool):
+    return _process_city_safe(_worker_extractor, city, incremental)
 
-def process_cities(data_directory: str):
-    extractor = FeatureExtractor(data_directory)
 
-    file_list = os.listdir(extractor.RAW_CITIES_DIRECTORY)
-    pbar = tqdm(file_list, desc="Processing cities")
+def extend_city(extractor: FeatureExtractor, city: str):
+    """
+    Appends the features of the raw rows added since the last run of a city.
+    :return: False if the city has to be rebuilt in full instead
+    """
+    state = extractor.load_feature_state(city)
+    processed_metadata = extractor.processed_store.metadata(city)
+    if state is None or processed_metadata is None:
+        return False
 
-    for file in pbar:
-        city = file.split('.')[0]
-        df = pd.read_csv(os.path.join(extractor.RAW_CITIES_DIRECTORY, file), parse_dates=["date"])
+    # Historical labels or coordinates changed, or processed table was touched since
+    if state["fingerprint"] != extractor.static_fingerprint(city) \
+            or processed_metadata["row_count"] != state.get("processed_rows"):
+        return False
 
-        pbar.set_description(f"{city}: Building static features")
-        extractor.build_static_features(df, city)
+    # Read from the last processed row on. Raw tables are append-only, except that the last row may be re-downloaded.
+    df = extractor.raw_store.read(city, start=state["row_count"] - 1)
+    if len(df) == 0 or df["date"].iloc[0] != pd.Timestamp(state["last_date"]) \
+            or not np.array_equal(df[RAW_COLUMNS].iloc[0].to_numpy(dtype=np.float64), state["raw_tail"], equal_nan=True):
+        return False
 
-        pbar.set_description(f"{city}: Building temporal features")
-        extractor.build_temporal_features(df)
+    df = df.iloc[1:].reset_index(drop=True)
+    if len(df) == 0:
+        return True
 
-        pbar.set_description(f"{city}: Saving")
-        df.to_csv(os.path.join(extractor.PROCESSED_CITIES_DIRECTORY, file), index=False)
+    extractor.build_static_features(df, city)
+    extractor.extend_temporal_features(df, state)
+    extractor.processed_store.append(city, df)
+
+    new_state = extractor.build_feature_state(df, state["row_count"] + len(df), state["fingerprint"], state)
+    new_state["processed_rows"] = state["processed_rows"] + len(df)
+    extractor.save_feature_state(city, new_state)
+    return True
+
+
+FINAL_DATASET_DROPPED_COLUMNS = ["temperature_2m_max", "temperature_2m_min", "rain_sum", "snowfall_sum",
+                                 "temperature_2m_mean", "et0_fao_evapotranspiration", "weather_code", "sunlight_length",
+                                 "total_precipitation"]
 
 
 def build_final_dataset(processed_cities_directory: str):
+    store = city_store(processed_cities_directory)
     dfs = []
-    for file in tqdm(os.listdir(processed_cities_directory), desc="Processing cities"):
-        df = pd.read_csv(os.path.join(processed_cities_directory, file), parse_dates=["date", "date_label"])
-        df.drop(columns=[
-            "temperature_2m_max", "temperature_2m_min", "rain_sum", "snowfall_sum", "temperature_2m_mean",
-            "et0_fao_evapotranspiration", "weather_code", "sunlight_length", "total_precipitation"
-        ], inplace=True, errors='ignore')
-        dfs.append(df)
+    for city in tqdm(store.list_cities(), desc="Processing cities"):
+        # Only the kept columns are read
+        columns = [col for col in store.metadata(city)["columns"] if col not in FINAL_DATASET_DROPPED_COLUMNS]
+        dfs.append(store.read(city, columns=columns))
 
     df_combined = pd.concat(dfs, ignore_index=True)
     return df_combined
 
 
-def date_update_cron_job(data_directory: str):
+def build_training_matrix(processed_cities_directory: str, feature_columns: List[str], label_column: str = "label",
+                          dtype=np.float32):
+    """
+    Memory-bounded assembly of the training set. Labels are read first to size a single preallocated feature matrix,
+    then each city is read with only the feature and label columns and its labelled rows are copied in column by
+    column, so at most one city is held besides the matrix.
+    :param feature_columns: Columns of the processed tables to use as features, in order
+    :param dtype: Dtype of the feature matrix. float32 halves the memory of the float64 tables, but LightGBM then bins
+                  and splits on rounded values, so models trained on it don't reproduce the predictions of models
+                  trained on float64 features exactly.
+    :return: (X, y) with X a DataFrame of feature_columns backed by the matrix, and y the labels
+    """
+    store = city_store(processed_cities_directory)
+    cities = store.list_cities()
+
+    labelled = {}
+    for city in cities:
+        labelled[city] = store.read(city, columns=[label_column])[label_column].notna().to_numpy()
+    row_count = sum(int(mask.sum()) for mask in labelled.values())
+
+    matrix = np.empty((row_count, len(feature_columns)), dtype=dtype)
+    labels = np.empty(row_count, dtype=np.float64)
+    row = 0
+    for city in tqdm(cities, desc="Loading training set"):
+        mask = labelled[city]
+        n_rows = int(mask.sum())
+        if n_rows == 0:
+            continue
+
+        df = store.read(city, columns=feature_columns + [label_column])
+        for i, col in enumerate(feature_columns):
+            matrix[row:row + n_rows, i] = df[col].to_numpy()[mask]
+        labels[row:row + n_rows] = df[label_column].to_numpy()[mask]
+        row += n_rows
+        del df
+
+    return pd.DataFrame(matrix, columns=feature_columns, copy=False), pd.Series(labels, name=label_column)
+
+
+def peak_rss_mb():
+    """
+    :return: Peak resident set size of this process in MB, None where the platform doesn't report it
+    """
+    if resource is None:
+        return None
+    # Linux reports kilobytes, macOS bytes
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
 
+def update_bloom_date_files(data_directory: str, context: DataContext):
+    """
+    Scrapes the JMA first and full bloom dates into the bloom date CSVs of data_directory.
+    """
     now = datetime.now()
     month = now.month
 
@@ -327,32 +648,19 @@ def date_update_cron_job(data_directory: str):
         print("Update Full Historic Bloom Date")
         update_from_live_bloom_dates(url="https://www.data.jma.go.jp/sakura/data/sakura_mankai.html",
                                      bloom_dates_csv=os.path.join(data_directory, "sakura_full_bloom_dates.csv"),
-                                     metadata_csv=os.path.join(data_directory, "cities_metadata.csv"))
+                                     jp_to_en=context.jp_to_en)
 
         print("Update First Historic Bloom Date")
         update_from_live_bloom_dates(url="https://www.data.jma.go.jp/sakura/data/sakura_kaika.html",
                                      bloom_dates_csv=os.path.join(data_directory, "sakura_first_bloom_dates.csv"),
-                                     metadata_csv=os.path.join(data_directory, "cities_metadata.csv"))
+                                     jp_to_en=context.jp_to_en)
     else:
         # Just take the slower-updating historic info in other months
         print("Update Full Historic Bloom Date")
         update_bloom_dates(url="https://www.data.jma.go.jp/sakura/data/sakura004_07.html",
                            bloom_dates_csv=os.path.join(data_directory, "sakura_full_bloom_dates.csv"),
-                           metadata_csv=os.path.join(data_directory, "cities_metadata.csv")
-                           )
+                           jp_to_en=context.jp_to_en)
         print("Update First Historic Bloom Date")
         update_bloom_dates(url="https://www.data.jma.go.jp/sakura/data/sakura003_07.html",
                            bloom_dates_csv=os.path.join(data_directory, "sakura_first_bloom_dates.csv"),
-                           metadata_csv=os.path.join(data_directory, "cities_metadata.csv")
-                           )
-
-    print("Update the weather data for each city")
-    for file in tqdm(os.listdir(os.path.join(data_directory, "raw_cities")), desc="Update raw cities"):
-        city = file.split('.')[0]
-        err = update_raw_city(city, os.path.join(data_directory, "raw_cities"), os.path.join(data_directory, "cities_metadata.csv"))
-        if err is not None:
-            print("Problem with OpenMateo: ", err)
-            break
-
-    print("Building features for cities")
-    process_cities(data_directory)
+                           jp_to_en=context.jp_to_en)
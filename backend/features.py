@@ -1,28 +1,252 @@
+import hashlib
+import json
 import os
+import re
+import threading
 
 import pandas as pd
 import numpy as np
 
+from storage import city_store
+
+
+RAW_COLUMNS = ["temperature_2m_max", "temperature_2m_min", "rain_sum", "snowfall_sum", "temperature_2m_mean",
+               "et0_fao_evapotranspiration", "weather_code"]
+
+# Cumulative temporal features as (output column, group key). Season years start in December of the previous year.
+ACCUMULATED_FEATURES = [
+    ("GDD_accumulation", "season_year"),
+    ("sunlight_length_accumulation", "season_year"),
+    ("frost_days", "calendar_year"),
+    ("non_frost_days", "calendar_year"),
+    ("snow_accumulation", "season_year"),
+    ("et0_fao_evapotranspiration_accumulation", "season_year"),
+    ("temperature_avg_accumulation", "season_year"),
+    ("snow_free_streak", "calendar_year"),
+]
+
+# Trailing window temporal features as (output column, source column, window length)
+WINDOWED_FEATURES = [
+    ("GDD_14day_avg", "GDD", 14),
+    ("GDD_30day_avg", "GDD", 30),
+    ("temperature_2m_mean_14day_avg", "temperature_2m_mean", 14),
+    ("temperature_2m_mean_30day_avg", "temperature_2m_mean", 30),
+    ("et0_fao_evapotranspiration_14day_avg", "et0_fao_evapotranspiration", 14),
+    ("et0_fao_evapotranspiration_30day_avg", "et0_fao_evapotranspiration", 30),
+    ("snowfall_sum_14day_avg", "snowfall_sum", 14),
+    ("rain_sum_14day_avg", "rain_sum", 14),
+]
+WINDOW_SOURCES = list(dict.fromkeys(source for _, source, _ in WINDOWED_FEATURES))
+WINDOW_TAIL_LENGTH = max(window for _, _, window in WINDOWED_FEATURES) - 1
+
+TEMPORAL_COLUMNS = [column for column, _ in ACCUMULATED_FEATURES] + [column for column, _, _ in WINDOWED_FEATURES]
+
+# Bump whenever feature definitions change so persisted states force a full rebuild.
+FEATURE_STATE_VERSION = 2
+
+
+class BloomDates:
+    """
+    Bloom dates of every city as a cities x years matrix of day of year values, so lookups are array indexing.
+    Days are counted from January 1st of the column year, which reconstructs every parsed date exactly.
+    """
+    MISSING = -1
+
+    def __init__(self, city_names, first_year: int, day_of_year: np.ndarray):
+        self.city_names = np.asarray(city_names)
+        self.city_index = {city: i for i, city in enumerate(self.city_names)}
+        self.first_year = first_year
+        self.day_of_year = day_of_year
+
+    @classmethod
+    def from_csv(cls, bloom_dates_csv: str):
+        df = pd.read_csv(bloom_dates_csv, dtype=str)
+        df.set_index('Site Name', inplace=True)
+
+        # Only year columns hold bloom dates
+        year_columns = {col: int(col) for col in df.columns if str(col).strip().isdigit()}
+        if not year_columns:
+            return cls(df.index, 0, np.full((len(df), 0), cls.MISSING, dtype=np.int16))
+        first_year = min(year_columns.values())
+        last_year = max(year_columns.values())
+
+        # Parse every cell at once, unparsable cells become missing
+        values = df[list(year_columns)]
+        parsed = pd.to_datetime(pd.Series(values.to_numpy().ravel()), errors='coerce').to_numpy(dtype='datetime64[D]')
+        parsed = parsed.reshape(values.shape)
+        jan_first = np.array([np.datetime64(f"{year:04d}-01-01") for year in year_columns.values()], dtype='datetime64[D]')
+        days = (parsed - jan_first).astype(np.int64) + 1
+
+        day_of_year = np.full((len(df), last_year - first_year + 1), cls.MISSING, dtype=np.int16)
+        column_index = np.array(list(year_columns.values())) - first_year
+        day_of_year[:, column_index] = np.where(np.isnat(parsed), cls.MISSING, days)
+        return cls(df.index, first_year, day_of_year)
+
+    def __contains__(self, city):
+        return city in self.city_index
+
+    def city_days(self, city: str):
+        """
+        :return: Day of year row of the city indexed by year - first_year, or None if the city has no bloom data
+        """
+        index = self.city_index.get(city)
+        return None if index is None else self.day_of_year[index]
+
+    def days(self, city: str, years):
+        """
+        :return: Day of year of the bloom of the city in each of years, MISSING where unknown
+        """
+        years = np.asarray(years)
+        result = np.full(len(years), self.MISSING, dtype=np.int16)
+        row = self.city_days(city)
+        if row is None:
+            return result
+
+        index = years - self.first_year
+        in_range = (index >= 0) & (index < len(row))
+        result[in_range] = row[index[in_range]]
+        return result
+
+    def dates(self, city: str, years):
+        """
+        :return: Naive UTC datetime64[ns] bloom date of the city in each of years, NaT where unknown
+        """
+        years = np.asarray(years)
+        days = self.days(city, years)
+        jan_first = (years.astype(np.int64) - 1970).astype('datetime64[Y]').astype('datetime64[D]')
+        dates = (jan_first + (days.astype(np.int64) - 1)).astype('datetime64[ns]')
+        dates[days == self.MISSING] = np.datetime64('NaT')
+        return dates
+
+    def observed(self, city: str):
+        """
+        :return: (years, day of year) arrays of every known bloom of the city
+        """
+        row = self.city_days(city)
+        if row is None:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int16)
+
+        known = row != self.MISSING
+        return np.flatnonzero(known) + self.first_year, row[known]
+
+    def get(self, city: str, year: int):
+        """
+        :return: Bloom date of the city in the year as a UTC Timestamp, or None if unknown
+        """
+        date = self.dates(city, [year])[0]
+        return None if np.isnat(date) else pd.Timestamp(date).tz_localize('UTC')
+
+
+class DataContext:
+    """
+    Read-only snapshot of the city metadata and bloom date tables of a data directory. It is loaded once and shared by
+    every stage of a job run, instead of each stage reparsing the CSVs. Use refresh() after a stage rewrote one of them.
+    """
+    SOURCE_FILES = {
+        "metadata": "cities_metadata.csv",
+        "first_bloom_dates": "sakura_first_bloom_dates.csv",
+        "full_bloom_dates": "sakura_full_bloom_dates.csv",
+    }
 
-class FeatureExtractor:
     def __init__(self, data_directory_path: str):
-        self.RAW_CITIES_DIRECTORY = os.path.join(data_directory_path, "raw_cities")
-        self.CLUSTERS_DIRECTORY = os.path.join(data_directory_path, "clusters")
-        self.PROCESSED_CITIES_DIRECTORY = os.path.join(data_directory_path, "processed_cities")
+        self.data_directory = data_directory_path
+        self.signatures = {name: self.file_signature(self.path(name)) for name in self.SOURCE_FILES}
 
         # City mapping
-        self.cities_metadata_df = pd.read_csv(os.path.join(data_directory_path, "cities_metadata.csv"))
+        self.cities_metadata_df = pd.read_csv(self.path("metadata"))
         self.cities_metadata_df.set_index('City', inplace=True)
         self.city_names = self.cities_metadata_df.index.to_numpy()
+        self.jp_to_en = self.build_jp_to_en(self.cities_metadata_df)
+
+        # Builds bloom date matrices for fast lookup based on city and year.
+        self.first_bloom_dates = BloomDates.from_csv(self.path("first_bloom_dates"))
+        self.full_bloom_dates = BloomDates.from_csv(self.path("full_bloom_dates"))
+        for bloom_dates in [self.first_bloom_dates, self.full_bloom_dates]:
+            bloom_dates.day_of_year.flags.writeable = False
+
+    def path(self, name: str):
+        return os.path.join(self.data_directory, self.SOURCE_FILES[name])
+
+    @staticmethod
+    def file_signature(path: str):
+        """
+        :return: (mtime in ns, size, sha1 of the content) of the file
+        """
+        stat = os.stat(path)
+        with open(path, "rb") as f:
+            digest = hashlib.sha1(f.read()).hexdigest()
+        return stat.st_mtime_ns, stat.st_size, digest
+
+    @staticmethod
+    def build_jp_to_en(metadata):
+        jp_to_en = {}
+        for jp, en in zip(metadata['Jp'], metadata.index):
+            # Always map full Japanese name → English name
+            jp_to_en[jp.strip()] = en
+
+            # If parenthesis present, map inner name → English name too
+            m = re.search(r'[(（](.*?)[)）]', jp)
+            if m:
+                jp_to_en[m.group(1).strip()] = en
+        return jp_to_en
+
+    def is_stale(self):
+        """
+        A source file is changed when its mtime or size moved and its content hash differs, so touching a file without
+        changing it keeps the context.
+        """
+        for name, (mtime, size, digest) in self.signatures.items():
+            path = self.path(name)
+            if not os.path.exists(path):
+                return True
+            stat = os.stat(path)
+            if (stat.st_mtime_ns, stat.st_size) == (mtime, size):
+                continue
+            if stat.st_size != size or self.file_signature(path)[2] != digest:
+                return True
+        return False
+
+    def refresh(self):
+        """
+        :return: This context if its source files are unchanged, otherwise a newly loaded one
+        """
+        return DataContext(self.data_directory) if self.is_stale() else self
+
+
+_data_contexts = {}
+_data_contexts_lock = threading.Lock()
+
+
+def load_data_context(data_directory_path: str):
+    """
+    :return: Shared DataContext of the data directory, reloaded only when its source files changed
+    """
+    key = os.path.abspath(data_directory_path)
+    with _data_contexts_lock:
+        context = _data_contexts.get(key)
+        context = DataContext(data_directory_path) if context is None else context.refresh()
+        _data_contexts[key] = context
+    return context
+
+
+class FeatureExtractor:
+    def __init__(self, data_directory_path: str, context: DataContext = None):
+        self.RAW_CITIES_DIRECTORY = os.path.join(data_directory_path, "raw_cities")
+        self.CLUSTERS_DIRECTORY = os.path.join(data_directory_path, "clusters")
+        self.PROCESSED_CITIES_DIRECTORY = os.path.join(data_directory_path, "processed_cities")
+        self.FEATURE_STATE_DIRECTORY = os.path.join(data_directory_path, "feature_state")
+        self.raw_store = city_store(self.RAW_CITIES_DIRECTORY)
+        self.processed_store = city_store(self.PROCESSED_CITIES_DIRECTORY)
 
-        # Builds bloom dictionary for fast lookup based on city and year.
-        self.first_bloom_dict = self.build_bloom_dates_dict(os.path.join(data_directory_path, "sakura_first_bloom_dates.csv"))
-        self.full_bloom_dict = self.build_bloom_dates_dict(os.path.join(data_directory_path, "sakura_full_bloom_dates.csv"))
+        # City metadata and bloom dates are shared with the other stages of the run
+        self.context = context or load_data_context(data_directory_path)
+        self.cities_metadata_df = self.context.cities_metadata_df
+        self.city_names = self.context.city_names
+        self.first_bloom_dates = self.context.first_bloom_dates
+        self.full_bloom_dates = self.context.full_bloom_dates
 
     def build_static_features(self, df, city: str):
         metadata = self.cities_metadata_df.loc[city]
-        first_bloom_dates = self.first_bloom_dict.get(city)
-        full_bloom_dates = self.full_bloom_dict.get(city)
 
         # Static Features
         df["latitude"] = metadata["latitude"]
@@ -37,55 +261,184 @@ class FeatureExtractor:
         df["doy_cos"] = np.cos(2 * np.pi * doy_fraction)
         df["doy_sin"] = np.sin(2 * np.pi * doy_fraction)
 
-        df["sunlight_length"] = df.apply(self.sunlight_length, axis=1, args=(metadata["latitude"],))
+        # Row-wise lookups are done column-wise: bloom dates are indexed by year instead of per-row dict lookups.
+        dates = self.utc_datetime64(df["date"])
+        years = df["date"].dt.year.to_numpy()
+        day_of_year = df["day_of_year"].to_numpy()
+
+        df["sunlight_length"] = self.sunlight_length(day_of_year, metadata["latitude"])
         df["total_precipitation"] = df["rain_sum"] + df["snowfall_sum"]
-        df["current_year"] = df["date"].dt.year
-        df["global_average_temp_increase"] = df.apply(self.global_average_temp_increase, axis=1, args=(metadata["latitude"],))
-        df[['days_since_prev_first_bloom', 'first_bloom_data_available']] = df.apply(self.days_since_last_bloom, axis=1,
-                                                                                     args=(first_bloom_dates,))
-        df[['days_since_prev_full_bloom', 'full_bloom_data_available']] = df.apply(self.days_since_last_bloom, axis=1,
-                                                                                   args=(full_bloom_dates,))
-        df["label"] = df.apply(self.Label, axis=1, args=(full_bloom_dates,))
-        df["date_label"] = df.apply(self.DateLabel, axis=1, args=(full_bloom_dates,))
+        df["current_year"] = years
+        df["global_average_temp_increase"] = self.global_average_temp_increase(years, day_of_year, metadata["latitude"])
+        df['days_since_prev_first_bloom'], df['first_bloom_data_available'] = self.days_since_last_bloom(
+            dates, years, self.first_bloom_dates, city)
+        df['days_since_prev_full_bloom'], df['full_bloom_data_available'] = self.days_since_last_bloom(
+            dates, years, self.full_bloom_dates, city)
+        date_label = self.DateLabel(dates, years, self.full_bloom_dates, city)
+        df["label"] = self.Label(date_label)
+        df["date_label"] = pd.DatetimeIndex(date_label).tz_localize('UTC')
 
     def build_temporal_features(self, df):
         # Temporal Features
-        self.GDD_accumulation(df)
-        self.sunlight_length_accumulation(df)
-        self.frostdays_accumulation(df)
-        self.non_frostdays_accumulation(df)
-        self.snow_accumulation(df)
-        self.et0_fao_evapotranspiration_accumulation(df)
-        self.temperature_avg_accumulation(df)
-        self.snow_streak(df)
-        self.GDD_window(df)
-        self.temperature_avg_window(df)
-        self.et0_fao_evapotranspiration_window(df)
-        self.snowfall_sum_avg_window(df)
-        self.rain_sum_avg_window(df)
+        features = self.temporal_features(df)
+        for column in TEMPORAL_COLUMNS:
+            df[column] = features[column]
+
+    def extend_temporal_features(self, df, state: dict):
+        """
+        Builds the temporal features of newly appended rows, continuing from the state of the last processed row.
+        Gives the same result as build_temporal_features on the full history, up to float rounding.
+        :param df: New rows only, with static features already built
+        :param state: Feature state of the previously processed rows, see build_feature_state
+        """
+        features = self.temporal_features(df, state)
+        for column in TEMPORAL_COLUMNS:
+            df[column] = features[column]
+
+    def temporal_features(self, df, state: dict = None):
+        """
+        Fused temporal feature engine. Group keys are computed once, the accumulations sharing a key are summed in
+        one grouped pass and the windows sharing a length are averaged in one rolling pass. No temporary columns are
+        added to df, so the caller inserts every finished column without copying the frame.
+        :param df: Rows with static features already built
+        :param state: Feature state to continue from, or None to start from the first row of df
+        :return: {temporal feature column: array aligned with the rows of df}
+        """
+        keys = self.temporal_keys(df["date"])
+        sources = self.accumulation_sources(df)
+        window_sources = df[WINDOW_SOURCES]
+
+        seed_length = 0
+        tail_length = 0
+        if state is not None:
+            # Seed row carries the running totals of the last processed day, so cumulative sums continue
+            seed_length = 1
+            keys = pd.concat([pd.DataFrame({key: [state[key]] for key in keys.columns}), keys], ignore_index=True)
+            sources = {key: pd.concat([pd.DataFrame({col: [state["totals"][col]] for col in block.columns}), block],
+                                      ignore_index=True)
+                       for key, block in sources.items()}
+
+            # Trailing windows see the carried tail of the previous rows first
+            tail = pd.DataFrame(state["window_tail"], columns=WINDOW_SOURCES, dtype=np.float64)
+            tail_length = len(tail)
+            window_sources = pd.concat([tail, window_sources.reset_index(drop=True)], ignore_index=True)
+
+        features = {}
+        for key, block in sources.items():
+            sums = block.groupby(keys[key].to_numpy()).cumsum()
+            features.update({column: sums[column].to_numpy()[seed_length:] for column in block.columns})
+
+        for window in sorted(set(window for _, _, window in WINDOWED_FEATURES)):
+            windowed = [(column, source) for column, source, source_window in WINDOWED_FEATURES if source_window == window]
+            means = window_sources[list(dict.fromkeys(source for _, source in windowed))].rolling(
+                window=window, center=False, min_periods=1).mean()
+            features.update({column: means[source].to_numpy()[tail_length:] for column, source in windowed})
+
+        return features
+
+    def build_feature_state(self, df, row_count: int, fingerprint: str, previous_state: dict = None):
+        """
+        Captures what is needed to extend the features of a city without reprocessing its history.
+        :param df: Processed rows (the full history, or the rows just appended to previous_state)
+        :param row_count: Total number of raw rows processed so far
+        :param fingerprint: Static input fingerprint of the city, see static_fingerprint
+        :param previous_state: State the rows in df were extended from, if any
+        """
+        keys = self.temporal_keys(df["date"])
+        last_keys = keys.iloc[-1]
+
+        totals = {}
+        for column, key in ACCUMULATED_FEATURES:
+            # Cumulative sums skip NaN, so the running total is the last non-NaN value of the current group
+            group = df[column][(keys[key] == last_keys[key]).to_numpy()].dropna()
+            if len(group) > 0:
+                totals[column] = group.iloc[-1].item()
+            elif previous_state is not None and previous_state[key] == last_keys[key]:
+                totals[column] = previous_state["totals"][column]
+            else:
+                totals[column] = 0 if pd.api.types.is_integer_dtype(df[column]) else 0.0
+
+        window_tail = df[WINDOW_SOURCES]
+        if previous_state is not None:
+            window_tail = pd.concat([pd.DataFrame(previous_state["window_tail"], columns=WINDOW_SOURCES, dtype=np.float64),
+                                     window_tail], ignore_index=True)
+        window_tail = window_tail.tail(WINDOW_TAIL_LENGTH)
+
+        last_row = df.iloc[-1]
+        return {
+            "version": FEATURE_STATE_VERSION,
+            "fingerprint": fingerprint,
+            "row_count": row_count,
+            "last_date": last_row["date"].isoformat(),
+            "raw_tail": [float(last_row[col]) for col in RAW_COLUMNS],
+            "season_year": int(last_keys["season_year"]),
+            "calendar_year": int(last_keys["calendar_year"]),
+            "totals": totals,
+            "window_tail": window_tail.to_dict(orient="list"),
+        }
+
+    def static_fingerprint(self, city: str):
+        """
+        Hash of every non-weather input of the static features of a city. Changes to it, such as a new bloom date
+        relabelling historical rows, require a full rebuild of the city.
+        """
+        metadata = self.cities_metadata_df.loc[city]
+        inputs = [
+            float(metadata["latitude"]), float(metadata["longitude"]),
+            [[int(year), int(day)] for year, day in zip(*self.first_bloom_dates.observed(city))],
+            [[int(year), int(day)] for year, day in zip(*self.full_bloom_dates.observed(city))],
+        ]
+        return hashlib.sha1(json.dumps(inputs).encode("utf-8")).hexdigest()
+
+    def load_feature_state(self, city: str):
+        path = os.path.join(self.FEATURE_STATE_DIRECTORY, f"{city}.json")
+        if not os.path.exists(path):
+            return None
+
+        with open(path, "r") as f:
+            state = json.load(f)
+        if state.get("version") != FEATURE_STATE_VERSION:
+            return None
+        return state
+
+    def save_feature_state(self, city: str, state: dict):
+        os.makedirs(self.FEATURE_STATE_DIRECTORY, exist_ok=True)
+        path = os.path.join(self.FEATURE_STATE_DIRECTORY, f"{city}.json")
+
+        # Write then rename, so an interrupted run never leaves a truncated state behind
+        with open(path + ".tmp", "w") as f:
+            json.dump(state, f)
+        os.replace(path + ".tmp", path)
 
     # === Helper Functions ===
 
-    def build_bloom_dates_dict(self, bloom_dates_csv: str = "data/sakura_first_bloom_dates.csv"):
-        df = pd.read_csv(bloom_dates_csv)
-        df.drop(["Currently Being Observed", "30 Year Average 1981-2010", "Notes"], axis=1, inplace=True)
-        df.set_index('Site Name', inplace=True)
-
-        bloom_dict = {}
-        for site_name, row in df.iterrows():
-            bloom_dict[site_name] = {}
-            for col, date_str in row.items():
-                if pd.isna(date_str) or date_str == '':
-                    continue
-
-                try:
-                    year = int(col)
-                    bloom_dict[site_name][year] = pd.to_datetime(date_str).tz_localize('UTC')
-                except Exception:
-                    continue
-        return bloom_dict
-
-
+    @staticmethod
+    def temporal_keys(dates: pd.Series):
+        season_year = dates.dt.year + (dates.dt.month >= 12)  # Start summing from December of previous year
+        return pd.DataFrame({"season_year": season_year.to_numpy(), "calendar_year": dates.dt.year.to_numpy()})
+
+    @staticmethod
+    def accumulation_sources(df):
+        """
+        Per day values summed by each accumulated feature, as one block of columns per group key.
+        :return: {group key: DataFrame with a column per accumulated feature}
+        """
+        season = df[["GDD", "sunlight_length", "snowfall_sum", "et0_fao_evapotranspiration", "temperature_2m_mean"]]
+        season.columns = ["GDD_accumulation", "sunlight_length_accumulation", "snow_accumulation",
+                          "et0_fao_evapotranspiration_accumulation", "temperature_avg_accumulation"]
+
+        min_temperature = df['temperature_2m_min'].to_numpy()
+        snowfall = df['snowfall_sum'].to_numpy()
+        calendar = pd.DataFrame(np.column_stack([min_temperature <= 0, min_temperature > 0, snowfall == 0]).astype(int),
+                                columns=["frost_days", "non_frost_days", "snow_free_streak"], index=df.index)
+        return {"season_year": season, "calendar_year": calendar}
+
+    @staticmethod
+    def utc_datetime64(dates: pd.Series) -> np.ndarray:
+        # Bloom dates are localized to UTC, so compare everything as naive UTC datetime64[ns]
+        if dates.dt.tz is not None:
+            dates = dates.dt.tz_convert('UTC').dt.tz_localize(None)
+        return dates.to_numpy(dtype='datetime64[ns]')
 
     # === STATIC FEATURES: === #
 
@@ -94,8 +447,8 @@ class FeatureExtractor:
         min_temp = row["temperature_2m_min"]
         return max(min(((max_temp + min_temp) / 2) - BASE, MAXIMUM), MINIMUM)
 
-    def sunlight_length(self, row, latitude):
-        doy = row['date'].dayofyear
+    def sunlight_length(self, day_of_year, latitude):
+        doy = day_of_year
 
         # Convert latitude to radians
         lat_rad = np.radians(latitude)
@@ -112,149 +465,44 @@ class FeatureExtractor:
         day_length_normalized = ha / np.pi  # Normally there is a factor of *24 to return day length as a unit of hours
         return day_length_normalized
 
-    def global_average_temp_increase(self, row, latitude):
-        fractional_year = row['date'].year + (row['date'].timetuple().tm_yday / 365.25)
+    def global_average_temp_increase(self, years, day_of_year, latitude):
+        fractional_year = years + (day_of_year / 365.25)
         return 0.02392396 * fractional_year + -0.00447833 * latitude + -47.81821267686717
 
-    def days_since_last_bloom(self, row, bloom_dates):
-        if bloom_dates is None:
-            return pd.Series({'days_since_prev_bloom': -1, 'bloom_data_available': False})
-
-        current_date = row['date']
-        prev_year = current_date.year - 1
-
-        current_bloom_date = bloom_dates.get(current_date.year, pd.NaT)
-        prev_bloom_date = bloom_dates.get(prev_year, pd.NaT)
-        if not pd.isna(current_bloom_date) and current_date >= current_bloom_date:
-            return pd.Series({
-                'days_since_prev_bloom': (current_date - current_bloom_date).days,
-                'bloom_data_available': True
-            })
-        elif not pd.isna(prev_bloom_date) and not pd.isna(current_bloom_date):
-            # We have both previous and current bloom date, but current day is not >= current year bloom date
-            return pd.Series({
-                'days_since_prev_bloom': (current_date - prev_bloom_date).days,
-                'bloom_data_available': True
-            })
-        elif not pd.isna(prev_bloom_date) and pd.isna(current_bloom_date):
-            # We don't have current year's bloom date, only last year's
-            days = (current_date - prev_bloom_date).days
-            if days <= 400:  # Set a cap on how long it'll take for bloom until we assume that data is missing
-                return pd.Series({'days_since_prev_bloom': days, 'bloom_data_available': True})
-            else:
-                return pd.Series({'days_since_prev_bloom': -1, 'bloom_data_available': False})
-
-        # We don't have any bloom date info
-        return pd.Series({'days_since_prev_bloom': -1, 'bloom_data_available': False})
-
-    def Label(self, row, bloom_dates):
-        if bloom_dates is None:
-            return np.nan
-
-        current_date = row['date']
-        next_year = current_date.year + 1
-
-        current_bloom_date = bloom_dates.get(current_date.year, pd.NaT)
-        next_bloom_date = bloom_dates.get(next_year, pd.NaT)
-        if not pd.isna(current_bloom_date) and current_date <= current_bloom_date:
-            # return (current_bloom_date - current_date).days  # Days until next bloom
-            return current_bloom_date.dayofyear
-        elif not pd.isna(next_bloom_date) and not pd.isna(current_bloom_date):
-            # return (next_bloom_date - current_date).days  # Days until next bloom
-            return next_bloom_date.dayofyear
-        return np.nan  # No label exists here
-
-    def DateLabel(self, row, bloom_dates):
-        if bloom_dates is None:
-            return np.nan
-
-        current_date = row['date']
-        next_year = current_date.year + 1
-
-        current_bloom_date = bloom_dates.get(current_date.year, pd.NaT)
-        next_bloom_date = bloom_dates.get(next_year, pd.NaT)
-        if not pd.isna(current_bloom_date) and current_date <= current_bloom_date:
-            return current_bloom_date
-        elif not pd.isna(next_bloom_date) and not pd.isna(current_bloom_date):
-            return next_bloom_date
-        return np.nan  # No label exists here
-
-
-    # === TEMPORAL FEATURES: === #
-
-    def GDD_accumulation(self, df):
-        # Assumes static features 'GDD' are already there
-        df["temp_year"] = df["date"].dt.year
-        df.loc[df["date"].dt.month >= 12, "temp_year"] += 1  # Start summing from December of previous year
-        df["GDD_accumulation"] = df.groupby("temp_year")["GDD"].cumsum()
-        df.drop(columns="temp_year", inplace=True)
-
-    def sunlight_length_accumulation(self, df):
-        # Assumes static feature 'sunlight_length' are already there
-        df["temp_year"] = df["date"].dt.year
-        df.loc[df["date"].dt.month >= 12, "temp_year"] += 1  # Start summing from December of previous year
-        df['sunlight_length_accumulation'] = df.groupby("temp_year")["sunlight_length"].cumsum()
-        df.drop(columns="temp_year", inplace=True)
-
-    def frostdays_accumulation(self, df):
-        df['temp_year'] = df["date"].dt.year
-        df['frost_days'] = (df['temperature_2m_min'] <= 0).astype(int).groupby(df['temp_year']).cumsum()
-        df.drop(columns='temp_year', inplace=True)
-
-    def non_frostdays_accumulation(self, df):
-        df['temp_year'] = df["date"].dt.year
-        df['non_frost_days'] = (df['temperature_2m_min'] > 0).astype(int).groupby(df['temp_year']).cumsum()
-        df.drop(columns='temp_year', inplace=True)
-
-    def snow_accumulation(self, df):
-        # Assumes static feature 'snowfall_sum' are already there
-        df['temp_year'] = df["date"].dt.year
-        df.loc[df["date"].dt.month >= 12, 'temp_year'] += 1  # Start summing from December of previous year
-        df['snow_accumulation'] = df.groupby('temp_year')['snowfall_sum'].cumsum()
-        df.drop(columns='temp_year', inplace=True)
-
-    def rain_accumulation(self, df):
-        # Assumes static feature 'rain_sum' are already there
-        df['temp_year'] = df["date"].dt.year
-        df['rain_accumulation'] = df.groupby('temp_year')['rain_sum'].cumsum()
-        df.drop(columns='temp_year', inplace=True)
-
-    def et0_fao_evapotranspiration_accumulation(self, df):
-        # Assumes static feature 'et0_fao_evapotranspiration' are already there
-        df['temp_year'] = df["date"].dt.year
-        df.loc[df["date"].dt.month >= 12, 'temp_year'] += 1  # Start summing from December of previous year
-        df['et0_fao_evapotranspiration_accumulation'] = df.groupby('temp_year')['et0_fao_evapotranspiration'].cumsum()
-        df.drop(columns='temp_year', inplace=True)
-
-    def temperature_avg_accumulation(self, df):
-        # Assumes static feature 'temperature_2m_mean' are already there
-        df['temp_year'] = df["date"].dt.year
-        df.loc[df["date"].dt.month >= 12, 'temp_year'] += 1  # Start summing from December of previous year
-        df['temperature_avg_accumulation'] = df.groupby('temp_year')['temperature_2m_mean'].cumsum()
-        df.drop(columns='temp_year', inplace=True)
-
-    def snow_streak(self, df):
-        df['temp_year'] = df["date"].dt.year
-        df['snow_free'] = df['snowfall_sum'] == 0
-        df['snow_free_streak'] = df['snow_free'].astype(int).groupby(df["temp_year"]).cumsum()
-        df.drop(columns=["snow_free", "temp_year"], inplace=True)
-
-    def GDD_window(self, df):
-        df['GDD_14day_avg'] = df['GDD'].rolling(window=14, center=False, min_periods=1).mean()
-        df['GDD_30day_avg'] = df['GDD'].rolling(window=30, center=False, min_periods=1).mean()
-
-
-    def temperature_avg_window(self, df):
-        df['temperature_2m_mean_14day_avg'] = df['temperature_2m_mean'].rolling(window=14, center=False, min_periods=1).mean()
-        df['temperature_2m_mean_30day_avg'] = df['temperature_2m_mean'].rolling(window=30, center=False, min_periods=1).mean()
-
-    def et0_fao_evapotranspiration_window(self, df):
-        df['et0_fao_evapotranspiration_14day_avg'] = df['et0_fao_evapotranspiration'].rolling(window=14, center=False, min_periods=1).mean()
-        df['et0_fao_evapotranspiration_30day_avg'] = df['et0_fao_evapotranspiration'].rolling(window=30, center=False, min_periods=1).mean()
-
-    def snowfall_sum_avg_window(self, df):
-        df['snowfall_sum_14day_avg'] = df['snowfall_sum'].rolling(window=14, center=False, min_periods=1).mean()
-
-    def rain_sum_avg_window(self, df):
-        df['rain_sum_14day_avg'] = df['rain_sum'].rolling(window=14, center=False, min_periods=1).mean()
-
+    def days_since_last_bloom(self, dates, years, bloom_dates: BloomDates, city: str):
+        """
+        :return: (days since the previous bloom or -1, whether bloom data was available) arrays
+        """
+        current_bloom_date = bloom_dates.dates(city, years)
+        prev_bloom_date = bloom_dates.dates(city, years - 1)
+        has_current = ~np.isnat(current_bloom_date)
+        has_prev = ~np.isnat(prev_bloom_date)
+
+        # Floor division matches Timedelta.days
+        days_since_current = (dates - np.where(has_current, current_bloom_date, dates)) // np.timedelta64(1, 'D')
+        days_since_prev = (dates - np.where(has_prev, prev_bloom_date, dates)) // np.timedelta64(1, 'D')
+
+        after_current = has_current & (dates >= current_bloom_date)
+        # We have both previous and current bloom date, but current day is not >= current year bloom date
+        # or we don't have current year's bloom date, only last year's. Set a cap on how long it'll take for bloom
+        # until we assume that data is missing.
+        since_prev = ~after_current & has_prev & (has_current | (days_since_prev <= 400))
+
+        days = np.where(after_current, days_since_current, np.where(since_prev, days_since_prev, -1))
+        return days.astype(np.int64), after_current | since_prev
+
+    def Label(self, date_label):
+        # Day of year of the next bloom, NaN where no label exists
+        return pd.DatetimeIndex(date_label).dayofyear.to_numpy(dtype=np.float64)
+
+    def DateLabel(self, dates, years, bloom_dates: BloomDates, city: str):
+        current_bloom_date = bloom_dates.dates(city, years)
+        next_bloom_date = bloom_dates.dates(city, years + 1)
+        has_current = ~np.isnat(current_bloom_date)
+
+        before_current = has_current & (dates <= current_bloom_date)
+        use_next = ~before_current & has_current & ~np.isnat(next_bloom_date)
+
+        # NaT where no label exists here
+        return np.where(before_current, current_bloom_date,
+                        np.where(use_next, next_bloom_date, np.datetime64('NaT')))
@@ -0,0 +1,196 @@
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from model import QUANTILES
+from model_registry import ModelRegistry
+from storage import city_store
+
+
+# LightGBM treats values with an absolute value up to this as zero
+ZERO_THRESHOLD = 1e-35
+
+MISSING_TYPES = {"None": 0, "Zero": 1, "NaN": 2}
+
+
+class CompiledForest:
+    """
+    Tree ensembles of LightGBM regression models flattened into one set of node arrays. A prediction evaluates every
+    split of every model at once with numpy, then walks all trees down together through the chosen children, instead
+    of going through Booster.predict and its per-call overhead.
+    Numerical splits follow LightGBM's rules for missing values: NaN counts as 0 unless the split has a NaN missing
+    type, and values matching the missing type of a split go to its default side.
+    """
+    def __init__(self, boosters):
+        feature, threshold, missing_type, default_left, left, right = [], [], [], [], [], []
+        leaf_value = []
+        roots = []
+        tree_model = []
+
+        def add(node):
+            # Internal nodes get indices from 0, leaves are encoded as ~leaf index
+            if "leaf_value" in node:
+                leaf_value.append(node["leaf_value"])
+                return ~(len(leaf_value) - 1)
+            if node["decision_type"] != "<=":
+                raise ValueError("Categorical splits are not supported")
+
+            index = len(feature)
+            feature.append(node["split_feature"])
+            threshold.append(node["threshold"])
+            missing_type.append(MISSING_TYPES[node["missing_type"]])
+            default_left.append(node["default_left"])
+            left.append(0)
+            right.append(0)
+            left[index] = add(node["left_child"])
+            right[index] = add(node["right_child"])
+            return index
+
+        self.feature_names = None
+        for i, booster in enumerate(boosters):
+            model = booster.dump_model()
+            if model["objective"].split()[0] not in ("quantile", "regression", "regression_l1", "huber"):
+                raise ValueError(f"Unsupported objective {model['objective']}")
+            if self.feature_names is not None and model["feature_names"] != self.feature_names:
+                raise ValueError("Models use different features")
+            self.feature_names = model["feature_names"]
+
+            for tree in model["tree_info"]:
+                roots.append(add(tree["tree_structure"]))
+                tree_model.append(i)
+
+        self.model_count = len(boosters)
+        self.roots = np.array(roots, dtype=np.int64)
+        self.tree_model = np.array(tree_model, dtype=np.int64)
+        self.feature = np.array(feature, dtype=np.int64)
+        self.threshold = np.array(threshold, dtype=np.float64)
+        self.missing_type = np.array(missing_type, dtype=np.int8)
+        self.default_left = np.array(default_left, dtype=bool)
+        self.left = np.array(left, dtype=np.int64)
+        self.right = np.array(right, dtype=np.int64)
+        self.leaf_value = np.array(leaf_value, dtype=np.float64)
+
+    def predict(self, features: np.ndarray) -> np.ndarray:
+        """
+        :param features: (rows, features) matrix, or a single row, in the column order of feature_names. Meant for a
+                         few rows at a time, every split is evaluated for every row.
+        :return: (rows, models) raw predictions
+        """
+        features = np.asarray(features, dtype=np.float64)
+        if features.ndim == 1:
+            features = features[np.newaxis]
+
+        # Side taken at every split
+        value = features[:, self.feature]
+        is_nan = np.isnan(value)
+        value = np.where(is_nan & (self.missing_type != MISSING_TYPES["NaN"]), 0.0, value)
+        is_missing = ((self.missing_type == MISSING_TYPES["Zero"]) & (np.abs(value) <= ZERO_THRESHOLD)) \
+            | ((self.missing_type == MISSING_TYPES["NaN"]) & is_nan)
+        go_left = np.where(is_missing, self.default_left, value <= self.threshold)
+        child = np.where(go_left, self.left, self.right)
+
+        # Walk every tree down one level per step until all reached a leaf
+        nodes = np.broadcast_to(self.roots, (len(features), len(self.roots))).copy()
+        active = nodes >= 0
+        while active.any():
+            nodes = np.where(active, np.take_along_axis(child, np.where(active, nodes, 0), axis=1), nodes)
+            active = nodes >= 0
+
+        leaves = self.leaf_value[~nodes]
+        predictions = np.zeros((len(features), self.model_count))
+        for i in range(self.model_count):
+            predictions[:, i] = leaves[:, self.tree_model == i].sum(axis=1)
+        return predictions
+
+
+class ForecastService:
+    """
+    Serves quantile forecasts from the API process. The latest registered models stay compiled in memory and are
+    reloaded when a new version is registered; the feature tables of recently requested cities are cached.
+    """
+    MAX_CACHED_CITIES = 16
+
+    def __init__(self, data_directory: str):
+        self.registry = ModelRegistry(os.path.join(data_directory, "models"))
+        self.store = city_store(os.path.join(data_directory, "processed_cities"))
+        self.lock = threading.Lock()
+        self.models_key = None
+        self.version = None
+        self.forest = None
+        self.cities = OrderedDict()
+
+    def load_models(self):
+        """
+        :return: (version, CompiledForest of the quantile models in QUANTILES order) of the latest models, None if none
+                 is registered
+        """
+        if not os.path.exists(self.registry.index_path):
+            return None
+        key = os.stat(self.registry.index_path).st_mtime_ns
+        with self.lock:
+            if key != self.models_key:
+                entry = self.registry.latest()
+                models = self.registry.load(entry)
+                self.forest = CompiledForest([models[q] for q in QUANTILES])
+                self.version = entry["version"]
+                self.models_key = key
+            return self.version, self.forest
+
+    def city_features(self, city: str, feature_names):
+        """
+        :return: (dates as int64 ns, feature matrix) of the city, None if the city has no processed table
+        """
+        if not self.store.exists(city):
+            return None
+        key = (self.store.signature(city), tuple(feature_names))
+        with self.lock:
+            cached = self.cities.get(city)
+            if cached is not None and cached[0] == key:
+                self.cities.move_to_end(city)
+                return cached[1]
+
+        df = self.store.read(city, columns=["date"] + list(feature_names))
+        dates = pd.DatetimeIndex(df["date"]).as_unit("ns").asi8
+        order = np.argsort(dates, kind="stable")
+        city_features = dates[order], df[list(feature_names)].to_numpy(dtype=np.float64)[order]
+
+        with self.lock:
+            self.cities[city] = (key, city_features)
+            self.cities.move_to_end(city)
+            while len(self.cities) > self.MAX_CACHED_CITIES:
+                self.cities.popitem(last=False)
+        return city_features
+
+    def forecast(self, city: str, as_of=None):
+        """
+        :param as_of: Date of the feature row to forecast from, the latest row if None. The latest row on or before
+                      the date is used.
+        :return: {"as_of", "model_version", quantile: day of year}, None if the city or the date has no data
+        """
+        models = self.load_models()
+        if models is None:
+            return None
+        version, forest = models
+
+        city_features = self.city_features(city, forest.feature_names)
+        if city_features is None:
+            return None
+        dates, features = city_features
+
+        if as_of is None:
+            row = len(dates) - 1
+        else:
+            # Stored dates are midnight in Japan, expressed in UTC
+            as_of_ns = (pd.Timestamp(as_of).tz_localize("Asia/Tokyo").tz_convert("UTC").value)
+            row = int(np.searchsorted(dates, as_of_ns, side="right")) - 1
+        if row < 0:
+            return None
+
+        predictions = forest.predict(features[row])[0]
+        forecast = {q: float(pred) for q, pred in zip(QUANTILES, predictions)}
+        forecast["as_of"] = pd.Timestamp(dates[row], tz="UTC").tz_convert("Asia/Tokyo").date()
+        forecast["model_version"] = version
+        return forecast
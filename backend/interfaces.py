@@ -1,5 +1,6 @@
 from abc import ABC, abstractmethod
-from typing import List, Optional
+from datetime import date
+from typing import List, Optional, Tuple
 from pydantic import BaseModel
 
 
@@ -26,6 +27,66 @@ class BloomHistory(BaseModel):
     prediction_q90: float
 
 
+class HeatmapCities(BaseModel):
+    names: List[str]
+    jp: List[str]
+    lat: List[float]
+    lng: List[float]
+
+
+class HeatmapYear(BaseModel):
+    year: int
+    # Indexed like HeatmapCities, None where the city has no point that year
+    values: List[Optional[float]]
+    is_prediction: List[bool]
+
+
+# Heatmaps of several years in columns, the cities are sent once instead of with every point
+class HeatmapRange(BaseModel):
+    cities: HeatmapCities
+    years: List[HeatmapYear]
+
+
+def build_heatmap_range(start: int, end: int, rows) -> HeatmapRange:
+    """
+    Builds the columns of a heatmap range.
+
+    Args:
+        start (int): First year of the range.
+        end (int): Last year of the range.
+        rows: (year, city, city_jp, lat, lng, value, is_prediction) of every point, a city's first point of a year wins.
+
+    Returns:
+        HeatmapRange: Every year of the range over the cities with at least one point.
+    """
+    rows = list(rows)
+    cities = sorted({row[1]: row[2:5] for row in rows}.items())
+    index = {city: i for i, (city, _) in enumerate(cities)}
+    years = {year: HeatmapYear(year=year, values=[None] * len(cities), is_prediction=[False] * len(cities))
+             for year in range(start, end + 1)}
+    for year, city, _, _, _, value, is_prediction in rows:
+        heatmap_year = years[year]
+        i = index[city]
+        if heatmap_year.values[i] is None:
+            heatmap_year.values[i] = value
+            heatmap_year.is_prediction[i] = bool(is_prediction)
+
+    return HeatmapRange(
+        cities=HeatmapCities(names=[city for city, _ in cities], jp=[jp for _, (jp, _, _) in cities],
+                             lat=[lat for _, (_, lat, _) in cities], lng=[lng for _, (_, _, lng) in cities]),
+        years=list(years.values()),
+    )
+
+
+class Forecast(BaseModel):
+    city: str
+    as_of: date
+    model_version: int
+    prediction_q10: float
+    prediction_q50: float
+    prediction_q90: float
+
+
 class DataService(ABC):
     """Abstract interface for any data source providing heatmap points."""
 
@@ -59,17 +120,148 @@ class DataService(ABC):
             BloomHistory: History of the city.
         """
 
+    def get_heatmap_range(self, start: int, end: int) -> HeatmapRange:
+        """
+        Retrieve the heatmaps of every year from start to end, by default with one get_heatmap_points per year.
+
+        Args:
+            start (int): First year of the range.
+            end (int): Last year of the range.
+
+        Returns:
+            HeatmapRange: Heatmaps of the range in columns.
+        """
+        return build_heatmap_range(start, end, [
+            (year, point.city, point.city_jp, point.lat, point.lng, point.value, point.is_prediction)
+            for year in range(start, end + 1) for point in self.get_heatmap_points(year)
+        ])
+
+    def get_heatmap_json(self, year: int) -> Optional[Tuple[bytes, str]]:
+        """
+        Pre-rendered JSON of get_heatmap_points, for data services that render their responses when the data changes.
+
+        Returns:
+            Optional[Tuple[bytes, str]]: (JSON body, content hash), None if it has to be built with get_heatmap_points.
+        """
+        return None
+
+    def get_city_history_json(self, city: str) -> Optional[Tuple[bytes, str]]:
+        """
+        Pre-rendered JSON of get_city_history, for data services that render their responses when the data changes.
+
+        Returns:
+            Optional[Tuple[bytes, str]]: (JSON body, content hash), None if it has to be built with get_city_history.
+        """
+        return None
+
+    def get_data_version(self) -> Optional[str]:
+        """
+        Token that changes whenever the served data changes, to invalidate cached responses.
+
+        Returns:
+            Optional[str]: Version token, None if the data service can't tell.
+        """
+        return None
+
+    def get_years(self) -> List[int]:
+        """
+        Returns:
+            List[int]: Years with heatmap points.
+        """
+        return []
+
+    def get_cities(self) -> List[str]:
+        """
+        Returns:
+            List[str]: Cities with a history.
+        """
+        return []
+
     @abstractmethod
-    def set_history(self, data_directory: str):
+    def set_history(self, data_directory: str, context=None):
         """
         Sets the history & metadata of cities
         :param data_directory:
+        :param context: Loaded metadata and bloom dates of data_directory, reused instead of reparsing them
         """
 
     @abstractmethod
-    def set_predictions(self, data_directory: str, predictions):
+    def set_predictions(self, data_directory: str, predictions, context=None):
         """
         Set the predictions from the model
         :param data_directory:
         :param predictions:
-        """
\ No newline at end of file
+        :param context: Loaded metadata and bloom dates of data_directory, reused instead of reparsing them
+        """
+
+    def close(self):
+        """
+        Releases the connections held by the data service.
+        """
+
+
+class AsyncDataService(ABC):
+    """
+    Async variant of DataService for request handlers. Reads are awaited so a slow query never blocks the event loop,
+    writes stay on the synchronous DataService the pipeline runs with.
+    """
+
+    @abstractmethod
+    def sync_service(self) -> DataService:
+        """
+        Returns:
+            DataService: Synchronous data service over the same data, for the pipeline to write through.
+        """
+
+    @abstractmethod
+    async def is_first_time_initialized(self) -> bool:
+        """
+        Flag for if it is first time initialized yet.
+        """
+
+    @abstractmethod
+    async def get_heatmap_points(self, year: int) -> List[HeatmapPoint]:
+        """
+        Retrieve heatmap points for a given year.
+        """
+
+    @abstractmethod
+    async def get_city_history(self, city: str) -> BloomHistory:
+        """
+        Retrieve history of the city.
+        """
+
+    @abstractmethod
+    async def get_heatmap_range(self, start: int, end: int) -> HeatmapRange:
+        """
+        Retrieve the heatmaps of every year from start to end.
+        """
+
+    async def get_heatmap_json(self, year: int) -> Optional[Tuple[bytes, str]]:
+        """
+        Pre-rendered JSON of get_heatmap_points, None if it has to be built with get_heatmap_points.
+        """
+        return None
+
+    async def get_city_history_json(self, city: str) -> Optional[Tuple[bytes, str]]:
+        """
+        Pre-rendered JSON of get_city_history, None if it has to be built with get_city_history.
+        """
+        return None
+
+    async def get_data_version(self) -> Optional[str]:
+        """
+        Token that changes whenever the served data changes, None if the data service can't tell.
+        """
+        return None
+
+    async def get_years(self) -> List[int]:
+        return []
+
+    async def get_cities(self) -> List[str]:
+        return []
+
+    def close(self):
+        """
+        Releases the connections and threads held by the data service.
+        """
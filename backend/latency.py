@@ -0,0 +1,40 @@
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+
+
+class LatencyMonitor:
+    """
+    Collects API request durations while a window is tracked, e.g. to see how serving holds up during training.
+    """
+    def __init__(self):
+        self.windows = []
+        self.lock = threading.Lock()
+
+    def record(self, seconds: float):
+        with self.lock:
+            for window in self.windows:
+                window.append(seconds)
+
+    @contextmanager
+    def track(self):
+        """
+        Yields the list that receives the duration of every request recorded until the block exits.
+        """
+        window = []
+        with self.lock:
+            self.windows.append(window)
+        try:
+            yield window
+        finally:
+            with self.lock:
+                self.windows.remove(window)
+
+    @staticmethod
+    def summary(durations) -> str:
+        if not durations:
+            return "no requests served"
+        ms = np.asarray(durations) * 1000
+        return (f"{len(ms)} requests, p50 {np.percentile(ms, 50):.1f} ms, p95 {np.percentile(ms, 95):.1f} ms, "
+                f"max {ms.max():.1f} ms")
@@ -1,23 +1,24 @@
-from datetime import datetime
+from datetime import date, datetime
 
 import uvicorn
-from fastapi import FastAPI, Query, HTTPException
+from fastapi import FastAPI, Query, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
 from typing import List, Optional
 import os
+import time
 
-from fastapi_cache import FastAPICache
-from fastapi_cache.backends.redis import RedisBackend
-from fastapi_cache.decorator import cache
 import redis.asyncio as redis
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.cron import CronTrigger
 import asyncio
+from concurrent.futures import ThreadPoolExecutor
 
-from data_processing import date_update_cron_job
-from interfaces import HeatmapPoint, DataService, BloomHistory
-from model import train_model, predict_model
-from sqlitedb_dataservice import SQLiteDataService
+from forecast import ForecastService
+from interfaces import HeatmapPoint, HeatmapRange, AsyncDataService, BloomHistory, Forecast
+from latency import LatencyMonitor
+from pipeline import run_daily_job
+from response_cache import ResponseCache, render_blob
+from sqlitedb_dataservice import AsyncSQLiteDataService
 
 
 # Load env vars
@@ -26,12 +27,26 @@ REDIS_PORT = int(os.getenv("REDIS_PORT", 6379))
 API_HOST = os.getenv("API_HOST", "0.0.0.0")
 API_PORT = int(os.getenv("API_PORT", 8000))
 FRONTEND_ORIGINS = [o.strip() for o in os.getenv("FRONTEND_ORIGINS", "http://localhost:5173").split(',') if o]
+FEATURE_WORKERS = int(os.getenv("FEATURE_WORKERS", max(1, (os.cpu_count() or 1) - 1)))
+DB_IO_WORKERS = int(os.getenv("DB_IO_WORKERS", 4))
+MAX_HEATMAP_RANGE_YEARS = 200
 
 
 # Create app
 app = FastAPI(debug=True)
-dataService: DataService = SQLiteDataService(os.path.join("data", "heatmap.db"))  # Select SQLite data service
+# Select SQLite data service
+dataService: AsyncDataService = AsyncSQLiteDataService(os.path.join("data", "heatmap.db"), DB_IO_WORKERS)
+forecastService = ForecastService("data")
+# Own threads for the daily job and the forecasts, so neither can take the threads requests are served from
+pipeline_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="pipeline")
+forecast_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="forecast")
 scheduler = AsyncIOScheduler()
+latency_monitor = LatencyMonitor()
+response_cache = ResponseCache(redis.Redis(host=REDIS_HOST, port=REDIS_PORT, socket_connect_timeout=1, socket_timeout=1))
+# Years and cities of the current data version. Requests for anything else are rejected before the response cache, so
+# arbitrary query values can't fill it.
+known_years: List[int] = []
+known_cities = frozenset()
 
 
 # CORS
@@ -44,14 +59,20 @@ app.add_middleware(
 )
 
 
-# Redis cache init
+# Request latency, reported by the daily job while it trains
+@app.middleware("http")
+async def record_latency(request: Request, call_next):
+    start = time.perf_counter()
+    response = await call_next(request)
+    latency_monitor.record(time.perf_counter() - start)
+    return response
+
+
 @app.on_event("startup")
 async def startup():
-    redis_client = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, decode_responses=True)
-    FastAPICache.init(RedisBackend(redis_client), prefix="api-cache")
-
     # Do initial data check/update if needed
     await first_time_data_service_init()
+    await refresh_response_cache()
 
     # Daily Dec-Jun
     scheduler.add_job(
@@ -72,28 +93,139 @@ async def startup():
 @app.on_event("shutdown")
 async def shutdown():
     scheduler.shutdown()
+    # A running daily job can't be interrupted, don't hold up the shutdown for it
+    pipeline_executor.shutdown(wait=False, cancel_futures=True)
+    forecast_executor.shutdown(wait=True)
+    dataService.close()
+
+
+def json_blob_response(request: Request, blob):
+    """
+    Response of pre-rendered JSON, sent as is without going through the response model.
+    """
+    body, etag = blob
+    headers = {"ETag": f'"{etag}"'}
+    if request.headers.get("if-none-match") == headers["ETag"]:
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+async def load_heatmap(year: int):
+    blob = await dataService.get_heatmap_json(year)
+    if blob is None:
+        blob = render_blob(await dataService.get_heatmap_points(year))
+    return blob
+
+
+async def load_history(city: str):
+    blob = await dataService.get_city_history_json(city)
+    if blob is None:
+        blob = render_blob(await dataService.get_city_history(city))
+    return blob
+
+
+def check_known_year(year: int):
+    if not known_years:
+        raise HTTPException(status_code=404, detail="No bloom data available yet")
+    if not known_years[0] <= year <= known_years[-1]:
+        raise HTTPException(status_code=422, detail=f"year must be between {known_years[0]} and {known_years[-1]}")
+
+
+def check_known_city(city: str):
+    if city not in known_cities:
+        raise HTTPException(status_code=404, detail=f"Unknown city {city}")
+
+
+def heatmap_key(year: int):
+    # Whether a heatmap shows predictions depends on the current year
+    return f"heatmap:{datetime.now().year}:{year}"
 
 
-@cache(expire=3600)
 @app.get("/heatmap", response_model=List[HeatmapPoint])
-def get_heatmap(
+async def get_heatmap(
+    request: Request,
     year: int = Query(..., description="Year to filter bloom points"),
 ):
-    points = dataService.get_heatmap_points(year=year)
-    return points
+    check_known_year(year)
+    blob = await response_cache.get_or_load(heatmap_key(year), lambda: load_heatmap(year))
+    return json_blob_response(request, blob)
+
+
+@app.get("/heatmap/range", response_model=HeatmapRange)
+async def get_heatmap_range(
+    request: Request,
+    start: int = Query(..., description="First year of the range"),
+    end: int = Query(..., description="Last year of the range"),
+):
+    if start > end or end - start >= MAX_HEATMAP_RANGE_YEARS:
+        raise HTTPException(status_code=422,
+                            detail=f"The range must be from start to end of at most {MAX_HEATMAP_RANGE_YEARS} years")
+
+    async def load():
+        return render_blob(await dataService.get_heatmap_range(start, end))
+
+    blob = await response_cache.get_or_load(f"heatmap-range:{datetime.now().year}:{start}:{end}", load)
+    return json_blob_response(request, blob)
 
 
-@cache(expire=3600)
 @app.get("/history", response_model=BloomHistory)
-def get_history(
+async def get_history(
+    request: Request,
     city: str = Query(..., description="City to get historic data"),
 ):
-    history = dataService.get_city_history(city=city)
-    return history
+    check_known_city(city)
+    blob = await response_cache.get_or_load(f"history:{city}", lambda: load_history(city))
+    return json_blob_response(request, blob)
+
+
+@app.get("/cache/stats")
+async def get_cache_stats():
+    return response_cache.summary()
+
+
+@app.get("/forecast", response_model=Forecast)
+async def get_forecast(
+    city: str = Query(..., description="City to forecast"),
+    as_of: Optional[date] = Query(None, description="Forecast from the features of this date, the latest if omitted"),
+):
+    loop = asyncio.get_running_loop()
+    forecast = await loop.run_in_executor(forecast_executor, forecastService.forecast, city, as_of)
+    if forecast is None:
+        raise HTTPException(status_code=404, detail=f"No forecast for {city}")
+    return Forecast(city=city, as_of=forecast["as_of"], model_version=forecast["model_version"],
+                    prediction_q10=forecast[0.1], prediction_q50=forecast[0.5], prediction_q90=forecast[0.9])
+
+
+async def refresh_response_cache():
+    """
+    Switches the response cache to the current data version and, when it changed, takes the known years and cities of
+    the new version and renders every one of them into the cache, so the first requests after a rebuild don't all miss.
+    """
+    global known_years, known_cities
+    if not await dataService.is_first_time_initialized():
+        return
+    version = await dataService.get_data_version()
+    if not response_cache.set_version(version or str(time.time_ns())):
+        return
+
+    start = time.perf_counter()
+    years = await dataService.get_years()
+    cities = await dataService.get_cities()
+    known_years, known_cities = years, frozenset(cities)
+    failed = 0
+    for key, load in [(heatmap_key(year), lambda year=year: load_heatmap(year)) for year in years] + \
+                     [(f"history:{city}", lambda city=city: load_history(city)) for city in cities]:
+        try:
+            await response_cache.get_or_load(key, load)
+        except Exception:
+            # e.g. a city without a prediction, requesting it fails the same way
+            failed += 1
+    print(f"Warmed the response cache for data version {response_cache.version[:12]}: {len(years)} years, "
+          f"{len(cities) - failed} of {len(cities)} cities in {time.perf_counter() - start:.2f}s")
 
 
 async def first_time_data_service_init():
-    if not dataService.is_first_time_initialized():
+    if not await dataService.is_first_time_initialized():
         await safe_daily_job()
 
 
@@ -113,26 +245,17 @@ async def daily_job():
     start = datetime.now()
     print("Start time:", start.strftime("%Y-%m-%d %H:%M:%S"))
 
-    # Run blocking IO in executor to avoid blocking event loop
+    # Run the job on its own thread so it neither blocks the event loop nor occupies the threads requests use
     loop = asyncio.get_running_loop()
-    await loop.run_in_executor(None, date_update_cron_job, DATA_DIR)
-    await loop.run_in_executor(None, train_and_predict, DATA_DIR)
+    report = await loop.run_in_executor(pipeline_executor, run_daily_job, DATA_DIR, dataService.sync_service(),
+                                        FEATURE_WORKERS, False, latency_monitor)
+    print(report)
+    await refresh_response_cache()
 
     duration = datetime.now() - start
     print(f"Cron Job Done! Duration: {duration}")
 
 
-def train_and_predict(data_dir: str):
-    print("Training model...")
-    models = train_model(os.path.join(data_dir, "processed_cities"))
-
-    print("Predicting from model...")
-    predictions = predict_model(os.path.join(data_dir, "processed_cities"), models)
-
-    dataService.set_history(data_dir)
-    dataService.set_predictions(data_dir, predictions)
-
-
 # Run app
 if __name__ == "__main__":
     uvicorn.run(app, host=API_HOST, port=API_PORT)
@@ -1,53 +1,252 @@
+import hashlib
+import json
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
 
 import lightgbm as lgb
-import pandas as pd
+import numpy as np
 from tqdm import tqdm
 
-from data_processing import build_final_dataset
+from data_processing import build_training_matrix, peak_rss_mb
+from model_registry import ModelRegistry
+from storage import city_store
 
 
-def train_model(processed_cities_directory: str):
-    df = build_final_dataset(processed_cities_directory)
+# Columns of the processed city tables that are not model features
+DROPPED_COLUMNS = ["date", "label", "date_label", "GDD", "day_of_year", "current_year", "temperature_2m_max",
+                   "temperature_2m_min", "rain_sum", "snowfall_sum", "temperature_2m_mean",
+                   "et0_fao_evapotranspiration", "weather_code", "sunlight_length", "total_precipitation"]
 
-    df.dropna(subset=['label'], inplace=True)
-    dropped_columns = ["date", "label", "date_label", "GDD", "day_of_year", "current_year", "temperature_2m_max",
-                       "temperature_2m_min", "rain_sum", "snowfall_sum", "temperature_2m_mean",
-                       "et0_fao_evapotranspiration", "weather_code", "sunlight_length", "total_precipitation"]
 
-    X_train = df.drop(columns=dropped_columns, errors='ignore')
-    y_train = df["label"]
+def model_feature_columns(processed_cities_directory: str):
+    """
+    :return: Feature columns of the processed city tables, in table order
+    """
+    store = city_store(processed_cities_directory)
+    cities = store.list_cities()
+    if not cities:
+        raise ValueError(f"No processed city tables in {processed_cities_directory}, run process_cities first")
+    columns = store.metadata(cities[0])["columns"]
+    return [col for col in columns if col not in DROPPED_COLUMNS]
 
-    # Train quantile models
-    quantiles = [0.1, 0.5, 0.9]
-    models = {}
 
-    for q in quantiles:
-        model = lgb.LGBMRegressor(objective='quantile', alpha=q, n_estimators=250, learning_rate=0.05, max_depth=-1,
-                                  colsample_bytree=0.3, num_leaves=31, random_state=42, verbosity=-1)
-        model.fit(X_train, y_train, callbacks=[lgb.log_evaluation(period=0)])
-        models[q] = model
+# Binning of the cached training Dataset. Pre-filtering is off so models with other leaf constraints reuse the same bins.
+DATASET_PARAMS = {"max_bin": 255, "min_data_in_bin": 3, "bin_construct_sample_cnt": 200000, "seed": 42,
+                  "feature_pre_filter": False, "verbosity": -1}
+
+QUANTILE_PARAMS = {"objective": "quantile", "metric": "quantile", "learning_rate": 0.05, "max_depth": -1,
+                   "feature_fraction": 0.3, "num_leaves": 31, "seed": 42, "verbosity": -1}
+NUM_BOOST_ROUND = 250
+QUANTILES = [0.1, 0.5, 0.9]
+
+# Cores the quantile models may use together, the rest is left to the API
+SERVING_RESERVED_CORES = int(os.getenv("SERVING_RESERVED_CORES", 1))
+TRAINING_CORE_BUDGET = int(os.getenv("TRAINING_CORE_BUDGET", max(1, (os.cpu_count() or 1) - SERVING_RESERVED_CORES)))
+
+# Small data updates add trees to the registered models, a full retrain happens on schedule or when the data drifts
+CONTINUE_BOOST_ROUND = int(os.getenv("CONTINUE_BOOST_ROUND", 25))
+FULL_RETRAIN_DAYS = int(os.getenv("FULL_RETRAIN_DAYS", 30))
+MAX_CONTINUED_UPDATES = 10
+DRIFT_ROW_FRACTION = 0.05
+DRIFT_LABEL_SHIFT_DAYS = 1.0
+
+
+def dataset_cache_directory(processed_cities_directory: str):
+    return os.path.join(os.path.dirname(os.path.normpath(processed_cities_directory)), "dataset_cache")
+
+
+def training_data_fingerprint(X_train, y_train):
+    """
+    Fingerprint of the labelled rows and the binning. Days appended to the processed tables stay unlabelled until the
+    bloom date of their season is known, so they leave it unchanged.
+    :param X_train: Feature matrix of build_training_matrix
+    :param y_train: Labels of build_training_matrix
+    """
+    digest = hashlib.sha1(json.dumps([list(X_train.columns), DATASET_PARAMS, lgb.__version__]).encode("utf-8"))
+    matrix = X_train.to_numpy()
+    # Hashed in memory order, the matrix is filled column by column
+    digest.update(matrix.T if matrix.flags.f_contiguous else np.ascontiguousarray(matrix))
+    digest.update(np.ascontiguousarray(y_train.to_numpy(dtype=np.float64)))
+    return digest.hexdigest()
+
+
+def load_training_dataset(processed_cities_directory: str, cache_directory: str = None, training_matrix=None):
+    """
+    Binned LightGBM Dataset of the labelled rows, loaded from the binary cache when the labelled rows didn't change
+    since it was built. Every model trained on it shares the same bins instead of re-binning the features.
+    :param cache_directory: Directory of the binary cache, data/dataset_cache by default
+    :param training_matrix: (X, y) of build_training_matrix over model_feature_columns, built here if None
+    :return: Constructed lgb.Dataset
+    """
+    cache_directory = cache_directory or dataset_cache_directory(processed_cities_directory)
+    if training_matrix is None:
+        print(f"Peak RSS before loading the training set: {peak_rss_mb()} MB")
+        training_matrix = build_training_matrix(processed_cities_directory,
+                                                model_feature_columns(processed_cities_directory))
+        print(f"Peak RSS after loading the training set: {peak_rss_mb()} MB")
+    X_train, y_train = training_matrix
+    key = training_data_fingerprint(X_train, y_train)
+    path = os.path.join(cache_directory, f"train_{key}.bin")
+    if os.path.exists(path):
+        return lgb.Dataset(path, params=DATASET_PARAMS).construct()
+
+    dataset = lgb.Dataset(X_train, y_train, params=DATASET_PARAMS).construct()
+
+    # Replace the cache of older training data
+    os.makedirs(cache_directory, exist_ok=True)
+    for file in os.listdir(cache_directory):
+        if file.startswith("train_") and file.endswith(".bin"):
+            os.remove(os.path.join(cache_directory, file))
+    dataset.save_binary(path + ".tmp")
+    os.replace(path + ".tmp", path)
+    return dataset
+
+
+def train_model(processed_cities_directory: str, core_budget: int = None, init_models=None,
+                num_boost_round: int = NUM_BOOST_ROUND, train_set: lgb.Dataset = None, training_matrix=None):
+    """
+    Trains the quantile models concurrently on the shared training Dataset, splitting the core budget between them.
+    :param core_budget: Total LightGBM threads across the models, TRAINING_CORE_BUDGET by default
+    :param init_models: {quantile: lgb.Booster} to continue boosting from, None to train from scratch
+    :param num_boost_round: Number of trees added to each model
+    :param train_set: Training Dataset already loaded with load_training_dataset, loaded here if None
+    :param training_matrix: (X, y) the training Dataset was built from, reused for continued models if given
+    :return: {quantile: lgb.Booster}, still holding their training data for training_loss
+    """
+    if train_set is None:
+        train_set = load_training_dataset(processed_cities_directory)
+    if init_models is None:
+        train_sets = {q: train_set for q in QUANTILES}
+    else:
+        # Continued models start from the scores of their previous trees, which need the raw features. Each model gets
+        # its own Dataset for its initial scores, binned with the cached bin mappers.
+        X_train, y_train = training_matrix or build_training_matrix(processed_cities_directory,
+                                                                    train_set.get_feature_name())
+        train_sets = {q: lgb.Dataset(X_train, y_train, reference=train_set, params=DATASET_PARAMS, free_raw_data=False)
+                      for q in QUANTILES}
+
+    core_budget = max(1, core_budget or TRAINING_CORE_BUDGET)
+    workers = min(len(QUANTILES), core_budget)
+    threads = core_budget // workers
+
+    def fit(q):
+        start = time.perf_counter()
+        booster = lgb.train({**QUANTILE_PARAMS, "alpha": q, "num_threads": threads}, train_sets[q],
+                            num_boost_round=num_boost_round, init_model=init_models and init_models[q],
+                            keep_training_booster=True)
+        print(f"Trained quantile {q} model in {time.perf_counter() - start:.1f}s")
+        return booster
+
+    # Train quantile models
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="training") as executor:
+        models = dict(zip(QUANTILES, executor.map(fit, QUANTILES)))
+    print(f"Trained {len(QUANTILES)} models in {time.perf_counter() - start:.1f}s "
+          f"({workers} at a time, {threads} threads each)")
 
     return models
 
 
-def predict_model(processed_cities_directory: str, models):
-    dropped_columns = ["date", "label", "date_label", "GDD", "day_of_year", "current_year", "temperature_2m_max",
-                       "temperature_2m_min", "rain_sum", "snowfall_sum", "temperature_2m_mean",
-                       "et0_fao_evapotranspiration", "weather_code", "sunlight_length", "total_precipitation"]
+def training_loss(booster: lgb.Booster):
+    """
+    :return: Pinball loss of a model returned by train_model on its training data
+    """
+    return float(booster.eval_train()[0][2])
+
+
+def full_retrain_reason(latest: dict, feature_columns, labels, now: datetime):
+    """
+    :param latest: Registry entry of the latest models
+    :param labels: Labels of the current training set
+    :return: Why the models have to be trained from scratch, None if the latest models can be continued
+    """
+    if latest is None:
+        return "no registered model"
+    if latest["feature_columns"] != feature_columns:
+        return "feature columns changed"
+    if now - datetime.fromisoformat(latest["full_trained"]) >= timedelta(days=FULL_RETRAIN_DAYS):
+        return f"last full retrain over {FULL_RETRAIN_DAYS} days ago"
+    if latest["continued_updates"] >= MAX_CONTINUED_UPDATES:
+        return f"{MAX_CONTINUED_UPDATES} continued updates since the last full retrain"
+    if abs(len(labels) - latest["full_rows"]) > DRIFT_ROW_FRACTION * latest["full_rows"]:
+        return "training rows drifted"
+    if abs(float(np.mean(labels)) - latest["full_label_mean"]) > DRIFT_LABEL_SHIFT_DAYS:
+        return "label mean drifted"
+    return None
+
 
-    predictions = {}
-    for file in tqdm(os.listdir(processed_cities_directory), desc="Predicting for cities"):
-        city = file.split('.')[0]
+def update_models(processed_cities_directory: str, registry: ModelRegistry, core_budget: int = None,
+                  full_retrain: bool = False):
+    """
+    Brings the registered models up to date with the processed tables: the latest version is loaded as is when it was
+    trained on the same labelled rows, continued with CONTINUE_BOOST_ROUND trees after small data updates, and otherwise
+    retrained from scratch. New models are registered with their training data fingerprint and metrics.
+    :param full_retrain: Always train from scratch
+    :return: ({quantile: lgb.Booster}, description of what was done, None if the latest models were loaded as is)
+    """
+    # Days appended since the last job are unlabelled, the models only change when the labelled rows do
+    feature_columns = model_feature_columns(processed_cities_directory)
+    X_train, y_train = build_training_matrix(processed_cities_directory, feature_columns)
+    fingerprint = training_data_fingerprint(X_train, y_train)
 
-        old_df = pd.read_csv(os.path.join(processed_cities_directory, file))
-        old_df['date'] = pd.to_datetime(old_df['date'])
-        latest_row_df = old_df.loc[[old_df['date'].idxmax()]]
-        latest_row_df = latest_row_df.drop(columns=dropped_columns, errors='ignore')
+    latest = registry.latest()
+    if latest is not None and latest["data_fingerprint"] == fingerprint and not full_retrain:
+        return registry.load(latest), None
+
+    train_set = load_training_dataset(processed_cities_directory, training_matrix=(X_train, y_train))
+    now = datetime.now()
+    labels = y_train.to_numpy()
+    reason = "full retrain requested" if full_retrain else full_retrain_reason(latest, feature_columns, labels, now)
+
+    start = time.perf_counter()
+    if reason is None:
+        models = train_model(processed_cities_directory, core_budget, init_models=registry.load(latest),
+                             num_boost_round=CONTINUE_BOOST_ROUND, train_set=train_set,
+                             training_matrix=(X_train, y_train))
+        lineage = {key: latest[key] for key in ["full_trained", "full_rows", "full_label_mean"]}
+        lineage["continued_updates"] = latest["continued_updates"] + 1
+    else:
+        models = train_model(processed_cities_directory, core_budget, train_set=train_set)
+        lineage = {"full_trained": now.isoformat(), "full_rows": len(labels), "full_label_mean": float(np.mean(labels)),
+                   "continued_updates": 0}
+
+    entry = registry.register(models, {
+        "data_fingerprint": fingerprint,
+        "mode": "full" if reason is not None else "continued",
+        "reason": reason,
+        "base_version": latest["version"] if reason is None else None,
+        "feature_columns": feature_columns,
+        "rows": len(labels),
+        "training_seconds": round(time.perf_counter() - start, 1),
+        "metrics": {str(q): training_loss(booster) for q, booster in models.items()},
+        **lineage,
+    })
+
+    if reason is None:
+        return models, f"continued v{latest['version']} as v{entry['version']}"
+    return models, f"trained v{entry['version']} from scratch ({reason})"
+
+
+def predict_model(processed_cities_directory: str, models):
+    """
+    Predicts every city from its latest row. Only the last row of each table is read, and the rows of all cities are
+    stacked into one matrix so each quantile model is evaluated in a single call.
+    :return: {city: [q10, q50, q90]}
+    """
+    store = city_store(processed_cities_directory)
+    feature_columns = models[QUANTILES[0]].feature_name()
 
-        preds = []
-        for quantile in [0.1, 0.5, 0.9]:
-            preds.append(models[quantile].predict(latest_row_df)[0])
-        predictions[city] = preds
+    cities = store.list_cities()
+    features = np.empty((len(cities), len(feature_columns)), dtype=np.float64)
+    for i, city in enumerate(tqdm(cities, desc="Reading latest rows")):
+        latest_row_df = store.tail(city, columns=["date"] + feature_columns)
+        if latest_row_df["date"].iloc[-1] != store.last_date(city):
+            # Rows out of date order, fall back to finding the latest one
+            old_df = store.read(city, columns=["date"] + feature_columns)
+            latest_row_df = old_df.loc[[old_df['date'].idxmax()]]
+        features[i] = latest_row_df[feature_columns].iloc[-1].to_numpy(dtype=np.float64)
 
-    return predictions
+    quantile_predictions = [models[quantile].predict(features) for quantile in QUANTILES]
+    return {city: [preds[i] for preds in quantile_predictions] for i, city in enumerate(cities)}
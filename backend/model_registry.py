@@ -0,0 +1,85 @@
+import json
+import os
+import shutil
+from datetime import datetime
+from typing import List, Optional
+
+import lightgbm as lgb
+
+
+class ModelRegistry:
+    """
+    Versioned quantile models on disk. Each version is a directory holding one LightGBM model file per quantile, and
+    registry.json lists every version with the fingerprint of its training data, its metrics and how it was trained.
+    """
+    KEEP_VERSIONS = 5
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.index_path = os.path.join(directory, "registry.json")
+
+    def versions(self) -> List[dict]:
+        if not os.path.exists(self.index_path):
+            return []
+        with open(self.index_path, "r") as f:
+            return json.load(f)["versions"]
+
+    def latest(self) -> Optional[dict]:
+        versions = self.versions()
+        return versions[-1] if versions else None
+
+    def version_directory(self, version: int) -> str:
+        return os.path.join(self.directory, f"v{version:04d}")
+
+    @staticmethod
+    def model_file(quantile: float) -> str:
+        return f"q{round(quantile * 100):02d}.txt"
+
+    def load(self, entry: dict = None):
+        """
+        :param entry: Version to load, the latest if None
+        :return: {quantile: lgb.Booster}, None if no version is registered
+        """
+        entry = entry or self.latest()
+        if entry is None:
+            return None
+
+        directory = self.version_directory(entry["version"])
+        return {float(q): lgb.Booster(model_file=os.path.join(directory, self.model_file(float(q))))
+                for q in entry["quantiles"]}
+
+    def register(self, models, info: dict) -> dict:
+        """
+        Saves the models as a new version.
+        :param models: {quantile: lgb.Booster}
+        :param info: Training data fingerprint, metrics and training details stored with the version
+        :return: Registry entry of the new version
+        """
+        versions = self.versions()
+        version = versions[-1]["version"] + 1 if versions else 1
+
+        # Write the model files next to the final directory, then rename, so a crash never leaves a partial version
+        directory = self.version_directory(version)
+        tmp_directory = directory + ".tmp"
+        shutil.rmtree(tmp_directory, ignore_errors=True)
+        os.makedirs(tmp_directory)
+        for q, booster in models.items():
+            booster.save_model(os.path.join(tmp_directory, self.model_file(q)))
+        os.replace(tmp_directory, directory)
+
+        entry = {**info, "version": version, "created": datetime.now().isoformat(),
+                 "quantiles": [str(q) for q in models],
+                 "num_trees": {str(q): booster.num_trees() for q, booster in models.items()}}
+        versions.append(entry)
+
+        # Older versions are dropped from disk and from the index
+        for old in versions[:-self.KEEP_VERSIONS]:
+            shutil.rmtree(self.version_directory(old["version"]), ignore_errors=True)
+        self.save_versions(versions[-self.KEEP_VERSIONS:])
+        return entry
+
+    def save_versions(self, versions: List[dict]):
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self.index_path + ".tmp", "w") as f:
+            json.dump({"versions": versions}, f, indent=2)
+        os.replace(self.index_path + ".tmp", self.index_path)
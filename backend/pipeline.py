@@ -0,0 +1,184 @@
+import hashlib
+import json
+import os
+import time
+from datetime import datetime
+
+from data_processing import process_cities, update_bloom_date_files, update_raw_cities
+from features import FEATURE_STATE_VERSION, DataContext, FeatureExtractor, load_data_context
+from interfaces import DataService
+from latency import LatencyMonitor
+from model import predict_model, update_models
+from model_registry import ModelRegistry
+from storage import CITY_STORAGE_FORMAT, city_store, migrate_csv_tree
+
+
+def fingerprint(value) -> str:
+    """
+    :return: sha1 of the JSON form of value, so equal inputs give equal fingerprints across runs
+    """
+    return hashlib.sha1(json.dumps(value, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+class JobReport:
+    """
+    Which stages of a job run ran or were skipped, and why.
+    """
+    def __init__(self):
+        self.stages = []
+
+    def ran(self, stage: str, reason: str):
+        self.stages.append({"stage": stage, "status": "ran", "reason": reason})
+
+    def skipped(self, stage: str, reason: str):
+        self.stages.append({"stage": stage, "status": "skipped", "reason": reason})
+
+    def __str__(self):
+        width = max([len(stage["stage"]) for stage in self.stages], default=0)
+        return "\n".join(f"{stage['stage']:<{width}}  {stage['status']:<7}  {stage['reason']}" for stage in self.stages)
+
+
+class JobState:
+    """
+    Fingerprints of the inputs each stage last ran on, persisted between runs in a JSON file.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.values = {}
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                self.values = json.load(f)
+
+    def get(self, key: str, default=None):
+        return self.values.get(key, default)
+
+    def set(self, key: str, value):
+        self.values[key] = value
+        self.save()
+
+    def save(self):
+        with open(self.path + ".tmp", "w") as f:
+            json.dump(self.values, f, indent=2)
+        os.replace(self.path + ".tmp", self.path)
+
+
+def source_fingerprint(context: DataContext):
+    """
+    Fingerprint of the content of the metadata and bloom date CSVs, ignoring rewrites that left them unchanged.
+    """
+    return fingerprint({name: signature[2] for name, signature in context.signatures.items()})
+
+
+def feature_input_fingerprint(extractor: FeatureExtractor, city: str):
+    """
+    Fingerprint of everything the processed table of a city is built from: the raw table metadata, the coordinates
+    and bloom dates of the city, and the feature definitions.
+    """
+    raw_metadata = extractor.raw_store.metadata(city)
+    return fingerprint([raw_metadata, extractor.static_fingerprint(city), FEATURE_STATE_VERSION])
+
+
+def run_daily_job(data_directory: str, data_service: DataService, workers: int = 1, force: bool = False,
+                  latency_monitor: LatencyMonitor = None):
+    """
+    Runs the daily update as a chain of stages, skipping the stages whose inputs did not change since their last run:
+    features are only rebuilt for the cities whose raw data or bloom dates changed, predictions are only made again when
+    the features changed, the models are only retrained when the labelled training rows changed, and the database
+    tables are only rewritten when their content would differ.
+    :param workers: Number of processes to build city features with
+    :param force: Run every stage regardless of the fingerprints
+    :param latency_monitor: Monitor of the API requests, to report their latency while the models train
+    :return: JobReport of the run
+    """
+    report = JobReport()
+    latency_monitor = latency_monitor or LatencyMonitor()
+    state = JobState(os.path.join(data_directory, "job_state.json"))
+    if force:
+        state.values = {}
+
+    # Moves CSV city tables left from an older data download into the configured store
+    migrated = migrate_csv_tree(data_directory)
+    if migrated:
+        print(f"Migrated {migrated} city tables to {CITY_STORAGE_FORMAT}")
+
+    # Bloom dates, the JMA pages are the only way to know whether they changed
+    context = load_data_context(data_directory)
+    update_bloom_date_files(data_directory, context)
+    # Reloaded through the shared cache, so later stages get the refreshed context instead of reloading it again
+    context = load_data_context(data_directory)
+    bloom_fingerprint = source_fingerprint(context)
+    if bloom_fingerprint != state.get("bloom_dates"):
+        report.ran("bloom_dates", "JMA bloom dates changed")
+    else:
+        report.ran("bloom_dates", "JMA bloom dates unchanged")
+    state.set("bloom_dates", bloom_fingerprint)
+
+    # Raw weather, fresh cities are not requested again
+    print("Update the weather data for each city")
+    raw_cities_directory = os.path.join(data_directory, "raw_cities")
+    cities = city_store(raw_cities_directory).list_cities()
+    errors = update_raw_cities(cities, raw_cities_directory, context.cities_metadata_df,
+                               queue_path=os.path.join(data_directory, "ingestion_queue.json"))
+    for city, err in errors.items():
+        print(f"Problem with OpenMateo for {city}: ", err)
+    report.ran("raw_weather", f"{len(errors)} of {len(cities)} cities failed to update")
+
+    # Features, only for the cities whose inputs changed
+    print("Building features for cities")
+    extractor = FeatureExtractor(data_directory, context)
+    feature_fingerprints = state.get("features", {})
+    input_fingerprints = {city: feature_input_fingerprint(extractor, city) for city in cities}
+    changed = [city for city in cities
+               if input_fingerprints[city] != feature_fingerprints.get(city) or not extractor.processed_store.exists(city)]
+    if changed:
+        errors = process_cities(data_directory, incremental=True, workers=workers, context=context, cities=changed)
+        feature_fingerprints = {city: fp for city, fp in feature_fingerprints.items() if city in input_fingerprints}
+        feature_fingerprints.update({city: input_fingerprints[city] for city in changed if city not in errors})
+        state.set("features", feature_fingerprints)
+        report.ran("features", f"{len(changed)} of {len(cities)} cities changed, {len(errors)} failed")
+    else:
+        report.skipped("features", f"inputs of all {len(cities)} cities unchanged")
+
+    # Models, only retrained when the labelled rows changed. Days appended to the processed tables stay unlabelled
+    # until their bloom date is known, so most feature updates only need new predictions.
+    processed_cities_directory = os.path.join(data_directory, "processed_cities")
+    registry = ModelRegistry(os.path.join(data_directory, "models"))
+    features_fingerprint = fingerprint(feature_fingerprints)
+    predictions = state.get("predictions")
+    if features_fingerprint != state.get("dataset") or predictions is None:
+        print("Updating the models...")
+        start = time.perf_counter()
+        with latency_monitor.track() as latencies:
+            models, action = update_models(processed_cities_directory, registry)
+        if action is None:
+            version = registry.latest()["version"]
+            report.skipped("training", f"labelled training rows unchanged, reusing model v{version}")
+        else:
+            training_summary = (f"{action} in {time.perf_counter() - start:.1f}s, "
+                                f"API {LatencyMonitor.summary(latencies)}")
+            print(f"Training {training_summary}")
+            report.ran("training", f"labelled training rows changed, {training_summary}")
+
+        print("Predicting from model...")
+        predictions = predict_model(processed_cities_directory, models)
+        predictions = {city: [float(pred) for pred in preds] for city, preds in predictions.items()}
+        state.set("predictions", predictions)
+        state.set("dataset", features_fingerprint)
+        report.ran("predict", "features changed")
+    else:
+        report.skipped("training", "features unchanged")
+        report.skipped("predict", "features unchanged, reusing the last predictions")
+
+    # Tables, their rows depend on the predictions, the full bloom history and which year is predicted
+    now = datetime.now()
+    tables_fingerprint = fingerprint([predictions, bloom_fingerprint, now.year, now.month >= 6])
+    if tables_fingerprint != state.get("tables") or not data_service.is_first_time_initialized():
+        data_service.set_history(data_directory, context)
+        data_service.set_predictions(data_directory, predictions, context)
+        state.set("tables", tables_fingerprint)
+        report.ran("tables", "predictions or bloom history changed")
+    else:
+        report.skipped("tables", "predictions and bloom history unchanged")
+
+    state.set("report", {"finished": datetime.now().isoformat(), "stages": report.stages})
+    return report
@@ -0,0 +1,60 @@
+import threading
+import time
+
+
+class TokenBucket:
+    """
+    Allows `capacity` units per `period` seconds, refilled continuously.
+    """
+    def __init__(self, capacity: float, period: float):
+        self.capacity = capacity
+        self.rate = capacity / period
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, tokens: float) -> float:
+        # Requests heavier than the whole bucket only wait for a full bucket
+        tokens = min(tokens, self.capacity)
+        return max(0.0, (tokens - self.tokens) / self.rate)
+
+    def consume(self, tokens: float):
+        self.tokens -= min(tokens, self.capacity)
+
+
+class RateLimiter:
+    """
+    Thread-safe limiter over several token buckets, e.g. a minutely and an hourly quota.
+    A request goes through only once every bucket has room for its weight.
+    """
+    def __init__(self, buckets):
+        self.buckets = list(buckets)
+        self.blocked_until = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self, weight: float = 1.0):
+        """
+        Blocks until the request fits all quotas, then takes its weight from every bucket.
+        """
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                for bucket in self.buckets:
+                    bucket.refill(now)
+
+                wait = max([self.blocked_until - now] + [bucket.wait_time(weight) for bucket in self.buckets])
+                if wait <= 0:
+                    for bucket in self.buckets:
+                        bucket.consume(weight)
+                    return
+            time.sleep(wait)
+
+    def pause(self, seconds: float):
+        """
+        Holds back every caller for the given time, e.g. after the server reported the quota as exceeded.
+        """
+        with self.lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
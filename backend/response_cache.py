@@ -0,0 +1,142 @@
+import asyncio
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Optional, Tuple
+
+
+# Cached responses are (JSON body, content hash)
+Blob = Tuple[bytes, str]
+
+
+def render_json(value) -> bytes:
+    """
+    :return: JSON of a model or a list of models, encoded the way FastAPI's JSONResponse encodes them
+    """
+    if isinstance(value, list):
+        content = [item.model_dump(mode="json") for item in value]
+    else:
+        content = value.model_dump(mode="json")
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+
+
+def render_blob(value) -> Blob:
+    body = render_json(value)
+    return body, hashlib.sha1(body).hexdigest()
+
+
+class ResponseCache:
+    """
+    Two-tier cache of rendered API responses: an in-process LRU in front of Redis. Keys include a data version token,
+    so bumping the version after the data changes invalidates every entry at once instead of waiting for a TTL.
+    Concurrent misses of the same key share a single load. Redis is optional, the LRU keeps working when it is down.
+    """
+    REDIS_PREFIX = "api-cache"
+    REDIS_TTL_SECONDS = 7 * 24 * 3600
+    REDIS_RETRY_SECONDS = 30
+
+    def __init__(self, redis_client=None, max_entries: int = 1024):
+        self.redis = redis_client
+        self.max_entries = max_entries
+        self.version = "0"
+        self.entries = OrderedDict()
+        self.in_flight = {}
+        self.redis_retry_at = 0.0
+        self.stats = {"local_hits": 0, "redis_hits": 0, "misses": 0, "coalesced": 0, "redis_errors": 0}
+
+    def set_version(self, version: str) -> bool:
+        """
+        :return: Whether the version changed, which drops every cached entry
+        """
+        if version == self.version:
+            return False
+        self.version = version
+        self.entries.clear()
+        return True
+
+    def redis_key(self, version: str, key: str) -> str:
+        return f"{self.REDIS_PREFIX}:{version}:{key}"
+
+    async def redis_get(self, version: str, key: str) -> Optional[Blob]:
+        if self.redis is None or time.monotonic() < self.redis_retry_at:
+            return None
+        try:
+            value = await self.redis.get(self.redis_key(version, key))
+        except Exception as e:
+            self.redis_failed(e)
+            return None
+        if value is None:
+            return None
+        # Stored as the 40 character hash followed by the body
+        return value[40:], value[:40].decode("ascii")
+
+    async def redis_set(self, version: str, key: str, blob: Blob):
+        if self.redis is None or time.monotonic() < self.redis_retry_at:
+            return
+        body, etag = blob
+        try:
+            await self.redis.set(self.redis_key(version, key), etag.encode("ascii") + body, ex=self.REDIS_TTL_SECONDS)
+        except Exception as e:
+            self.redis_failed(e)
+
+    def redis_failed(self, error: Exception):
+        # Skip Redis for a while instead of paying for a failed connection on every request
+        self.stats["redis_errors"] += 1
+        self.redis_retry_at = time.monotonic() + self.REDIS_RETRY_SECONDS
+        print(f"Redis cache unavailable for {self.REDIS_RETRY_SECONDS}s: {error}")
+
+    def remember(self, key: str, blob: Blob):
+        self.entries[key] = blob
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    async def get_or_load(self, key: str, load: Callable[[], Awaitable[Blob]]) -> Blob:
+        """
+        :param load: Renders the response on a miss of both tiers, errors are raised to every waiting caller and not
+                     cached
+        """
+        blob = self.entries.get(key)
+        if blob is not None:
+            self.entries.move_to_end(key)
+            self.stats["local_hits"] += 1
+            return blob
+
+        flight_key = (self.version, key)
+        task = self.in_flight.get(flight_key)
+        if task is not None:
+            self.stats["coalesced"] += 1
+        else:
+            # The load runs as its own task, so a caller that is cancelled, e.g. by a client disconnecting, doesn't
+            # cancel it for the other callers waiting on it
+            task = asyncio.ensure_future(self.load(flight_key, load))
+            self.in_flight[flight_key] = task
+            task.add_done_callback(lambda done: self.finish_load(flight_key, done))
+        return await asyncio.shield(task)
+
+    def finish_load(self, flight_key: Tuple[str, str], task: asyncio.Future):
+        del self.in_flight[flight_key]
+        if not task.cancelled():
+            # Retrieved here so an exception nobody waits for anymore is not reported as unhandled
+            task.exception()
+
+    async def load(self, flight_key: Tuple[str, str], load: Callable[[], Awaitable[Blob]]) -> Blob:
+        version, key = flight_key
+        blob = await self.redis_get(version, key)
+        if blob is not None:
+            self.stats["redis_hits"] += 1
+        else:
+            self.stats["misses"] += 1
+            blob = await load()
+            await self.redis_set(version, key, blob)
+        # A version bump while loading makes the result stale for the new version
+        if version == self.version:
+            self.remember(key, blob)
+        return blob
+
+    def summary(self) -> dict:
+        lookups = sum(self.stats[key] for key in ["local_hits", "redis_hits", "misses", "coalesced"])
+        hits = lookups - self.stats["misses"]
+        return {**self.stats, "version": self.version, "entries": len(self.entries),
+                "hit_rate": round(hits / lookups, 4) if lookups else None}
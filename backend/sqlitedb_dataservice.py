@@ -1,157 +1,478 @@
+import asyncio
+import hashlib
 import os
 import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime
-from typing import List
+from typing import List, Optional, Tuple
+from urllib.request import pathname2url
 
-from tqdm import tqdm
+import numpy as np
 
-from features import FeatureExtractor
-from interfaces import HeatmapPoint, DataService, BloomHistory, BloomHistoryPoint
+from features import DataContext, load_data_context
+from interfaces import HeatmapPoint, DataService, AsyncDataService, BloomHistory, BloomHistoryPoint, HeatmapRange, \
+    build_heatmap_range
+from response_cache import render_blob
+
+
+class SQLiteConnections:
+    """
+    Connections to one SQLite database: a read-only connection per thread for the API, kept open so sqlite3 reuses its
+    prepared statements between requests, and a single writer connection for the rebuilds. The database is switched
+    to WAL mode by the writer, so readers keep reading the last committed state while a rebuild writes.
+    """
+    MMAP_SIZE = 256 * 1024 * 1024
+    CACHE_SIZE_KB = 16 * 1024
+    CACHED_STATEMENTS = 64
+    BUSY_TIMEOUT_MS = 5000
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self.local = threading.local()
+        self.readers = []
+        self.lock = threading.Lock()
+        self.write_lock = threading.Lock()
+        self.write_connection = None
+
+    def connect(self, read_only: bool) -> sqlite3.Connection:
+        if read_only:
+            uri = f"file:{pathname2url(os.path.abspath(self.db_path))}?mode=ro"
+            conn = sqlite3.connect(uri, uri=True, check_same_thread=False, cached_statements=self.CACHED_STATEMENTS)
+            conn.execute("PRAGMA query_only = ON")
+        else:
+            conn = sqlite3.connect(self.db_path, check_same_thread=False, cached_statements=self.CACHED_STATEMENTS)
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("PRAGMA synchronous = NORMAL")
+        conn.execute(f"PRAGMA busy_timeout = {self.BUSY_TIMEOUT_MS}")
+        conn.execute(f"PRAGMA mmap_size = {self.MMAP_SIZE}")
+        conn.execute(f"PRAGMA cache_size = -{self.CACHE_SIZE_KB}")
+        conn.execute("PRAGMA temp_store = MEMORY")
+        return conn
+
+    def reader(self) -> sqlite3.Connection:
+        """
+        :return: Read-only connection of the calling thread, reopened when the database file was replaced
+        """
+        try:
+            stat = os.stat(self.db_path)
+        except FileNotFoundError:
+            raise sqlite3.OperationalError(f"unable to open database file {self.db_path}") from None
+        key = (stat.st_dev, stat.st_ino)
+
+        conn = getattr(self.local, "conn", None)
+        if conn is not None and self.local.key == key:
+            return conn
+        if conn is not None:
+            self.close_reader(conn)
+
+        conn = self.connect(read_only=True)
+        self.local.conn, self.local.key = conn, key
+        with self.lock:
+            self.readers.append(conn)
+        return conn
+
+    def close_reader(self, conn: sqlite3.Connection):
+        with self.lock:
+            if conn in self.readers:
+                self.readers.remove(conn)
+        conn.close()
+
+    @contextmanager
+    def writer(self):
+        """
+        Yields the writer connection, one writer at a time. Commits when the block exits, rolls back on errors.
+        """
+        with self.write_lock:
+            if self.write_connection is None:
+                self.write_connection = self.connect(read_only=False)
+            conn = self.write_connection
+            try:
+                yield conn
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+
+    def close(self):
+        with self.write_lock:
+            if self.write_connection is not None:
+                self.write_connection.close()
+                self.write_connection = None
+        with self.lock:
+            readers, self.readers = self.readers, []
+        for conn in readers:
+            conn.close()
+
+
+# Cities are a dimension table, bloom rows only hold their keys and values. Rows are keyed by (city, year), which
+# serves the per city reads, and the year indexes serve the per year reads.
+SCHEMA_VERSION = 2
+
+# Table definitions with the table name left out, so shadow copies of a table are created with the same schema
+TABLES = {
+    "cities": """
+        CREATE TABLE {name} (
+            city TEXT PRIMARY KEY,
+            jp TEXT NOT NULL,
+            lat REAL NOT NULL,
+            lon REAL NOT NULL
+        ) WITHOUT ROWID
+    """,
+    "bloom_history": """
+        CREATE TABLE {name} (
+            city TEXT NOT NULL REFERENCES cities (city),
+            year INTEGER NOT NULL,
+            day_of_year INTEGER NOT NULL,
+            PRIMARY KEY (city, year)
+        ) WITHOUT ROWID
+    """,
+    "bloom_predictions": """
+        CREATE TABLE {name} (
+            city TEXT NOT NULL REFERENCES cities (city),
+            year INTEGER NOT NULL,
+            quantile_10 REAL NOT NULL,
+            quantile_50 REAL NOT NULL,
+            quantile_90 REAL NOT NULL,
+            PRIMARY KEY (city, year)
+        ) WITHOUT ROWID
+    """,
+    # Final JSON of the /heatmap and /history responses, rendered when the tables above change. Heatmaps show
+    # predictions depending on the current year, rendered_year is the year they were rendered in.
+    "response_blobs": """
+        CREATE TABLE {name} (
+            kind TEXT NOT NULL,
+            key TEXT NOT NULL,
+            body BLOB NOT NULL,
+            etag TEXT NOT NULL,
+            rendered_year INTEGER NOT NULL,
+            PRIMARY KEY (kind, key)
+        ) WITHOUT ROWID
+    """,
+}
+
+INDEXES = {
+    "cities": [],
+    "bloom_history": ["CREATE INDEX bloom_history_year ON bloom_history (year, day_of_year)"],
+    "bloom_predictions": ["CREATE INDEX bloom_predictions_year ON bloom_predictions (year, quantile_50)"],
+    "response_blobs": [],
+}
+
+
+def table_exists(conn: sqlite3.Connection, table: str) -> bool:
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone() is not None
+
+
+def schema_version(conn: sqlite3.Connection) -> int:
+    """
+    :return: Schema version of the database, 0 for an empty database or one from before the versioned schema
+    """
+    if not table_exists(conn, "schema_version"):
+        return 0
+    row = conn.execute("SELECT version FROM schema_version").fetchone()
+    return row[0] if row else 0
+
+
+def migrate_to_v1(conn: sqlite3.Connection):
+    # Tables of the unversioned schema repeat jp, lat and lon in every row and have no keys
+    legacy_tables = [table for table in ["bloom_history", "bloom_predictions"] if table_exists(conn, table)]
+    for table in legacy_tables:
+        conn.execute(f"ALTER TABLE {table} RENAME TO {table}_v0")
+
+    conn.execute("CREATE TABLE schema_version (version INTEGER NOT NULL)")
+    for table in ["cities", "bloom_history", "bloom_predictions"]:
+        conn.execute(TABLES[table].format(name=table))
+        for index in INDEXES[table]:
+            conn.execute(index)
+
+    for table in legacy_tables:
+        conn.execute(f"INSERT OR IGNORE INTO cities SELECT DISTINCT city, jp, lat, lon FROM {table}_v0")
+    if "bloom_history" in legacy_tables:
+        conn.execute("INSERT OR IGNORE INTO bloom_history SELECT city, year, day_of_year FROM bloom_history_v0")
+    if "bloom_predictions" in legacy_tables:
+        conn.execute("INSERT OR IGNORE INTO bloom_predictions "
+                     "SELECT city, year, quantile_10, quantile_50, quantile_90 FROM bloom_predictions_v0")
+    for table in legacy_tables:
+        conn.execute(f"DROP TABLE {table}_v0")
+
+
+def migrate_to_v2(conn: sqlite3.Connection):
+    conn.execute(TABLES["response_blobs"].format(name="response_blobs"))
+    write_response_blobs(conn)
+
+
+# MIGRATIONS[v] brings a database from version v to v + 1
+MIGRATIONS = [migrate_to_v1, migrate_to_v2]
+
+
+def replace_tables(conn: sqlite3.Connection, table_rows: dict, on_swap=None):
+    """
+    Replaces the content of tables without readers ever seeing them partially written. The rows are bulk-loaded into
+    shadow tables without indexes first, then one short transaction drops the live tables, renames the shadow tables
+    in their place and builds their indexes. In WAL mode readers keep the previous tables until that commits.
+    :param table_rows: {table: rows as tuples in column order}
+    :param on_swap: Called with the connection inside the swap transaction, after the new tables are in place
+    """
+    for table, rows in table_rows.items():
+        shadow = f"{table}_shadow"
+        conn.execute("BEGIN")
+        # Left over if an earlier rebuild crashed
+        conn.execute(f"DROP TABLE IF EXISTS {shadow}")
+        conn.execute(TABLES[table].format(name=shadow))
+        rows = list(rows)
+        if rows:
+            placeholders = ", ".join("?" * len(rows[0]))
+            conn.executemany(f"INSERT INTO {shadow} VALUES ({placeholders})", rows)
+        conn.commit()
+
+    conn.execute("BEGIN IMMEDIATE")
+    for table in table_rows:
+        conn.execute(f"DROP TABLE IF EXISTS {table}")
+        conn.execute(f"ALTER TABLE {table}_shadow RENAME TO {table}")
+        for index in INDEXES[table]:
+            conn.execute(index)
+    if on_swap is not None:
+        on_swap(conn)
+    conn.commit()
+
+
+def query_heatmap_points(cursor: sqlite3.Cursor, year: int, current_year: int) -> List[HeatmapPoint]:
+    cursor.execute("""
+        SELECT h.city, c.jp, c.lat, c.lon, h.day_of_year
+        FROM bloom_history h JOIN cities c ON c.city = h.city
+        WHERE h.year = ?
+    """, (year,))
+    rows = cursor.fetchall()
+
+    points = [HeatmapPoint(city=row[0], city_jp=row[1], lat=row[2], lng=row[3], value=row[4], is_prediction=False) for row in rows]
+    existing_cities = set(row[0] for row in rows)
+
+    if year >= current_year:
+        cursor.execute("""
+            SELECT p.city, c.jp, c.lat, c.lon, p.quantile_50
+            FROM bloom_predictions p JOIN cities c ON c.city = p.city
+            WHERE p.year = ?
+        """, (year,))
+        prediction_rows = cursor.fetchall()
+
+        predicted_points = [HeatmapPoint(city=row[0], city_jp=row[1], lat=row[2], lng=row[3], value=row[4], is_prediction=True)
+                            for row in prediction_rows if row[0] not in existing_cities]
+        points.extend(predicted_points)
+
+    return points
+
+
+def query_heatmap_range(cursor: sqlite3.Cursor, start: int, end: int, current_year: int) -> HeatmapRange:
+    # One pass over the year indexes of both tables, history rows sort first so they win over predictions
+    cursor.execute("""
+        SELECT b.year, b.city, c.jp, c.lat, c.lon, b.value, b.is_prediction
+        FROM (
+            SELECT year, city, day_of_year AS value, 0 AS is_prediction
+            FROM bloom_history WHERE year BETWEEN ? AND ?
+            UNION ALL
+            SELECT year, city, quantile_50, 1
+            FROM bloom_predictions WHERE year BETWEEN ? AND ?
+        ) b JOIN cities c ON c.city = b.city
+        ORDER BY b.year, b.is_prediction
+    """, (start, end, max(start, current_year), end))
+    return build_heatmap_range(start, end, cursor.fetchall())
+
+
+def query_city_history(cursor: sqlite3.Cursor, city: str) -> BloomHistory:
+    cursor.execute("SELECT year, day_of_year FROM bloom_history WHERE city = ? ORDER BY year", (city,))
+    rows = cursor.fetchall()
+
+    cursor.execute("""
+        SELECT year, quantile_10, quantile_50, quantile_90
+        FROM bloom_predictions
+        WHERE city = ?
+    """, (city,))
+    preds = cursor.fetchone()
+
+    points = [BloomHistoryPoint(year=row[0], value=row[1]) for row in rows]
+    history = BloomHistory(points=points, prediction_year=preds[0], prediction_q10=preds[1], prediction_q50=preds[2], prediction_q90=preds[3])
+    return history
+
+
+def write_response_blobs(conn: sqlite3.Connection):
+    """
+    Renders the heatmap of every year and the history of every predicted city from the tables into response_blobs.
+    """
+    cursor = conn.cursor()
+    current_year = datetime.now().year
+    blobs = []
+
+    years = [row[0] for row in conn.execute("SELECT year FROM bloom_history UNION SELECT year FROM bloom_predictions")]
+    for year in years:
+        blobs.append(("heatmap", str(year), *render_blob(query_heatmap_points(cursor, year, current_year))))
+    for (city,) in conn.execute("SELECT DISTINCT city FROM bloom_predictions").fetchall():
+        blobs.append(("history", city, *render_blob(query_city_history(cursor, city))))
+
+    conn.execute("DELETE FROM response_blobs")
+    conn.executemany("INSERT INTO response_blobs VALUES (?, ?, ?, ?, ?)",
+                     [(kind, key, body, etag, current_year) for kind, key, body, etag in blobs])
 
 
 class SQLiteDataService(DataService):
     def __init__(self, db_path: str = "heatmap.db"):
         self.db_path = db_path
+        self.connections = SQLiteConnections(db_path)
+
+        # Readers are read-only, an existing database is brought to the current schema before serving them
+        if os.path.exists(db_path):
+            with self.connections.writer() as conn:
+                self.ensure_schema(conn)
 
     def is_first_time_initialized(self) -> bool:
         return os.path.exists(self.db_path)
 
-    def set_history(self, data_directory: str):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-
-        # Drop and recreate table
-        cursor.execute("DROP TABLE IF EXISTS bloom_history")
-        cursor.execute("""
-            CREATE TABLE bloom_history (
-                city TEXT,
-                jp TEXT,
-                year INT,
-                lat REAL,
-                lon REAL,
-                day_of_year INT
-            )
-        """)
-
-        extractor = FeatureExtractor(data_directory)
-
-        total_rows_inserted = 0
-        years_set = set()
-
-        # Add full bloom data to db.
-        for city in tqdm(extractor.city_names, desc="Building sqlite database."):
-            city_years = extractor.full_bloom_dict[city].keys()
-            for year in city_years:
-                lat = extractor.cities_metadata_df.loc[city]["latitude"]
-                lon = extractor.cities_metadata_df.loc[city]["longitude"]
-                jp = extractor.cities_metadata_df.loc[city]["Jp"]
-                val = extractor.full_bloom_dict[city].get(year)
-                if val is None:
-                    continue
-                doy = val.dayofyear
-                cursor.execute(
-                    "INSERT INTO bloom_history VALUES (?, ?, ?, ?, ?, ?)",
-                    (city, jp, year, lat, lon, doy)
-                )
-                years_set.add(year)
-                total_rows_inserted += 1
+    @staticmethod
+    def ensure_schema(conn: sqlite3.Connection):
+        """
+        Creates the tables of an empty database, or migrates an older one in place.
+        """
+        version = schema_version(conn)
+        if version == SCHEMA_VERSION:
+            return
+        if version > SCHEMA_VERSION:
+            raise RuntimeError(f"Database schema version {version} is newer than {SCHEMA_VERSION}")
 
+        conn.execute("BEGIN")
+        for migration in MIGRATIONS[version:]:
+            migration(conn)
+        conn.execute("DELETE FROM schema_version")
+        conn.execute("INSERT INTO schema_version VALUES (?)", (SCHEMA_VERSION,))
         conn.commit()
-        conn.close()
 
-    def set_predictions(self, data_directory: str, predictions):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+    @staticmethod
+    def city_rows(context: DataContext):
+        metadata = context.cities_metadata_df[~context.cities_metadata_df.index.duplicated()]
+        return zip(metadata.index, metadata["Jp"], metadata["latitude"].astype(float).tolist(),
+                   metadata["longitude"].astype(float).tolist())
 
-        # Drop and recreate table
-        cursor.execute("DROP TABLE IF EXISTS bloom_predictions")
-        cursor.execute("""
-            CREATE TABLE bloom_predictions (
-                city TEXT,
-                year INT,
-                jp TEXT,
-                lat REAL,
-                lon REAL,
-                quantile_10 REAL,
-                quantile_50 REAL,
-                quantile_90 REAL
-            )
-        """)
-
-        extractor = FeatureExtractor(data_directory)
-
-        year = datetime.now().year
-        month = datetime.now().month
-        for city, preds in predictions.items():
-            lat = extractor.cities_metadata_df.loc[city]["latitude"]
-            lon = extractor.cities_metadata_df.loc[city]["longitude"]
-            jp = extractor.cities_metadata_df.loc[city]["Jp"]
-
-            cursor.execute(
-                """
-                SELECT 1 FROM bloom_history
-                WHERE city = ? AND year = ?
-                LIMIT 1
-                """,
-                (city, year)
-            )
-            row = cursor.fetchone()
-            if row or month >= 6:
-                cursor.execute(
-                    "INSERT INTO bloom_predictions VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
-                    (city, year+1, jp, lat, lon, preds[0], preds[1], preds[2])
-                )
-                continue
-
-            cursor.execute(
-                "INSERT INTO bloom_predictions VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
-                (city, year, jp, lat, lon, preds[0], preds[1], preds[2])
-            )
+    def set_history(self, data_directory: str, context: DataContext = None):
+        context = context or load_data_context(data_directory)
 
-        conn.commit()
-        conn.close()
+        # Known full blooms of every city as columns, read off the bloom matrix at once
+        bloom_dates = context.full_bloom_dates
+        cities = [city for city in dict.fromkeys(context.city_names) if city in bloom_dates.city_index]
+        days = bloom_dates.day_of_year[[bloom_dates.city_index[city] for city in cities]]
+        city_rows, year_columns = np.nonzero(days != bloom_dates.MISSING)
+        city_names = np.asarray(cities, dtype=object)[city_rows]
+        years = year_columns + bloom_dates.first_year
+        order = np.lexsort((years, city_names.astype(str)))
+        history_rows = zip(city_names[order].tolist(), years[order].tolist(),
+                           days[city_rows, year_columns][order].tolist())
 
-    def get_heatmap_points(self, year: int) -> List[HeatmapPoint]:
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        with self.connections.writer() as conn:
+            self.ensure_schema(conn)
+            replace_tables(conn, {"cities": self.city_rows(context), "bloom_history": history_rows},
+                           on_swap=write_response_blobs)
 
-        cursor.execute(f"SELECT city, jp, lat, lon, day_of_year FROM bloom_history WHERE year = ?", (year,))
-        rows = cursor.fetchall()
+    def set_predictions(self, data_directory: str, predictions, context: DataContext = None):
+        context = context or load_data_context(data_directory)
+        now = datetime.now()
 
-        points = [HeatmapPoint(city=row[0], city_jp=row[1], lat=row[2], lng=row[3], value=row[4], is_prediction=False) for row in rows]
-        existing_cities = set(row[0] for row in rows)
+        with self.connections.writer() as conn:
+            self.ensure_schema(conn)
 
-        if year >= datetime.now().year:
-            cursor.execute("""
-                SELECT city, jp, lat, lon, quantile_50 
-                FROM bloom_predictions 
-                WHERE year = ?
-            """, (year,))
-            prediction_rows = cursor.fetchall()
+            # Cities that already bloomed this year, or every city from June, are predicted for next year
+            bloomed = {row[0] for row in conn.execute("SELECT city FROM bloom_history WHERE year = ?", (now.year,))}
+            prediction_rows = sorted(
+                (city, now.year + 1 if city in bloomed or now.month >= 6 else now.year,
+                 float(preds[0]), float(preds[1]), float(preds[2]))
+                for city, preds in predictions.items())
 
-            predicted_points = [HeatmapPoint(city=row[0], city_jp=row[1], lat=row[2], lng=row[3], value=row[4], is_prediction=True)
-                                for row in prediction_rows if row[0] not in existing_cities]
-            points.extend(predicted_points)
+            replace_tables(conn, {"cities": self.city_rows(context), "bloom_predictions": prediction_rows},
+                           on_swap=write_response_blobs)
 
-        conn.close()
-        return points
+    def get_heatmap_points(self, year: int) -> List[HeatmapPoint]:
+        return query_heatmap_points(self.connections.reader().cursor(), year, datetime.now().year)
+
+    def get_heatmap_range(self, start: int, end: int) -> HeatmapRange:
+        return query_heatmap_range(self.connections.reader().cursor(), start, end, datetime.now().year)
 
     def get_city_history(self, city: str) -> BloomHistory:
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        return query_city_history(self.connections.reader().cursor(), city)
 
-        cursor.execute(f"SELECT year, day_of_year FROM bloom_history WHERE city = ?", (city,))
-        rows = cursor.fetchall()
+    def get_response_blob(self, kind: str, key: str) -> Optional[Tuple[bytes, str]]:
+        row = self.connections.reader().execute(
+            "SELECT body, etag, rendered_year FROM response_blobs WHERE kind = ? AND key = ?", (kind, key)
+        ).fetchone()
+        if row is None:
+            return None
+        body, etag, rendered_year = row
+        if kind == "heatmap" and (int(key) >= rendered_year) != (int(key) >= datetime.now().year):
+            # Rendered before the new year, whether the predictions show changed since
+            return None
+        return body, etag
 
-        cursor.execute("""
-            SELECT year, quantile_10, quantile_50, quantile_90
-            FROM bloom_predictions
-            WHERE city = ?
-        """, (city,))
-        preds = cursor.fetchone()
+    def get_heatmap_json(self, year: int) -> Optional[Tuple[bytes, str]]:
+        return self.get_response_blob("heatmap", str(year))
 
-        conn.close()
+    def get_city_history_json(self, city: str) -> Optional[Tuple[bytes, str]]:
+        return self.get_response_blob("history", city)
+
+    def get_data_version(self) -> Optional[str]:
+        etags = self.connections.reader().execute("SELECT etag FROM response_blobs ORDER BY kind, key").fetchall()
+        return hashlib.sha1("".join(row[0] for row in etags).encode("ascii")).hexdigest()
+
+    def get_years(self) -> List[int]:
+        rows = self.connections.reader().execute(
+            "SELECT year FROM bloom_history UNION SELECT year FROM bloom_predictions ORDER BY year").fetchall()
+        return [row[0] for row in rows]
+
+    def get_cities(self) -> List[str]:
+        return [row[0] for row in self.connections.reader().execute("SELECT city FROM cities ORDER BY city").fetchall()]
+
+    def close(self):
+        self.connections.close()
+
+
+class AsyncSQLiteDataService(AsyncDataService):
+    """
+    SQLiteDataService for the event loop. Queries run on a dedicated pool of I/O threads, each keeping its own reader
+    connection, so requests neither block the loop nor queue behind other work in Starlette's shared threadpool.
+    """
+
+    def __init__(self, db_path: str = "heatmap.db", io_workers: int = 4):
+        self.service = SQLiteDataService(db_path)
+        self.executor = ThreadPoolExecutor(max_workers=io_workers, thread_name_prefix="sqlite-io")
+
+    async def run(self, function, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, function, *args)
+
+    def sync_service(self) -> SQLiteDataService:
+        return self.service
+
+    async def is_first_time_initialized(self) -> bool:
+        return await self.run(self.service.is_first_time_initialized)
+
+    async def get_heatmap_points(self, year: int) -> List[HeatmapPoint]:
+        return await self.run(self.service.get_heatmap_points, year)
+
+    async def get_city_history(self, city: str) -> BloomHistory:
+        return await self.run(self.service.get_city_history, city)
+
+    async def get_heatmap_range(self, start: int, end: int) -> HeatmapRange:
+        return await self.run(self.service.get_heatmap_range, start, end)
+
+    async def get_heatmap_json(self, year: int) -> Optional[Tuple[bytes, str]]:
+        return await self.run(self.service.get_heatmap_json, year)
+
+    async def get_city_history_json(self, city: str) -> Optional[Tuple[bytes, str]]:
+        return await self.run(self.service.get_city_history_json, city)
+
+    async def get_data_version(self) -> Optional[str]:
+        return await self.run(self.service.get_data_version)
+
+    async def get_years(self) -> List[int]:
+        return await self.run(self.service.get_years)
+
+    async def get_cities(self) -> List[str]:
+        return await self.run(self.service.get_cities)
 
-        points = [BloomHistoryPoint(year=row[0], value=row[1]) for row in rows]
-        history = BloomHistory(points=points, prediction_year=preds[0], prediction_q10=preds[1], prediction_q50=preds[2], prediction_q90=preds[3])
-        return history
+    def close(self):
+        self.executor.shutdown(wait=True)
+        self.service.close()
@@ -0,0 +1,341 @@
+import json
+import os
+import shutil
+import sys
+from abc import ABC, abstractmethod
+from typing import List, Optional, Tuple
+
+import pandas as pd
+
+
+# Columns stored as UTC timestamps
+DATE_COLUMNS = ["date", "date_label"]
+
+CITY_STORAGE_FORMAT = os.getenv("CITY_STORAGE_FORMAT", "parquet")
+
+
+class CityStore(ABC):
+    """
+    Storage of one table per city, such as raw_cities or processed_cities.
+    Every table has a small metadata sidecar (last date, row count, columns) so freshness checks don't read the data.
+    """
+    extension = ""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def path(self, city: str) -> str:
+        return os.path.join(self.directory, f"{city}{self.extension}")
+
+    def metadata_path(self, city: str) -> str:
+        return os.path.join(self.directory, f"{city}{self.extension}.meta.json")
+
+    def list_cities(self) -> List[str]:
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(file[:-len(self.extension)] for file in os.listdir(self.directory) if file.endswith(self.extension))
+
+    def exists(self, city: str) -> bool:
+        return os.path.exists(self.path(city))
+
+    def signature(self, city: str) -> Tuple[int, int]:
+        """
+        :return: (modification time in ns, size) of the table, changes whenever it is rewritten or appended to
+        """
+        stat = os.stat(self.path(city))
+        return stat.st_mtime_ns, stat.st_size
+
+    @abstractmethod
+    def read(self, city: str, columns: Optional[List[str]] = None, start: int = 0) -> pd.DataFrame:
+        """
+        Reads the table of a city.
+
+        Args:
+            city (str): City to read.
+            columns (List[str]): Columns to read, all of them if None.
+            start (int): Index of the first row to read.
+
+        Returns:
+            pd.DataFrame: Rows from start on, with date columns parsed as UTC timestamps.
+        """
+
+    @abstractmethod
+    def _write(self, city: str, df: pd.DataFrame):
+        """
+        Replaces the data of a city.
+        """
+
+    @abstractmethod
+    def _append(self, city: str, df: pd.DataFrame):
+        """
+        Appends rows to the existing data of a city.
+        """
+
+    def write(self, city: str, df: pd.DataFrame):
+        os.makedirs(self.directory, exist_ok=True)
+        self._write(city, df)
+        self.save_metadata(city, self.describe(df))
+
+    def append(self, city: str, df: pd.DataFrame):
+        if len(df) == 0:
+            return
+        metadata = self.metadata(city)
+        if metadata is None:
+            self.write(city, df)
+            return
+
+        self._append(city, df)
+        new_metadata = self.describe(df)
+        new_metadata["row_count"] += metadata["row_count"]
+        if metadata["last_date"] is not None and (new_metadata["last_date"] is None
+                                                  or metadata["last_date"] > new_metadata["last_date"]):
+            new_metadata["last_date"] = metadata["last_date"]
+        self.save_metadata(city, new_metadata)
+
+    def tail(self, city: str, columns: Optional[List[str]] = None, rows: int = 1) -> pd.DataFrame:
+        """
+        Reads the last rows of a city, located through the metadata row count.
+        """
+        metadata = self.metadata(city)
+        return self.read(city, columns=columns, start=max(0, metadata["row_count"] - rows))
+
+    def metadata(self, city: str) -> Optional[dict]:
+        """
+        :return: {"last_date": ISO UTC timestamp, "row_count": int, "columns": [str]}, None if the city doesn't exist
+        """
+        if not self.exists(city):
+            return None
+
+        path = self.metadata_path(city)
+        if os.path.exists(path) and os.path.getmtime(path) >= os.path.getmtime(self.path(city)):
+            with open(path, "r") as f:
+                return json.load(f)
+
+        # Missing or stale sidecar, rebuild it from the data once
+        metadata = self.describe(self.read(city))
+        self.save_metadata(city, metadata)
+        return metadata
+
+    def last_date(self, city: str) -> Optional[pd.Timestamp]:
+        metadata = self.metadata(city)
+        if metadata is None or metadata["last_date"] is None:
+            return None
+        return pd.Timestamp(metadata["last_date"])
+
+    def save_metadata(self, city: str, metadata: dict):
+        path = self.metadata_path(city)
+        with open(path + ".tmp", "w") as f:
+            json.dump(metadata, f)
+        os.replace(path + ".tmp", path)
+
+    @staticmethod
+    def describe(df: pd.DataFrame) -> dict:
+        last_date = df["date"].max() if "date" in df.columns and len(df) > 0 else None
+        return {
+            "last_date": None if pd.isna(last_date) else pd.Timestamp(last_date).isoformat(),
+            "row_count": len(df),
+            "columns": [str(col) for col in df.columns],
+        }
+
+
+class CsvCityStore(CityStore):
+    """
+    Original CSV layout, one {city}.csv per city.
+    """
+    extension = ".csv"
+
+    def read(self, city: str, columns: Optional[List[str]] = None, start: int = 0) -> pd.DataFrame:
+        header = pd.read_csv(self.path(city), nrows=0).columns
+        dates = [col for col in DATE_COLUMNS if col in header and (columns is None or col in columns)]
+        df = pd.read_csv(self.path(city), usecols=columns, skiprows=range(1, start + 1) if start > 0 else None)
+        for col in dates:
+            df[col] = pd.to_datetime(df[col], utc=True)
+        return df
+
+    def _write(self, city: str, df: pd.DataFrame):
+        df.to_csv(self.path(city), index=False)
+
+    def _append(self, city: str, df: pd.DataFrame):
+        df.to_csv(self.path(city), mode="a", header=False, index=False)
+
+
+class ParquetCityStore(CityStore):
+    """
+    Columnar layout with typed columns and column projection. A city is a {city}.parquet directory of part files and a
+    manifest listing the parts of the table in order. Appends add a part with only the new rows, and once MAX_PARTS
+    parts accumulate the next append compacts them into one. Every change is published by replacing the manifest, so
+    readers switch from one complete table to the next at once. A single {city}.parquet file of an older layout is read
+    as is and turned into a directory on its first write.
+    Row groups are kept small so reads from a start row, such as tails, only decode the last groups.
+    """
+    extension = ".parquet"
+    ROW_GROUP_SIZE = 4096
+    MAX_PARTS = 32
+    MANIFEST = "manifest.json"
+
+    def manifest_path(self, city: str) -> str:
+        return os.path.join(self.path(city), self.MANIFEST)
+
+    def parts(self, city: str) -> List[str]:
+        path = self.path(city)
+        if os.path.isfile(path):
+            return [path]
+        try:
+            with open(self.manifest_path(city), "r") as f:
+                names = json.load(f)["parts"]
+        except FileNotFoundError:
+            # Directory written before manifests, its parts sort in order
+            names = sorted(file for file in os.listdir(path) if file.startswith("part-") and file.endswith(".parquet"))
+        return [os.path.join(path, name) for name in names]
+
+    def signature(self, city: str) -> Tuple[int, int]:
+        # Every change replaces the manifest, which changes the directory's modification time
+        stats = [os.stat(self.path(city))] + [os.stat(part) for part in self.parts(city)]
+        return max(stat.st_mtime_ns for stat in stats), sum(stat.st_size for stat in stats[1:])
+
+    def read(self, city: str, columns: Optional[List[str]] = None, start: int = 0) -> pd.DataFrame:
+        try:
+            return self.read_parts(self.parts(city), columns, start)
+        except FileNotFoundError:
+            # Parts of a manifest replaced while reading are deleted, the new manifest lists the current ones
+            return self.read_parts(self.parts(city), columns, start)
+
+    @staticmethod
+    def read_parts(parts: List[str], columns: Optional[List[str]], start: int) -> pd.DataFrame:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        # Skip the parts and row groups that end before start
+        tables = []
+        schema = None
+        first_row = 0
+        for part in parts:
+            parquet_file = pq.ParquetFile(part)
+            schema = parquet_file.schema_arrow
+            for group in range(parquet_file.num_row_groups):
+                group_rows = parquet_file.metadata.row_group(group).num_rows
+                if first_row + group_rows > start:
+                    table = parquet_file.read_row_groups(range(group, parquet_file.num_row_groups), columns=columns)
+                    tables.append(table.slice(max(0, start - first_row)))
+                    first_row += table.num_rows
+                    break
+                first_row += group_rows
+
+        if tables:
+            return pa.concat_tables(tables).to_pandas()
+        if schema is None:
+            # No parts at all
+            return pd.DataFrame(columns=columns or [])
+        # Everything is before start, or the table has no rows
+        empty_schema = schema if columns is None else pa.schema([schema.field(col) for col in columns])
+        return empty_schema.empty_table().to_pandas()
+
+    @classmethod
+    def write_part(cls, path: str, df: pd.DataFrame, schema=None):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        # Write then rename, so a part is complete before any manifest lists it
+        table = pa.Table.from_pandas(df, schema=schema, preserve_index=False)
+        pq.write_table(table, path + ".tmp", row_group_size=cls.ROW_GROUP_SIZE)
+        os.replace(path + ".tmp", path)
+
+    def publish(self, city: str, parts: List[str]):
+        """
+        Replaces the manifest with the given part file names and deletes the files no longer listed.
+        """
+        manifest_path = self.manifest_path(city)
+        with open(manifest_path + ".tmp", "w") as f:
+            json.dump({"parts": parts}, f)
+        os.replace(manifest_path + ".tmp", manifest_path)
+        for file in os.listdir(self.path(city)):
+            if file != self.MANIFEST and file not in parts:
+                os.remove(os.path.join(self.path(city), file))
+
+    def next_part_name(self, city: str) -> str:
+        numbers = [int(file[len("part-"):-len(".parquet")]) for file in os.listdir(self.path(city))
+                   if file.startswith("part-") and file.endswith(".parquet")]
+        return f"part-{max(numbers, default=-1) + 1:05d}.parquet"
+
+    def _write(self, city: str, df: pd.DataFrame):
+        path = self.path(city)
+        # Left by a crashed write of an earlier layout that swapped whole directories
+        shutil.rmtree(path + ".old", ignore_errors=True)
+        if os.path.isfile(path):
+            # Older single file layout, replaced by a directory once
+            tmp_path = path + ".tmp"
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            os.makedirs(tmp_path)
+            self.write_part(os.path.join(tmp_path, "part-00000.parquet"), df)
+            with open(os.path.join(tmp_path, self.MANIFEST), "w") as f:
+                json.dump({"parts": ["part-00000.parquet"]}, f)
+            os.remove(path)
+            os.rename(tmp_path, path)
+            return
+
+        os.makedirs(path, exist_ok=True)
+        name = self.next_part_name(city)
+        self.write_part(os.path.join(path, name), df)
+        self.publish(city, [name])
+
+    def _append(self, city: str, df: pd.DataFrame):
+        import pyarrow.parquet as pq
+
+        parts = self.parts(city)
+        if os.path.isfile(self.path(city)) or len(parts) >= self.MAX_PARTS:
+            self._write(city, pd.concat([self.read(city), df], ignore_index=True))
+            return
+
+        # New rows take the table's types, so every part has the same schema
+        schema = pq.read_schema(parts[-1]) if parts else None
+        name = self.next_part_name(city)
+        self.write_part(os.path.join(self.path(city), name), df, schema)
+        self.publish(city, [os.path.basename(part) for part in parts] + [name])
+
+
+STORE_TYPES = {
+    "csv": CsvCityStore,
+    "parquet": ParquetCityStore,
+}
+
+
+def city_store(directory: str, storage_format: str = None) -> CityStore:
+    """
+    :param storage_format: One of STORE_TYPES, defaults to CITY_STORAGE_FORMAT
+    """
+    return STORE_TYPES[storage_format or CITY_STORAGE_FORMAT](directory)
+
+
+def migrate_csv_tree(data_directory: str, storage_format: str = None, remove_csv: bool = False):
+    """
+    One-shot migration of the raw_cities and processed_cities CSV files into the configured store. Cities that are
+    already migrated are skipped, so it is safe to run on every job.
+    :param remove_csv: Delete each CSV file once its city is migrated
+    :return: Number of migrated tables
+    """
+    storage_format = storage_format or CITY_STORAGE_FORMAT
+    if STORE_TYPES[storage_format] is CsvCityStore:
+        return 0
+
+    migrated = 0
+    for name in ["raw_cities", "processed_cities"]:
+        directory = os.path.join(data_directory, name)
+        source = CsvCityStore(directory)
+        target = city_store(directory, storage_format)
+        for city in source.list_cities():
+            if not target.exists(city):
+                df = source.read(city)
+                target.write(city, df)
+                migrated += 1
+            if remove_csv and target.metadata(city)["row_count"] == source.metadata(city)["row_count"]:
+                os.remove(source.path(city))
+                if os.path.exists(source.metadata_path(city)):
+                    os.remove(source.metadata_path(city))
+    return migrated
+
+
+if __name__ == "__main__":
+    # python storage.py [data directory] [--remove-csv]
+    data_dir = next((arg for arg in sys.argv[1:] if not arg.startswith("--")), "data")
+    count = migrate_csv_tree(data_dir, remove_csv="--remove-csv" in sys.argv)
+    print(f"Migrated {count} city tables to {CITY_STORAGE_FORMAT}")
@@ -0,0 +1,128 @@
+import numpy as np
+import pandas as pd
+
+from benchmark import generate_synthetic_data
+from data_processing import extend_city, process_city
+from features import FeatureExtractor
+
+
+# Row-wise static features as they were computed before being vectorized, kept as the reference they must match
+
+def bloom_dates_dict(bloom_dates_csv: str):
+    df = pd.read_csv(bloom_dates_csv)
+    df.drop(["Currently Being Observed", "30 Year Average 1981-2010", "Notes"], axis=1, inplace=True)
+    df.set_index('Site Name', inplace=True)
+
+    bloom_dict = {}
+    for site_name, row in df.iterrows():
+        bloom_dict[site_name] = {}
+        for col, date_str in row.items():
+            if pd.isna(date_str) or date_str == '':
+                continue
+            bloom_dict[site_name][int(col)] = pd.to_datetime(date_str).tz_localize('UTC')
+    return bloom_dict
+
+
+def row_sunlight_length(row, latitude):
+    decl = 0.409 * np.sin(2 * np.pi * row['date'].dayofyear / 365 - 1.39)
+    cos_ha = np.clip(-np.tan(np.radians(latitude)) * np.tan(decl), -1, 1)
+    return np.arccos(cos_ha) / np.pi
+
+
+def row_global_average_temp_increase(row, latitude):
+    fractional_year = row['date'].year + (row['date'].timetuple().tm_yday / 365.25)
+    return 0.02392396 * fractional_year + -0.00447833 * latitude + -47.81821267686717
+
+
+def row_days_since_last_bloom(row, bloom_dates):
+    current_date = row['date']
+    current_bloom_date = bloom_dates.get(current_date.year, pd.NaT)
+    prev_bloom_date = bloom_dates.get(current_date.year - 1, pd.NaT)
+    if not pd.isna(current_bloom_date) and current_date >= current_bloom_date:
+        return pd.Series({'days': (current_date - current_bloom_date).days, 'available': True})
+    elif not pd.isna(prev_bloom_date) and not pd.isna(current_bloom_date):
+        return pd.Series({'days': (current_date - prev_bloom_date).days, 'available': True})
+    elif not pd.isna(prev_bloom_date) and (current_date - prev_bloom_date).days <= 400:
+        return pd.Series({'days': (current_date - prev_bloom_date).days, 'available': True})
+    return pd.Series({'days': -1, 'available': False})
+
+
+def row_date_label(row, bloom_dates):
+    current_date = row['date']
+    current_bloom_date = bloom_dates.get(current_date.year, pd.NaT)
+    next_bloom_date = bloom_dates.get(current_date.year + 1, pd.NaT)
+    if not pd.isna(current_bloom_date) and current_date <= current_bloom_date:
+        return current_bloom_date
+    elif not pd.isna(next_bloom_date) and not pd.isna(current_bloom_date):
+        return next_bloom_date
+    return pd.NaT
+
+
+def row_static_features(df, latitude, first_bloom_dates, full_bloom_dates):
+    expected = pd.DataFrame(index=df.index)
+    expected["sunlight_length"] = df.apply(row_sunlight_length, axis=1, args=(latitude,))
+    expected["global_average_temp_increase"] = df.apply(row_global_average_temp_increase, axis=1, args=(latitude,))
+    expected[['days_since_prev_first_bloom', 'first_bloom_data_available']] = df.apply(
+        row_days_since_last_bloom, axis=1, args=(first_bloom_dates,))
+    expected[['days_since_prev_full_bloom', 'full_bloom_data_available']] = df.apply(
+        row_days_since_last_bloom, axis=1, args=(full_bloom_dates,))
+    date_label = pd.DatetimeIndex(df.apply(row_date_label, axis=1, args=(full_bloom_dates,)))
+    expected["date_label"] = date_label
+    expected["label"] = date_label.dayofyear.to_numpy(dtype=np.float64)
+    return expected
+
+
+def test_vectorized_static_features_match_the_row_wise_features(tmp_path):
+    data_directory = str(tmp_path)
+    generate_synthetic_data(data_directory, cities=3, years=4)
+    extractor = FeatureExtractor(data_directory)
+    first_bloom_dates = bloom_dates_dict(str(tmp_path / "sakura_first_bloom_dates.csv"))
+    full_bloom_dates = bloom_dates_dict(str(tmp_path / "sakura_full_bloom_dates.csv"))
+
+    for city in extractor.city_names:
+        df = extractor.raw_store.read(city)
+        extractor.build_static_features(df, city)
+        latitude = extractor.cities_metadata_df.loc[city, "latitude"]
+        expected = row_static_features(df, latitude, first_bloom_dates[city], full_bloom_dates[city])
+
+        for column in ["sunlight_length", "global_average_temp_increase"]:
+            np.testing.assert_allclose(df[column].to_numpy(), expected[column].to_numpy(), rtol=0, atol=1e-12)
+        for column in ["days_since_prev_first_bloom", "days_since_prev_full_bloom"]:
+            np.testing.assert_array_equal(df[column].to_numpy(), expected[column].to_numpy(dtype=np.int64))
+        for column in ["first_bloom_data_available", "full_bloom_data_available"]:
+            np.testing.assert_array_equal(df[column].to_numpy(), expected[column].to_numpy(dtype=bool))
+        np.testing.assert_array_equal(df["label"].to_numpy(), expected["label"].to_numpy())
+        pd.testing.assert_series_equal(df["date_label"], expected["date_label"].astype(df["date_label"].dtype),
+                                       check_names=False)
+        # Rows without a bloom date to label them are covered too
+        assert not df["full_bloom_data_available"].all()
+        assert df["label"].isna().any()
+
+
+def test_extending_a_city_in_chunks_matches_a_full_rebuild(tmp_path):
+    data_directory = str(tmp_path)
+    generate_synthetic_data(data_directory, cities=2, years=3)
+    extractor = FeatureExtractor(data_directory)
+    city = extractor.city_names[0]
+    raw = extractor.raw_store.read(city)
+
+    # Start in November, so the appended chunks cross the December season start, the new year and a bloom
+    start = int((raw["date"] < pd.Timestamp("2024-11-20", tz="UTC")).sum())
+    extractor.raw_store.write(city, raw.iloc[:start].reset_index(drop=True))
+    process_city(extractor, city)
+
+    for size in [5, 9, 1, 30, 14, 60, 200]:
+        chunk = raw.iloc[start:start + size].reset_index(drop=True)
+        start += size
+        if len(chunk) == 0:
+            break
+        extractor.raw_store.append(city, chunk)
+        assert extend_city(extractor, city)
+    assert start >= len(raw)
+
+    expected = raw.copy()
+    extractor.build_static_features(expected, city)
+    extractor.build_temporal_features(expected)
+    extended = extractor.processed_store.read(city)
+    assert len(extended) == len(raw)
+    pd.testing.assert_frame_equal(extended[expected.columns], expected, check_dtype=False, rtol=1e-9)
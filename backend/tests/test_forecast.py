@@ -0,0 +1,80 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from forecast import MISSING_TYPES, CompiledForest, ForecastService
+from model import QUANTILES, update_models
+from model_registry import ModelRegistry
+from storage import city_store
+
+
+def processed_rows(days: int, seed: int) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    gdd = rng.uniform(0, 100, days)
+    chill_days = rng.integers(0, 5, days).astype(np.float64)
+    temp_roll_7 = rng.normal(10, 5, days)
+    # Missing values and exact zeros, so splits with every missing type are learned
+    temp_roll_7[rng.random(days) < 0.15] = np.nan
+    return pd.DataFrame({
+        "date": pd.date_range("2020-01-01", periods=days, freq="D", tz="UTC"),
+        "GDD_accumulation": gdd,
+        "temp_roll_7": temp_roll_7,
+        "chill_days": chill_days,
+        "label": np.round(60 + gdd / 4 + np.nan_to_num(temp_roll_7) + rng.normal(0, 3, days)),
+    })
+
+
+@pytest.fixture(scope="module")
+def data_directory(tmp_path_factory):
+    directory = tmp_path_factory.mktemp("data")
+    store = city_store(str(directory / "processed_cities"))
+    for i in range(3):
+        store.write(f"City{i}", processed_rows(300, i))
+    update_models(str(directory / "processed_cities"), ModelRegistry(str(directory / "models")), core_budget=1)
+    return str(directory)
+
+
+def test_compiled_forest_matches_booster_predict(data_directory):
+    models = ModelRegistry(os.path.join(data_directory, "models")).load()
+    boosters = [models[q] for q in QUANTILES]
+    forest = CompiledForest(boosters)
+    assert MISSING_TYPES["NaN"] in forest.missing_type
+
+    rng = np.random.default_rng(1)
+    features = rng.normal([50, 10, 2], [40, 8, 2], (200, 3))
+    features[rng.random(features.shape) < 0.2] = np.nan
+    features[rng.random(features.shape) < 0.1] = 0.0
+    # Values exactly on a split threshold take the left child
+    nodes = rng.choice(len(forest.feature), 200, replace=False)
+    on_threshold = np.tile(np.nanmedian(features, axis=0), (len(nodes), 1))
+    on_threshold[np.arange(len(nodes)), forest.feature[nodes]] = forest.threshold[nodes]
+    features = np.vstack([features, on_threshold])
+
+    expected = np.column_stack([booster.predict(features) for booster in boosters])
+    np.testing.assert_allclose(forest.predict(features), expected, rtol=1e-12, atol=1e-9)
+    np.testing.assert_allclose(forest.predict(features[0]), expected[:1], rtol=1e-12, atol=1e-9)
+
+
+def test_forecast_uses_the_latest_row_on_or_before_the_date(data_directory):
+    service = ForecastService(data_directory)
+    models = ModelRegistry(os.path.join(data_directory, "models")).load()
+    df = city_store(os.path.join(data_directory, "processed_cities")).read("City1")
+    features = df[models[0.5].feature_name()].to_numpy(dtype=np.float64)
+
+    forecast = service.forecast("City1")
+    assert forecast["model_version"] == 1
+    assert forecast[0.5] == pytest.approx(models[0.5].predict(features[-1:])[0])
+
+    # as_of is a day in Japan, 2020-01-11 00:00 JST comes before the row stored at 2020-01-11 00:00 UTC
+    forecast = service.forecast("City1", as_of="2020-01-11")
+    assert forecast["as_of"].isoformat() == "2020-01-10"
+    assert forecast[0.1] == pytest.approx(models[0.1].predict(features[9:10])[0])
+
+
+def test_forecast_without_data(data_directory):
+    service = ForecastService(data_directory)
+    assert service.forecast("Atlantis") is None
+    assert service.forecast("City0", as_of="2019-12-31") is None
+    assert ForecastService(os.path.join(data_directory, "empty")).forecast("City0") is None
@@ -0,0 +1,194 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+import pytest
+import requests
+
+import data_processing
+from data_processing import download_raw_batch, is_ingestion_cooling_down, update_raw_cities
+from features import RAW_COLUMNS
+from storage import city_store
+
+
+class NoLimit:
+    def acquire(self, weight):
+        pass
+
+    def pause(self, seconds):
+        pass
+
+
+def test_download_retries_connection_errors_and_does_not_sleep_after_the_last_attempt(monkeypatch):
+    calls = []
+    sleeps = []
+
+    def failing_download(*args):
+        calls.append(args)
+        raise requests.exceptions.ConnectionError("connection refused")
+
+    monkeypatch.setattr(data_processing, "get_meteorological_data_batch", failing_download)
+    monkeypatch.setattr(data_processing.time, "sleep", sleeps.append)
+    metadata = pd.DataFrame({"latitude": [35.7], "longitude": [139.7]}, index=["Tokyo"])
+    latest_dates = {"Tokyo": pd.Timestamp("2024-01-01", tz="UTC")}
+
+    error = download_raw_batch(["Tokyo"], "unused", metadata, latest_dates, NoLimit())
+
+    assert "ConnectionError" in error
+    assert len(calls) == data_processing.INGESTION_MAX_ATTEMPTS
+    assert len(sleeps) == data_processing.INGESTION_MAX_ATTEMPTS - 1
+
+
+def test_cities_failing_many_runs_cool_down():
+    recent = datetime.now().isoformat()
+    old = (datetime.now() - data_processing.INGESTION_QUEUE_COOLDOWN - timedelta(hours=1)).isoformat()
+    limit = data_processing.INGESTION_QUEUE_MAX_ATTEMPTS
+
+    assert not is_ingestion_cooling_down(None)
+    assert not is_ingestion_cooling_down({"attempts": limit - 1, "error": "", "last_attempt": recent})
+    assert is_ingestion_cooling_down({"attempts": limit, "error": "", "last_attempt": recent})
+    assert not is_ingestion_cooling_down({"attempts": limit, "error": "", "last_attempt": old})
+
+
+def test_cooling_down_cities_are_not_downloaded(tmp_path, monkeypatch):
+    monkeypatch.setattr(data_processing, "download_raw_batch",
+                        lambda *args: (_ for _ in ()).throw(AssertionError("should not download")))
+    queue_path = str(tmp_path / "queue.json")
+    data_processing.save_ingestion_queue(queue_path, {"Tokyo": {
+        "attempts": data_processing.INGESTION_QUEUE_MAX_ATTEMPTS, "error": "HTTPError: 500",
+        "last_attempt": datetime.now().isoformat()}})
+    metadata = pd.DataFrame({"latitude": [35.7], "longitude": [139.7]}, index=["Tokyo"])
+    raw_cities_directory = str(tmp_path / "raw_cities")
+    city_store(raw_cities_directory).write("Tokyo", pd.DataFrame({"date": [pd.Timestamp("2024-01-01", tz="UTC")]}))
+
+    errors = update_raw_cities(["Tokyo"], raw_cities_directory, metadata, queue_path=queue_path)
+
+    assert errors["Tokyo"].startswith("Skipped after")
+    assert data_processing.load_ingestion_queue(queue_path)["Tokyo"]["attempts"] == \
+        data_processing.INGESTION_QUEUE_MAX_ATTEMPTS
+
+
+def test_tables_without_dates_are_downloaded_from_the_history_start(tmp_path, monkeypatch):
+    downloads = []
+
+    def download(latitudes, longitudes, start_date, end_date):
+        downloads.append(start_date)
+        dates = pd.date_range(data_processing.RAW_HISTORY_START, periods=3, freq="D")
+        return [pd.DataFrame({"date": dates, "rain_sum": [0.0, 1.0, 2.0]})]
+
+    monkeypatch.setattr(data_processing, "get_meteorological_data_batch", download)
+    raw_cities_directory = str(tmp_path / "raw_cities")
+    store = city_store(raw_cities_directory)
+    store.write("Tokyo", pd.DataFrame({"date": pd.Series([], dtype="datetime64[ns, UTC]"), "rain_sum": []}))
+    metadata = pd.DataFrame({"latitude": [35.7], "longitude": [139.7]}, index=["Tokyo"])
+
+    errors = update_raw_cities(["Tokyo"], raw_cities_directory, metadata, rate_limiter=NoLimit())
+
+    assert errors == {}
+    assert downloads == [data_processing.RAW_HISTORY_START.strftime("%Y-%m-%d")]
+    assert store.read("Tokyo")["rain_sum"].tolist() == [0.0, 1.0, 2.0]
+    assert store.last_date("Tokyo") == data_processing.RAW_HISTORY_START + pd.Timedelta(days=2)
+
+
+class FakeVariable:
+    def __init__(self, values):
+        self.values = values
+
+    def ValuesAsNumpy(self):
+        return self.values
+
+
+class FakeDaily:
+    def __init__(self, start_date: str, end_date: str, value: float):
+        self.start = pd.Timestamp(start_date, tz="Asia/Tokyo")
+        self.end = pd.Timestamp(end_date, tz="Asia/Tokyo") + pd.Timedelta(days=1)
+        self.value = value
+
+    def Time(self):
+        return int(self.start.timestamp())
+
+    def TimeEnd(self):
+        return int(self.end.timestamp())
+
+    def Interval(self):
+        return 86400
+
+    def Variables(self, i):
+        return FakeVariable(np.full((self.end - self.start).days, self.value + i, dtype=np.float32))
+
+
+class FakeResponse:
+    def __init__(self, daily: FakeDaily):
+        self.daily = daily
+
+    def Daily(self):
+        return self.daily
+
+
+class FakeOpenMeteoClient:
+    """
+    Answers multi-location archive requests with the latitude of each location as its weather, offset by the index of
+    the variable, so every downloaded table shows which location it came from.
+    """
+    def __init__(self, drop_locations: int = 0):
+        self.drop_locations = drop_locations
+        self.requests = []
+
+    def weather_api(self, url, params):
+        self.requests.append((url, params))
+        latitudes = params["latitude"][:len(params["latitude"]) - self.drop_locations]
+        return [FakeResponse(FakeDaily(params["start_date"], params["end_date"], latitude)) for latitude in latitudes]
+
+
+def test_stale_cities_are_batched_by_location_count_and_start_date():
+    start = pd.Timestamp("2024-01-01", tz="UTC")
+    # A dense group larger than one request, then two groups further apart than the allowed spread
+    latest_dates = {f"City{i:03d}": start + pd.Timedelta(hours=i) for i in range(120)}
+    latest_dates.update({f"Late{i}": start + pd.Timedelta(days=30 + i) for i in range(20)})
+    latest_dates["Last"] = start + pd.Timedelta(days=60)
+
+    batches = data_processing.batch_stale_cities(list(reversed(latest_dates)), latest_dates)
+
+    assert sorted(city for batch in batches for city in batch) == sorted(latest_dates)
+    for batch in batches:
+        assert len(batch) <= data_processing.MAX_LOCATIONS_PER_REQUEST
+        dates = [latest_dates[city] for city in batch]
+        assert max(dates) - min(dates) <= data_processing.MAX_START_DATE_SPREAD
+    assert [len(batch) for batch in batches] == [50, 50, 20, 15, 5, 1]
+
+
+def test_batch_responses_are_mapped_back_to_their_cities(tmp_path, monkeypatch):
+    client = FakeOpenMeteoClient()
+    monkeypatch.setattr(data_processing, "get_openmeteo_client", lambda: client)
+    metadata = pd.DataFrame({"latitude": [35.0, 43.0, 26.0, 38.0], "longitude": [139.0, 141.0, 127.0, 140.0]},
+                            index=["Tokyo", "Sapporo", "Naha", "Sendai"])
+    raw_cities_directory = str(tmp_path / "raw_cities")
+    store = city_store(raw_cities_directory)
+    today = pd.Timestamp.now(tz="Asia/Tokyo").normalize()
+    # Sendai is too far behind to share the request of the other cities
+    for city, days_behind in [("Tokyo", 10), ("Sapporo", 12), ("Naha", 10), ("Sendai", 40)]:
+        latitude = metadata.loc[city, "latitude"]
+        date = (today - pd.Timedelta(days=days_behind)).tz_convert("UTC")
+        store.write(city, pd.DataFrame({"date": [date], **{column: [np.float32(latitude + i)]
+                                                           for i, column in enumerate(RAW_COLUMNS)}}))
+
+    errors = update_raw_cities(list(metadata.index), raw_cities_directory, metadata, workers=1,
+                               rate_limiter=NoLimit())
+
+    assert errors == {}
+    assert sorted(len(params["latitude"]) for _, params in client.requests) == [1, 3]
+    assert all(url == data_processing.OPEN_METEO_ARCHIVE_URL for url, _ in client.requests)
+    end_date = (today - pd.Timedelta(days=2)).tz_convert("UTC")
+    for city in metadata.index:
+        df = store.read(city)
+        assert df["date"].iloc[-1] == end_date
+        assert df["date"].is_unique and df["date"].is_monotonic_increasing
+        for i, column in enumerate(RAW_COLUMNS):
+            assert (df[column] == np.float32(metadata.loc[city, "latitude"] + i)).all()
+
+
+def test_batch_response_count_mismatch_raises(monkeypatch):
+    monkeypatch.setattr(data_processing, "get_openmeteo_client", lambda: FakeOpenMeteoClient(drop_locations=1))
+
+    with pytest.raises(ValueError, match="Expected 2 locations"):
+        data_processing.get_meteorological_data_batch([35.0, 43.0], [139.0, 141.0], "2024-01-01", "2024-01-10")
@@ -0,0 +1,52 @@
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from interfaces import BloomHistory, BloomHistoryPoint, HeatmapPoint
+from response_cache import ResponseCache, render_blob
+
+
+class StubDataService:
+    async def get_heatmap_json(self, year):
+        return render_blob([HeatmapPoint(city="Tokyo", city_jp="東京", lat=35.7, lng=139.7, value=84,
+                                         is_prediction=False)])
+
+    async def get_city_history_json(self, city):
+        return render_blob(BloomHistory(points=[BloomHistoryPoint(year=2024, value=84)], prediction_year=2025,
+                                        prediction_q10=80.0, prediction_q50=84.0, prediction_q90=88.0))
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(main, "dataService", StubDataService())
+    monkeypatch.setattr(main, "response_cache", ResponseCache())
+    monkeypatch.setattr(main, "known_years", [2000, 2001, 2024, 2025])
+    monkeypatch.setattr(main, "known_cities", frozenset(["Tokyo", "Sapporo"]))
+    # Startup events are not run, the app is served without the daily job
+    return TestClient(main.app)
+
+
+def test_unknown_years_and_cities_are_rejected_without_caching(client):
+    assert client.get("/heatmap", params={"year": 1999}).status_code == 422
+    assert client.get("/heatmap", params={"year": 2026}).status_code == 422
+    assert client.get("/history", params={"city": "Atlantis"}).status_code == 404
+    assert client.get("/history", params={"city": "tokyo"}).status_code == 404
+
+    assert main.response_cache.entries == {}
+    assert main.response_cache.stats["misses"] == 0
+
+
+def test_known_years_and_cities_are_cached(client):
+    assert client.get("/heatmap", params={"year": 2010}).json()[0]["city"] == "Tokyo"
+    assert client.get("/history", params={"city": "Tokyo"}).json()["prediction_year"] == 2025
+
+    assert list(main.response_cache.entries) == [main.heatmap_key(2010), "history:Tokyo"]
+
+
+def test_requests_before_the_data_is_loaded(client, monkeypatch):
+    monkeypatch.setattr(main, "known_years", [])
+    monkeypatch.setattr(main, "known_cities", frozenset())
+
+    assert client.get("/heatmap", params={"year": 2024}).status_code == 404
+    assert client.get("/history", params={"city": "Tokyo"}).status_code == 404
+    assert main.response_cache.entries == {}
@@ -0,0 +1,94 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from data_processing import build_training_matrix
+from model import CONTINUE_BOOST_ROUND, load_training_dataset, model_feature_columns, training_data_fingerprint, \
+    update_models
+from model_registry import ModelRegistry
+from storage import city_store
+
+
+def processed_rows(start: str, days: int, labelled: bool, seed: int) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        "date": pd.date_range(start, periods=days, freq="D", tz="UTC"),
+        "GDD": rng.uniform(0, 100, days),
+        "temp_roll_7": rng.normal(10, 5, days),
+        "chill_days": rng.uniform(0, 50, days),
+        "label": rng.integers(60, 120, days).astype(np.float64) if labelled else np.nan,
+    })
+
+
+def write_processed_cities(directory: str, cities: int = 3):
+    store = city_store(directory)
+    for i in range(cities):
+        store.write(f"City{i}", pd.concat([processed_rows("2020-01-01", 300, True, i),
+                                           processed_rows("2020-10-27", 30, False, 100 + i)], ignore_index=True))
+    return store
+
+
+def labelled_fingerprint(directory: str):
+    return training_data_fingerprint(*build_training_matrix(directory, model_feature_columns(directory)))
+
+
+def test_feature_columns_without_processed_tables(tmp_path):
+    with pytest.raises(ValueError, match="No processed city tables"):
+        model_feature_columns(str(tmp_path / "processed_cities"))
+
+
+def test_training_fingerprint_ignores_unlabelled_days(tmp_path):
+    directory = str(tmp_path / "processed_cities")
+    store = write_processed_cities(directory)
+    before = labelled_fingerprint(directory)
+
+    store.append("City0", processed_rows("2020-11-26", 5, False, 7))
+    assert labelled_fingerprint(directory) == before
+
+    df = store.read("City1")
+    df.loc[0, "label"] += 1
+    store.write("City1", df)
+    assert labelled_fingerprint(directory) != before
+
+
+def test_dataset_cache_survives_unlabelled_appends(tmp_path):
+    directory = str(tmp_path / "processed_cities")
+    cache_directory = str(tmp_path / "dataset_cache")
+    store = write_processed_cities(directory)
+    dataset = load_training_dataset(directory, cache_directory)
+    assert dataset.num_data() == 900
+    [cache_file] = os.listdir(cache_directory)
+    cache_mtime = os.stat(os.path.join(cache_directory, cache_file)).st_mtime_ns
+
+    store.append("City2", processed_rows("2020-11-26", 5, False, 8))
+    dataset = load_training_dataset(directory, cache_directory)
+
+    assert dataset.num_data() == 900
+    assert os.listdir(cache_directory) == [cache_file]
+    assert os.stat(os.path.join(cache_directory, cache_file)).st_mtime_ns == cache_mtime
+
+
+def test_models_are_reused_while_the_labelled_rows_are_unchanged(tmp_path):
+    directory = str(tmp_path / "processed_cities")
+    store = write_processed_cities(directory)
+    registry = ModelRegistry(str(tmp_path / "models"))
+    models, action = update_models(directory, registry, core_budget=1)
+    assert action.startswith("trained v1")
+    trees = models[0.5].num_trees()
+
+    store.append("City0", processed_rows("2020-11-26", 5, False, 9))
+    models, action = update_models(directory, registry, core_budget=1)
+
+    assert action is None
+    assert [entry["version"] for entry in registry.versions()] == [1]
+    assert models[0.5].num_trees() == trees
+
+    df = store.read("City1")
+    df.loc[0, "label"] += 1
+    store.write("City1", df)
+    models, action = update_models(directory, registry, core_budget=1)
+
+    assert action == "continued v1 as v2"
+    assert models[0.5].num_trees() == trees + CONTINUE_BOOST_ROUND
@@ -0,0 +1,62 @@
+import pandas as pd
+
+import pipeline
+from benchmark import generate_synthetic_data
+from features import RAW_COLUMNS
+from storage import city_store
+
+
+class RecordingDataService:
+    def __init__(self):
+        self.predictions = None
+
+    def is_first_time_initialized(self):
+        return self.predictions is not None
+
+    def set_history(self, data_directory, context=None):
+        pass
+
+    def set_predictions(self, data_directory, predictions, context=None):
+        self.predictions = predictions
+
+
+def append_raw_day(raw_cities_directory: str):
+    # One more unlabelled day per city, like a daily weather download
+    store = city_store(raw_cities_directory)
+    for city in store.list_cities():
+        tail = store.tail(city)
+        day = tail.assign(date=tail["date"] + pd.Timedelta(days=1))
+        day[RAW_COLUMNS] = day[RAW_COLUMNS] + 0.5
+        store.append(city, day.reset_index(drop=True))
+    return {}
+
+
+def stage_statuses(report):
+    return {stage["stage"]: stage["status"] for stage in report.stages}
+
+
+def test_unlabelled_days_update_the_predictions_without_training(tmp_path, monkeypatch):
+    data_directory = str(tmp_path)
+    generate_synthetic_data(data_directory, cities=3, years=6)
+    monkeypatch.setattr(pipeline, "update_bloom_date_files", lambda *args: None)
+    monkeypatch.setattr(pipeline, "update_raw_cities", lambda *args, **kwargs: {})
+    data_service = RecordingDataService()
+
+    report = pipeline.run_daily_job(data_directory, data_service)
+    assert stage_statuses(report)["training"] == "ran"
+    assert stage_statuses(report)["predict"] == "ran"
+    first_predictions = data_service.predictions
+
+    report = pipeline.run_daily_job(data_directory, data_service)
+    assert stage_statuses(report)["training"] == "skipped"
+    assert stage_statuses(report)["predict"] == "skipped"
+
+    monkeypatch.setattr(pipeline, "update_raw_cities",
+                        lambda cities, raw_cities_directory, *args, **kwargs: append_raw_day(raw_cities_directory))
+    report = pipeline.run_daily_job(data_directory, data_service)
+    statuses = stage_statuses(report)
+    assert statuses["features"] == "ran"
+    assert statuses["training"] == "skipped"
+    assert statuses["predict"] == "ran"
+    assert set(data_service.predictions) == set(first_predictions)
+    assert len(pipeline.ModelRegistry(str(tmp_path / "models")).versions()) == 1
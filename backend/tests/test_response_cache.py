@@ -0,0 +1,83 @@
+import asyncio
+
+import pytest
+
+from response_cache import ResponseCache, render_blob
+from interfaces import BloomHistoryPoint
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def test_concurrent_misses_share_one_load():
+    async def scenario():
+        cache = ResponseCache()
+        loads = 0
+
+        async def load():
+            nonlocal loads
+            loads += 1
+            await asyncio.sleep(0.01)
+            return render_blob(BloomHistoryPoint(year=2000, value=90))
+
+        blobs = await asyncio.gather(*[cache.get_or_load("key", load) for _ in range(10)])
+        return cache, loads, blobs
+
+    cache, loads, blobs = run(scenario())
+    assert loads == 1
+    assert len(set(blobs)) == 1
+    assert cache.stats["coalesced"] == 9
+    assert not cache.in_flight
+
+
+def test_cancelled_leader_does_not_cancel_waiters():
+    async def scenario():
+        cache = ResponseCache()
+        release = asyncio.Event()
+
+        async def load():
+            await release.wait()
+            return render_blob(BloomHistoryPoint(year=2000, value=90))
+
+        leader = asyncio.ensure_future(cache.get_or_load("key", load))
+        await asyncio.sleep(0)
+        waiter = asyncio.ensure_future(cache.get_or_load("key", load))
+        await asyncio.sleep(0)
+
+        # e.g. the leader's client disconnected
+        leader.cancel()
+        await asyncio.sleep(0)
+        release.set()
+        return cache, leader, await waiter
+
+    cache, leader, blob = run(scenario())
+    assert leader.cancelled()
+    assert blob == render_blob(BloomHistoryPoint(year=2000, value=90))
+    assert cache.entries["key"] == blob
+    assert not cache.in_flight
+
+
+def test_waiters_get_the_load_error_and_it_is_not_cached():
+    async def scenario():
+        cache = ResponseCache()
+
+        async def load():
+            await asyncio.sleep(0.01)
+            raise KeyError("city")
+
+        results = await asyncio.gather(*[cache.get_or_load("key", load) for _ in range(3)], return_exceptions=True)
+        return cache, results
+
+    cache, results = run(scenario())
+    assert all(isinstance(result, KeyError) for result in results)
+    assert "key" not in cache.entries
+    assert not cache.in_flight
+
+
+def test_load_error_is_raised_to_a_single_caller():
+    async def load():
+        raise ValueError("broken")
+
+    with pytest.raises(ValueError):
+        run(ResponseCache().get_or_load("key", load))
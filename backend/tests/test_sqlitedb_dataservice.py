@@ -0,0 +1,90 @@
+import sqlite3
+from datetime import datetime
+
+from response_cache import render_blob
+from sqlitedb_dataservice import SCHEMA_VERSION, SQLiteDataService, schema_version
+
+
+CITIES = {"Tokyo": ("東京", 35.69, 139.69), "Sapporo": ("札幌", 43.06, 141.35), "Naha": ("那覇", 26.21, 127.68)}
+
+
+def write_legacy_database(db_path: str, current_year: int):
+    # Unversioned schema, every row repeats the city metadata and no table has keys
+    conn = sqlite3.connect(db_path)
+    conn.execute("CREATE TABLE bloom_history (city TEXT, jp TEXT, year INT, lat REAL, lon REAL, day_of_year INT)")
+    conn.execute("CREATE TABLE bloom_predictions (city TEXT, year INT, jp TEXT, lat REAL, lon REAL, "
+                 "quantile_10 REAL, quantile_50 REAL, quantile_90 REAL)")
+    history = [("Sapporo", current_year - 1, 125), ("Tokyo", current_year, 84), ("Tokyo", current_year - 2, 82),
+               ("Naha", current_year - 2, 20), ("Tokyo", current_year - 1, 80), ("Sapporo", current_year - 2, 128)]
+    for city, year, day in history:
+        jp, lat, lon = CITIES[city]
+        conn.execute("INSERT INTO bloom_history VALUES (?, ?, ?, ?, ?, ?)", (city, jp, year, lat, lon, day))
+    predictions = [("Tokyo", current_year + 1, 78.5, 83.0, 88.5), ("Sapporo", current_year, 120.0, 124.5, 130.0)]
+    for city, year, q10, q50, q90 in predictions:
+        jp, lat, lon = CITIES[city]
+        conn.execute("INSERT INTO bloom_predictions VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                     (city, year, jp, lat, lon, q10, q50, q90))
+    conn.commit()
+    conn.close()
+
+
+def legacy_heatmap(conn: sqlite3.Connection, year: int, current_year: int):
+    # Rows of /heatmap?year= as the unversioned schema served them
+    points = [(*row, False) for row in conn.execute(
+        "SELECT city, jp, lat, lon, day_of_year FROM bloom_history WHERE year = ?", (year,))]
+    if year >= current_year:
+        cities = {point[0] for point in points}
+        points += [(*row, True) for row in conn.execute(
+            "SELECT city, jp, lat, lon, quantile_50 FROM bloom_predictions WHERE year = ?", (year,))
+            if row[0] not in cities]
+    return sorted(points)
+
+
+def legacy_history(conn: sqlite3.Connection, city: str):
+    points = sorted(conn.execute("SELECT year, day_of_year FROM bloom_history WHERE city = ?", (city,)).fetchall())
+    prediction = conn.execute("SELECT year, quantile_10, quantile_50, quantile_90 FROM bloom_predictions "
+                              "WHERE city = ?", (city,)).fetchone()
+    return points, prediction
+
+
+def test_legacy_database_is_migrated_in_place(tmp_path):
+    db_path = str(tmp_path / "heatmap.db")
+    current_year = datetime.now().year
+    write_legacy_database(db_path, current_year)
+    years = range(current_year - 2, current_year + 2)
+    with sqlite3.connect(db_path) as conn:
+        heatmaps = {year: legacy_heatmap(conn, year, current_year) for year in years}
+        histories = {city: legacy_history(conn, city) for city in ["Tokyo", "Sapporo"]}
+
+    service = SQLiteDataService(db_path)
+    try:
+        conn = service.connections.reader()
+        assert schema_version(conn) == SCHEMA_VERSION
+        tables = dict(conn.execute("SELECT name, sql FROM sqlite_master WHERE type = 'table'").fetchall())
+        assert set(tables) == {"schema_version", "cities", "bloom_history", "bloom_predictions", "response_blobs"}
+        for table in ["cities", "bloom_history", "bloom_predictions", "response_blobs"]:
+            assert tables[table].rstrip().endswith("WITHOUT ROWID")
+
+        assert service.get_cities() == ["Naha", "Sapporo", "Tokyo"]
+        assert service.get_years() == list(years)
+        for year in years:
+            points = service.get_heatmap_points(year)
+            assert sorted((p.city, p.city_jp, p.lat, p.lng, p.value, p.is_prediction) for p in points) == heatmaps[year]
+            assert service.get_heatmap_json(year) == render_blob(points)
+        for city, (points, prediction) in histories.items():
+            history = service.get_city_history(city)
+            assert [(p.year, p.value) for p in history.points] == points
+            assert (history.prediction_year, history.prediction_q10, history.prediction_q50,
+                    history.prediction_q90) == prediction
+            assert service.get_city_history_json(city) == render_blob(history)
+        data_version = service.get_data_version()
+    finally:
+        service.close()
+
+    # Opening a migrated database leaves it as is
+    service = SQLiteDataService(db_path)
+    try:
+        assert service.get_data_version() == data_version
+        assert schema_version(service.connections.reader()) == SCHEMA_VERSION
+    finally:
+        service.close()
@@ -0,0 +1,113 @@
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+
+from storage import ParquetCityStore
+
+
+def daily_rows(start: str, days: int, first_value: float = 0.0) -> pd.DataFrame:
+    return pd.DataFrame({"date": pd.date_range(start, periods=days, freq="D", tz="UTC"),
+                         "value": np.arange(days, dtype=np.float64) + first_value})
+
+
+def test_parquet_append_adds_a_part_with_only_the_new_rows(tmp_path):
+    store = ParquetCityStore(str(tmp_path))
+    store.write("Tokyo", daily_rows("2020-01-01", 10000))
+    first_part = os.path.join(store.path("Tokyo"), "part-00000.parquet")
+    first_mtime = os.stat(first_part).st_mtime_ns
+
+    store.append("Tokyo", daily_rows("2047-05-19", 3, first_value=10000))
+
+    assert os.stat(first_part).st_mtime_ns == first_mtime
+    assert len(store.parts("Tokyo")) == 2
+    assert pq.ParquetFile(store.parts("Tokyo")[-1]).metadata.num_rows == 3
+    df = store.read("Tokyo")
+    assert len(df) == 10003
+    assert df["value"].tolist() == list(range(10003))
+    assert store.metadata("Tokyo")["row_count"] == 10003
+    assert store.last_date("Tokyo") == df["date"].iloc[-1]
+    assert store.tail("Tokyo", columns=["value"], rows=5)["value"].tolist() == list(range(9998, 10003))
+    assert store.list_cities() == ["Tokyo"]
+
+
+def test_parquet_append_compacts_parts(tmp_path):
+    store = ParquetCityStore(str(tmp_path))
+    store.write("Tokyo", daily_rows("2020-01-01", 1))
+    for day in range(1, store.MAX_PARTS + 1):
+        store.append("Tokyo", daily_rows("2020-01-01", 1, first_value=day).assign(
+            date=pd.Timestamp("2020-01-01", tz="UTC") + pd.Timedelta(days=day)))
+
+    assert len(store.parts("Tokyo")) == 1
+    assert store.read("Tokyo")["value"].tolist() == list(range(store.MAX_PARTS + 1))
+    assert store.metadata("Tokyo")["row_count"] == store.MAX_PARTS + 1
+
+
+def test_parquet_reads_and_appends_to_a_single_file_table(tmp_path):
+    store = ParquetCityStore(str(tmp_path))
+    daily_rows("2020-01-01", 5).to_parquet(store.path("Tokyo"), index=False)
+
+    assert store.read("Tokyo", start=3)["value"].tolist() == [3.0, 4.0]
+    store.append("Tokyo", daily_rows("2020-01-06", 2, first_value=5))
+
+    assert os.path.isdir(store.path("Tokyo"))
+    assert store.read("Tokyo")["value"].tolist() == list(range(7))
+    assert store.metadata("Tokyo")["row_count"] == 7
+
+
+def test_parquet_read_past_the_end_keeps_the_columns(tmp_path):
+    store = ParquetCityStore(str(tmp_path))
+    store.write("Tokyo", daily_rows("2020-01-01", 5))
+
+    df = store.read("Tokyo", columns=["value"], start=5)
+    assert len(df) == 0
+    assert list(df.columns) == ["value"]
+
+
+def test_parquet_rewrites_publish_through_the_manifest(tmp_path):
+    store = ParquetCityStore(str(tmp_path))
+    store.write("Tokyo", daily_rows("2020-01-01", 5))
+    store.append("Tokyo", daily_rows("2020-01-06", 2, first_value=5))
+    os.makedirs(store.path("Tokyo") + ".old")
+
+    store.write("Tokyo", daily_rows("2021-01-01", 3, first_value=100))
+
+    assert not os.path.exists(store.path("Tokyo") + ".old")
+    assert sorted(os.listdir(store.path("Tokyo"))) == ["manifest.json", "part-00002.parquet"]
+    assert store.read("Tokyo")["value"].tolist() == [100.0, 101.0, 102.0]
+
+
+def test_parquet_readers_never_see_a_missing_table(tmp_path):
+    store = ParquetCityStore(str(tmp_path))
+    store.write("Tokyo", daily_rows("2020-01-01", 50))
+    done = threading.Event()
+    errors = []
+
+    def read_continuously():
+        while not done.is_set():
+            try:
+                assert len(store.read("Tokyo", columns=["value"])) in (50, 53)
+            except Exception as e:
+                errors.append(e)
+
+    reader = threading.Thread(target=read_continuously)
+    reader.start()
+    try:
+        for _ in range(30):
+            store.write("Tokyo", daily_rows("2020-01-01", 50))
+            store.append("Tokyo", daily_rows("2020-02-20", 3, first_value=50))
+    finally:
+        done.set()
+        reader.join()
+    assert errors == []
+
+
+def test_parquet_directory_without_parts_reads_empty(tmp_path):
+    store = ParquetCityStore(str(tmp_path))
+    os.makedirs(store.path("Tokyo"))
+
+    df = store.read("Tokyo", columns=["date", "value"])
+    assert len(df) == 0
+    assert list(df.columns) == ["date", "value"]
@@ -1,74 +1,237 @@
+import hashlib
+import json
+import math
+import multiprocessing
 import os.path
+import sys
 import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 import lightgbm as lgb
+import numpy as np
 import pandas as pd
 from tqdm import tqdm
-from sklearn.metrics import mean_absolute_error
 from sklearn.model_selection import ParameterSampler
 
-from data_processing import build_final_dataset
+from data_processing import build_training_matrix
+from model import TRAINING_CORE_BUDGET, load_training_dataset, model_feature_columns, training_data_fingerprint
 
 
-# Load data
-df = build_final_dataset(os.path.join("data", "processed_cities"))
-df.dropna(subset=['label'], inplace=True)
-
-dropped_columns = ["date", "label", "date_label", "year", "GDD", "day_of_year", "current_year"]
-
-
-df['year'] = df['date'].dt.year
-train = df[df['year'] < 2013]
-val = df[df['year'] >= 2015]
-
-X_train = train.drop(columns=dropped_columns)
-y_train = train["label"]
-
-X_val = val.drop(columns=dropped_columns)
-y_val = val["label"]
-
-# Extensive hyperparameter grid
+# Extensive hyperparameter grid, the number of boosting rounds is the budget of successive halving
 param_grid = {
-    'n_estimators': [100, 250, 400],
     'max_depth': [-1, 3, 4],
     'learning_rate': [0.01, 0.05, 0.1],
     'min_child_weight': [0.001, 0.01, 0.1, 1.0, 5.0, 10.0],
     'colsample_bytree': [0.1, 0.2, 0.3, 0.5, 0.7],
     'num_leaves': [30, 45, 60]
 }
-
-grid = list(ParameterSampler(param_grid, 500))
-print(f"Total hyperparameter combinations: {len(grid)}")
-
-# For tracking best model
-best_score = float('inf')
-best_params = None
-results = []
-
-start_time = time.time()
-
-for i, params in enumerate(tqdm(grid, desc="Tuning... ")):
-    model = lgb.LGBMRegressor(objective='quantile', alpha=0.5, random_state=42, verbosity=-1, **params)
-    model.fit(X_train, y_train, callbacks=[lgb.log_evaluation(period=0)])
-
-    preds = model.predict(X_val)
-    mae = mean_absolute_error(y_val, preds)
-
-    results.append({**params, 'val_mae': mae})
-
-    if mae < best_score:
-        best_score = mae
-        best_params = params
-
-    if (i + 1) % 50 == 0 or i == 0:
-        elapsed = time.time() - start_time
-        print(f"[{i + 1}/{len(grid)}] Current best MAE: {best_score:.4f} | Elapsed: {elapsed / 60:.2f} min")
-
-# Save results as DataFrame for inspection
-results_df = pd.DataFrame(results).sort_values(by='val_mae')
-print("\nTop 15 parameter sets:")
-with pd.option_context('display.max_columns', None, 'display.max_colwidth', None, 'display.expand_frame_repr',False):
-    print(results_df.head(15))
-
-print("\nBest hyperparameters found:")
-print(best_params)
+N_CONFIGS = 500
+
+# Successive halving: every config gets the first budget, the best third of them moves on to the next one
+ROUND_BUDGETS = [50, 150, 400]
+HALVING_RATE = 3
+EARLY_STOPPING_ROUNDS = 20
+
+# Time-series folds: each trains on the years before its cutoff and validates on the years from cutoff + gap up to the
+# next fold's validation years, the last fold validates on every later year
+FOLD_CUTOFFS = [2009, 2011, 2013]
+VALIDATION_GAP_YEARS = 2
+
+TRIAL_PARAMS = {'objective': 'quantile', 'alpha': 0.5, 'metric': 'l1', 'seed': 42, 'verbosity': -1}
+
+TUNING_WORKERS = int(os.getenv("TUNING_WORKERS", TRAINING_CORE_BUDGET))
+
+
+def search_key(data_fingerprint: str):
+    """
+    :return: Key of a search, runs with the same settings on the same training data resume each other
+    """
+    key = [param_grid, N_CONFIGS, ROUND_BUDGETS, HALVING_RATE, EARLY_STOPPING_ROUNDS, FOLD_CUTOFFS,
+           VALIDATION_GAP_YEARS, TRIAL_PARAMS, data_fingerprint]
+    return hashlib.sha1(json.dumps(key).encode("utf-8")).hexdigest()[:16]
+
+
+def build_folds(processed_cities_directory: str, folds_directory: str):
+    """
+    Writes the training row indices and the validation matrix of every fold once, for all trial workers to map.
+    :return: Number of folds
+    """
+    done_path = os.path.join(folds_directory, "folds.json")
+    if os.path.exists(done_path):
+        with open(done_path, "r") as f:
+            return json.load(f)["folds"]
+
+    # Same feature columns and row order as the cached training Dataset
+    X, y = build_training_matrix(processed_cities_directory, model_feature_columns(processed_cities_directory))
+    years = build_training_matrix(processed_cities_directory, ["current_year"], dtype=np.int32)[0]["current_year"]
+    years = years.to_numpy()
+
+    os.makedirs(folds_directory, exist_ok=True)
+    folds = 0
+    for i, cutoff in enumerate(FOLD_CUTOFFS):
+        validation_start = cutoff + VALIDATION_GAP_YEARS
+        validation_end = FOLD_CUTOFFS[i + 1] + VALIDATION_GAP_YEARS if i + 1 < len(FOLD_CUTOFFS) else np.inf
+        train_rows = np.flatnonzero(years < cutoff)
+        validation_rows = (years >= validation_start) & (years < validation_end)
+        if len(train_rows) == 0 or not validation_rows.any():
+            print(f"Skipping fold with cutoff {cutoff}, it has no training or validation rows")
+            continue
+
+        np.save(os.path.join(folds_directory, f"fold{folds}_train_rows.npy"), train_rows.astype(np.int32))
+        np.save(os.path.join(folds_directory, f"fold{folds}_X_val.npy"), X.to_numpy()[validation_rows])
+        np.save(os.path.join(folds_directory, f"fold{folds}_y_val.npy"), y.to_numpy()[validation_rows])
+        print(f"Fold {folds}: {len(train_rows)} training rows before {cutoff}, "
+              f"{validation_rows.sum()} validation rows from {validation_start}")
+        folds += 1
+
+    with open(done_path, "w") as f:
+        json.dump({"folds": folds}, f)
+    return folds
+
+
+def load_trials(trials_path: str):
+    """
+    :return: {(trial, rounds): result} of the trials checkpointed so far
+    """
+    results = {}
+    if not os.path.exists(trials_path):
+        return results
+    with open(trials_path, "r") as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except json.JSONDecodeError:
+                # Line cut off by a crash, the trial runs again
+                continue
+            results[(result["trial"], result["rounds"])] = result
+    return results
+
+
+def save_trial(trials_file, result: dict):
+    trials_file.write(json.dumps(result) + "\n")
+    trials_file.flush()
+    os.fsync(trials_file.fileno())
+
+
+_worker_folds = None
+_worker_threads = 1
+
+
+def _init_trial_worker(processed_cities_directory: str, folds_directory: str, folds: int, threads: int):
+    global _worker_folds, _worker_threads
+    # Every fold trains on a subset of the cached Dataset and keeps its bins, the validation rows are mapped
+    full_set = load_training_dataset(processed_cities_directory)
+    _worker_folds = []
+    for i in range(folds):
+        train_rows = np.load(os.path.join(folds_directory, f"fold{i}_train_rows.npy"))
+        X_val = np.load(os.path.join(folds_directory, f"fold{i}_X_val.npy"), mmap_mode="r")
+        y_val = np.load(os.path.join(folds_directory, f"fold{i}_y_val.npy"), mmap_mode="r")
+        train_set = full_set.subset(train_rows).construct()
+        val_set = lgb.Dataset(X_val, y_val, reference=train_set).construct()
+        _worker_folds.append((train_set, val_set))
+    _worker_threads = threads
+
+
+def _run_trial(trial: int, params: dict, rounds: int):
+    """
+    Trains the config on every fold with early stopping on the validation MAE.
+    """
+    start = time.perf_counter()
+    fold_mae, best_iterations, stopped_early = [], [], True
+    for train_set, val_set in _worker_folds:
+        model = lgb.train({**TRIAL_PARAMS, **params, 'num_threads': _worker_threads}, train_set,
+                          num_boost_round=rounds, valid_sets=[val_set],
+                          callbacks=[lgb.early_stopping(EARLY_STOPPING_ROUNDS, verbose=False)])
+        fold_mae.append(float(model.best_score['valid_0']['l1']))
+        best_iterations.append(model.best_iteration)
+        # Early stopping ends training once the best iteration is EARLY_STOPPING_ROUNDS behind
+        stopped_early = stopped_early and model.best_iteration + EARLY_STOPPING_ROUNDS <= rounds
+
+    return {'trial': trial, 'rounds': rounds, 'params': params, 'val_mae': float(np.mean(fold_mae)),
+            'fold_mae': fold_mae, 'best_iterations': best_iterations, 'stopped_early': stopped_early,
+            'seconds': round(time.perf_counter() - start, 2)}
+
+
+def tune(processed_cities_directory: str, tuning_directory: str, workers: int = TUNING_WORKERS):
+    """
+    Searches the hyperparameters of the median model with successive halving over ROUND_BUDGETS, running trials in a
+    process pool. Every trial result is appended to a JSONL checkpoint, so an interrupted search resumes where it
+    stopped.
+    :return: Results of the last budget every config reached, best first
+    """
+    # Builds the cached training Dataset the trial workers load
+    X, y = build_training_matrix(processed_cities_directory, model_feature_columns(processed_cities_directory))
+    load_training_dataset(processed_cities_directory, training_matrix=(X, y))
+    data_fingerprint = training_data_fingerprint(X, y)
+    del X, y
+    key = search_key(data_fingerprint)
+    fold_key = hashlib.sha1(json.dumps([FOLD_CUTOFFS, VALIDATION_GAP_YEARS, data_fingerprint]).encode("utf-8"))
+    folds_directory = os.path.join(tuning_directory, f"folds_{fold_key.hexdigest()[:16]}")
+    trials_path = os.path.join(tuning_directory, f"trials_{key}.jsonl")
+
+    folds = build_folds(processed_cities_directory, folds_directory)
+    configs = list(ParameterSampler(param_grid, N_CONFIGS, random_state=42))
+    print(f"Total hyperparameter combinations: {len(configs)}, {folds} folds")
+
+    results = load_trials(trials_path)
+    if results:
+        print(f"Resuming from {len(results)} checkpointed trials in {trials_path}")
+
+    workers = max(1, workers)
+    threads = max(1, TRAINING_CORE_BUDGET // workers)
+    latest = {}
+    survivors = list(range(len(configs)))
+    start_time = time.time()
+    with open(trials_path, "a") as trials_file, \
+            ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                                initializer=_init_trial_worker,
+                                initargs=(processed_cities_directory, folds_directory, folds, threads)) as executor:
+        for rung, rounds in enumerate(ROUND_BUDGETS):
+            pending = []
+            for trial in survivors:
+                previous = latest.get(trial)
+                if (trial, rounds) in results:
+                    continue
+                if previous is not None and previous['stopped_early']:
+                    # Early stopping ended every fold before the smaller budget, more rounds give the same models
+                    results[(trial, rounds)] = {**previous, 'rounds': rounds, 'seconds': 0.0}
+                    save_trial(trials_file, results[(trial, rounds)])
+                    continue
+                pending.append(trial)
+
+            futures = [executor.submit(_run_trial, trial, configs[trial], rounds) for trial in pending]
+            for future in tqdm(as_completed(futures), total=len(futures),
+                               desc=f"Tuning {len(survivors)} configs with {rounds} rounds"):
+                result = future.result()
+                results[(result['trial'], rounds)] = result
+                save_trial(trials_file, result)
+
+            for trial in survivors:
+                latest[trial] = results[(trial, rounds)]
+            survivors.sort(key=lambda t: latest[t]['val_mae'])
+            best = latest[survivors[0]]
+            elapsed = time.time() - start_time
+            print(f"[{rounds} rounds] Best MAE: {best['val_mae']:.4f} | Elapsed: {elapsed / 60:.2f} min")
+
+            if rung + 1 < len(ROUND_BUDGETS):
+                survivors = survivors[:max(1, math.ceil(len(survivors) / HALVING_RATE))]
+
+    return sorted(latest.values(), key=lambda result: (-result['rounds'], result['val_mae']))
+
+
+if __name__ == "__main__":
+    # python tuning.py [data directory]
+    data_dir = sys.argv[1] if len(sys.argv) > 1 else "data"
+    trial_results = tune(os.path.join(data_dir, "processed_cities"), os.path.join(data_dir, "tuning"))
+
+    results_df = pd.DataFrame([{**result['params'], 'rounds': result['rounds'], 'val_mae': result['val_mae'],
+                                'best_iteration': int(np.mean(result['best_iterations']))}
+                               for result in trial_results])
+    print("\nTop 15 parameter sets:")
+    with pd.option_context('display.max_columns', None, 'display.max_colwidth', None, 'display.expand_frame_repr',
+                           False):
+        print(results_df.head(15))
+
+    best = trial_results[0]
+    print("\nBest hyperparameters found:")
+    print({**best['params'], 'n_estimators': int(np.mean(best['best_iterations']))})
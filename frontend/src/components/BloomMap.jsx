@@ -18,7 +18,8 @@ import {
   colormaps,
   getHeatmapColor,
   getDateFromDayOfYear,
-  formatDateString
+  formatDateString,
+  getHeatmapPoints
 } from '../utils/heatmapUtils';
 import ColorBar from "./ColorBar";
 import BambooSlider from "./BambooSlider";
@@ -72,9 +73,11 @@ function MouseCoordinates({ setMouseLatLng }) {
 
 
 function BloomMap({ SELECTED_MAP_LAYER = "GSI_en", DEFAULT_MIN_DAY_OF_YEAR = 1, DEFAULT_MAX_DAY_OF_YEAR = 160, language="en"}) {
+  const FIRST_YEAR = 1953;
   const CURRENT_YEAR = new Date().getMonth() < 5 ? new Date().getFullYear() : new Date().getFullYear() + 1;
 
   const [year, setYear] = useState(CURRENT_YEAR);
+  const [heatmapRange, setHeatmapRange] = useState(null);
   const [points, setPoints] = useState([]);
   const [minDayOfYear, setMinDayOfYear] = useState(DEFAULT_MIN_DAY_OF_YEAR);
   const [maxDayOfYear, setMaxDayOfYear] = useState(DEFAULT_MAX_DAY_OF_YEAR);
@@ -87,31 +90,37 @@ function BloomMap({ SELECTED_MAP_LAYER = "GSI_en", DEFAULT_MIN_DAY_OF_YEAR = 1,
   const [predictions, setPredictions] = useState(null);
 
 
+  // Every year of the slider in one request, moving the slider doesn't fetch again
   useEffect(() => {
     const fetchHeatmapData = async () => {
-      console.log(`Fetching data for year ${year}...`);
+      console.log(`Fetching data for years ${FIRST_YEAR}-${CURRENT_YEAR}...`);
 
       try {
-        const response = await api.get(`/heatmap?year=${year}`);
-        const fetchedPoints = response.data || [];
-        setPoints(fetchedPoints);
-        console.log("Fetched Points:", fetchedPoints)
-
-        if (fetchedPoints.length > 0) {
-            const values = fetchedPoints.map(p => p.value);
-            setMinDayOfYear(Math.min(...values));
-            setMaxDayOfYear(Math.max(...values));
-
-            const preds = fetchedPoints.map(p => p.is_prediction);
-            setContainsPredictions(preds.some(Boolean));
-        }
+        const response = await api.get(`/heatmap/range?start=${FIRST_YEAR}&end=${CURRENT_YEAR}`);
+        setHeatmapRange(response.data);
+        console.log("Fetched Heatmap Range:", response.data)
       } catch (error) {
         console.error("Error fetching heatmap data:", error);
       }
     };
 
     fetchHeatmapData();
-  }, [year]);
+  }, [CURRENT_YEAR]);
+
+
+  useEffect(() => {
+    const yearPoints = getHeatmapPoints(heatmapRange, year);
+    setPoints(yearPoints);
+
+    if (yearPoints.length > 0) {
+        const values = yearPoints.map(p => p.value);
+        setMinDayOfYear(Math.min(...values));
+        setMaxDayOfYear(Math.max(...values));
+
+        const preds = yearPoints.map(p => p.is_prediction);
+        setContainsPredictions(preds.some(Boolean));
+    }
+  }, [heatmapRange, year]);
 
 
   useEffect(() => {
@@ -157,7 +166,7 @@ function BloomMap({ SELECTED_MAP_LAYER = "GSI_en", DEFAULT_MIN_DAY_OF_YEAR = 1,
       alignItems: 'center',
     }}>
       <BambooSlider
-        min={1953}
+        min={FIRST_YEAR}
         max={CURRENT_YEAR}
         value={year}
         onChange={(e) => setYear(Number(e.target.value))}
@@ -56,3 +56,24 @@ export function formatDateString(date, language = "en", includeYear = false) {
   const locale = language === "en" ? "en-US" : "ja-JP";
   return date.toLocaleDateString(locale, options);
 }
+
+// Points of one year of a /heatmap/range response, shaped like the /heatmap points
+export function getHeatmapPoints(heatmapRange, year) {
+  const heatmapYear = heatmapRange?.years.find(y => y.year === year);
+  if (!heatmapYear) return [];
+
+  const { names, jp, lat, lng } = heatmapRange.cities;
+  const points = [];
+  heatmapYear.values.forEach((value, i) => {
+    if (value === null) return;
+    points.push({
+      city: names[i],
+      city_jp: jp[i],
+      lat: lat[i],
+      lng: lng[i],
+      value,
+      is_prediction: heatmapYear.is_prediction[i]
+    });
+  });
+  return points;
+}